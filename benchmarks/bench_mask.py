@@ -0,0 +1,279 @@
+"""Benchmarks of the mask hook.
+
+Every case generates a synthetic repo and times, in a fresh process:
+- MaskGitHook.mask (the staged files are masked),
+- MaskGitHook.reverse_mask (all the masked files are unmasked),
+- 'git-hooks exec mask' end to end (a new interpreter, like the pre-commit hook).
+
+The results (seconds, MB/s, files/s and peak RSS) are printed and saved as JSON,
+so two versions can be compared with '--compare'.
+
+    python benchmarks/bench_mask.py --output results.json
+    python benchmarks/bench_mask.py --quick --compare results.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import pathlib
+import platform
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = pathlib.Path(__file__).resolve().parents[1]
+
+# files: number of files, size: bytes per file, secrets: secrets in mask.config,
+# density: secrets written per MB of content.
+CASES = [
+    {"name": "few-small", "files": 10, "size": 4 * 1024, "secrets": 10, "density": 100},
+    {
+        "name": "many-small",
+        "files": 2000,
+        "size": 4 * 1024,
+        "secrets": 10,
+        "density": 100,
+    },
+    {
+        "name": "many-clean",
+        "files": 2000,
+        "size": 4 * 1024,
+        "secrets": 10,
+        "density": 0,
+    },
+    {
+        "name": "large-files",
+        "files": 10,
+        "size": 8 * 1024 * 1024,
+        "secrets": 10,
+        "density": 10,
+    },
+    {
+        "name": "many-secrets",
+        "files": 100,
+        "size": 64 * 1024,
+        "secrets": 2000,
+        "density": 100,
+    },
+    {
+        "name": "dense",
+        "files": 100,
+        "size": 64 * 1024,
+        "secrets": 100,
+        "density": 10000,
+    },
+]
+QUICK_CASES = ["few-small", "many-clean", "dense"]
+
+
+def git(repo: pathlib.Path, *args: str) -> None:
+    subprocess.run(
+        ["git", "-c", "user.name=bench", "-c", "user.email=bench@localhost", *args],
+        cwd=repo,
+        check=True,
+        capture_output=True,
+    )
+
+
+def generate_repo(repo: pathlib.Path, case: dict, seed: int) -> int:
+    """Writes mask.config and the files of the case. Returns the total size."""
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits
+    secrets = [
+        "".join(rng.choices(alphabet, k=rng.randint(16, 40)))
+        for _ in range(case["secrets"])
+    ]
+    with (repo / "mask.config").open(mode="w") as f:
+        f.write("[show]\n")
+        for secret in secrets:
+            f.write(f"{secret} = 4\n")
+    (repo / ".gitignore").write_text("_unmasked_*\n/mask.config\n")
+
+    words = ["".join(rng.choices(string.ascii_lowercase, k=6)) for _ in range(512)]
+    line_size = 80
+    lines_per_file = max(1, case["size"] // line_size)
+    # Probability that a line contains a secret.
+    secret_rate = case["density"] * line_size / (1024 * 1024)
+    total = 0
+    for idx in range(case["files"]):
+        lines = []
+        for _ in range(lines_per_file):
+            line = " ".join(rng.choices(words, k=line_size // 7))
+            if secret_rate and rng.random() < secret_rate:
+                line = line[: line_size // 2] + rng.choice(secrets)
+            lines.append(line[: line_size - 1])
+        content = "\n".join(lines) + "\n"
+        file = repo / f"dir{idx % 20}" / f"file{idx}.txt"
+        file.parent.mkdir(exist_ok=True)
+        file.write_text(content)
+        total += len(content)
+    return total
+
+
+def peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows.
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB on Linux.
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def throughput(seconds: float, size: int, files: int) -> dict:
+    return {
+        "seconds": round(seconds, 4),
+        "mb_per_s": round(size / (1024 * 1024) / seconds, 2) if seconds else None,
+        "files_per_s": round(files / seconds, 1) if seconds else None,
+    }
+
+
+def run_case(case: dict, seed: int) -> dict:
+    """Runs one case (in its own process, so the peak RSS is its own)."""
+    sys.path.insert(0, str(ROOT_DIR))
+    from githooks.hooks.mask import MaskGitHook
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        repo = pathlib.Path(tmp_dir)
+        git(repo, "init", "-q")
+        size = generate_repo(repo, case, seed)
+        git(repo, "add", ".")
+        results = {"size": size}
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            MaskGitHook(repo).mask()
+        results["mask"] = throughput(time.perf_counter() - start, size, case["files"])
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                MaskGitHook(repo).reverse_mask("")
+                results["reverse_mask"] = throughput(
+                    time.perf_counter() - start, size, case["files"]
+                )
+            except SystemExit:
+                # Nothing was masked (a case without secrets), there's no timing.
+                results["reverse_mask"] = None
+        results["peak_rss_mb"] = peak_rss_mb()
+
+        # End to end, from the same (unmasked) files and without any cache.
+        shutil.rmtree(repo / ".git" / "githooks")
+        for backup in repo.glob("**/_unmasked_*"):
+            backup.unlink()
+        git(repo, "add", ".")
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [str(ROOT_DIR), *filter(None, [env.get("PYTHONPATH")])]
+        )
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "githooks.scripts.git_hooks", "exec", "mask"],
+            cwd=repo,
+            env=env,
+            check=True,
+            capture_output=True,
+        )
+        results["cli"] = throughput(time.perf_counter() - start, size, case["files"])
+    return results
+
+
+def compare(results: dict, baseline: dict) -> None:
+    previous = {case["name"]: case for case in baseline["cases"]}
+    print(f"\nCompared to {baseline['version']} ({baseline['date']}):")
+    for case in results["cases"]:
+        if case["name"] not in previous:
+            continue
+        for phase in ["mask", "reverse_mask", "cli"]:
+            if (
+                not previous[case["name"]]["results"][phase]
+                or not case["results"][phase]
+            ):
+                print(f"  {case['name']:<14}{phase:<14}{'n/a':>10}")
+                continue
+            old = previous[case["name"]]["results"][phase]["seconds"]
+            new = case["results"][phase]["seconds"]
+            ratio = old / new if new else float("inf")
+            print(
+                f"  {case['name']:<14}{phase:<14}{old:>9.3f}s -> {new:>9.3f}s  x{ratio:.2f}"
+            )
+
+
+def version() -> str:
+    result = subprocess.run(
+        ["git", "describe", "--always", "--dirty"],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    return result.stdout.strip() or "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks of the mask hook.")
+    parser.add_argument("--output", type=pathlib.Path, help="Save the results as JSON.")
+    parser.add_argument("--compare", type=pathlib.Path, help="Previous JSON results.")
+    parser.add_argument("--quick", action="store_true", help="Run a few small cases.")
+    parser.add_argument("--case", action="append", help="Run only the named cases.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case), args.seed)))
+        return
+
+    names = args.case or (QUICK_CASES if args.quick else [c["name"] for c in CASES])
+    results = {
+        "version": version(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "git": subprocess.run(
+            ["git", "--version"], capture_output=True, text=True
+        ).stdout.strip(),
+        "seed": args.seed,
+        "cases": [],
+    }
+    header = f"{'case':<14}{'phase':<14}{'seconds':>9}{'MB/s':>10}{'files/s':>10}"
+    print(header + f"{'peak RSS MB':>13}")
+    for case in CASES:
+        if case["name"] not in names:
+            continue
+        output = subprocess.run(
+            [sys.executable, __file__, "--run-case", json.dumps(case)]
+            + ["--seed", str(args.seed)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        case_results = json.loads(output.splitlines()[-1])
+        results["cases"].append({**case, "results": case_results})
+        for phase in ["mask", "reverse_mask", "cli"]:
+            timing = case_results[phase]
+            if timing is None:
+                print(f"{case['name']:<14}{phase:<14}{'n/a':>9}")
+                continue
+            rss = case_results["peak_rss_mb"] if phase != "cli" else None
+            print(
+                f"{case['name']:<14}{phase:<14}{timing['seconds']:>9.3f}"
+                f"{timing['mb_per_s'] or 0:>10.1f}{timing['files_per_s'] or 0:>10.1f}"
+                + (f"{rss:>13.1f}" if rss is not None else "")
+            )
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+        print(f"\nResults saved to {args.output}")
+    if args.compare:
+        compare(results, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
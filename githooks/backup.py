@@ -0,0 +1,117 @@
+import hashlib
+import os
+import pathlib
+import shutil
+import tempfile
+
+# ioctl request of Linux to clone a file (share its blocks copy-on-write).
+FICLONE = 0x40049409
+CHUNK_SIZE = 1024 * 1024
+
+
+def _temp_path(target: pathlib.Path) -> pathlib.Path:
+    return target.with_name(f".{target.name}.{os.getpid()}.tmp")
+
+
+def clone_file(source: pathlib.Path, target: pathlib.Path) -> bool:
+    """Clones the file with a reflink. Returns False if it isn't supported."""
+    try:
+        import fcntl
+    except ImportError:
+        # Not available on Windows.
+        return False
+    tmp = _temp_path(target)
+    try:
+        with source.open(mode="rb") as src, tmp.open(mode="wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(source, tmp)
+        os.replace(tmp, target)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+        return False
+    return True
+
+
+def link_file(source: pathlib.Path, target: pathlib.Path) -> bool:
+    """Hard links the file. Returns False if it isn't supported.
+
+    This is only a backup as long as the source is replaced (renamed over) and
+    never written in place.
+    """
+    tmp = _temp_path(target)
+    try:
+        os.link(source, tmp)
+        os.replace(tmp, target)
+    except OSError:
+        tmp.unlink(missing_ok=True)
+        return False
+    return True
+
+
+def write_atomic(file: pathlib.Path, content: bytes) -> None:
+    """Replaces the content of the file, which is never left half written."""
+    with tempfile.NamedTemporaryFile(
+        mode="wb", dir=file.parent, delete=False
+    ) as target:
+        try:
+            target.write(content)
+            target.flush()
+            os.fsync(target.fileno())
+        except BaseException:
+            target.close()
+            os.unlink(target.name)
+            raise
+    shutil.copymode(file, target.name)
+    os.replace(target.name, file)
+
+
+class BackupStore:
+    """Content addressed copies of files, deduplicated by their sha256.
+
+    A file is stored in '<sha[:2]>/<sha[2:]>'. It's cloned or hard linked into the
+    store when possible, so it doesn't take more space than the original.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+
+    def add(self, file: pathlib.Path) -> str:
+        """Stores the file and returns its sha256."""
+        digest = hashlib.sha256()
+        with file.open(mode="rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        sha = digest.hexdigest()
+        target = self.path / sha[:2] / sha[2:]
+        if target.exists():
+            return sha
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if not (clone_file(file, target) or link_file(file, target)):
+            tmp = _temp_path(target)
+            shutil.copy2(file, tmp)
+            os.replace(tmp, target)
+        return sha
+
+    def get(self, sha: str) -> pathlib.Path:
+        return self.path / sha[:2] / sha[2:]
+
+    def restore(self, sha: str, target: pathlib.Path) -> None:
+        """Replaces the target with a copy of the stored file.
+
+        The copy is a reflink or a full copy, never a hard link, so writing to the
+        target doesn't change the stored file.
+        """
+        source = self.get(sha)
+        if not clone_file(source, target):
+            tmp = _temp_path(target)
+            shutil.copy2(source, tmp)
+            os.replace(tmp, target)
+
+    def remove(self, sha: str) -> None:
+        file = self.get(sha)
+        file.unlink(missing_ok=True)
+        try:
+            file.parent.rmdir()
+        except OSError:
+            # Other files are stored in the same directory.
+            pass
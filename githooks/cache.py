@@ -0,0 +1,186 @@
+import hashlib
+import hmac
+import json
+import os
+import pathlib
+import pickle
+import time
+from typing import Any, Iterable, Optional
+
+from . import __version__
+
+CLEAN = 0
+NEEDS_MASKING = 1
+# Bumped when the data kept in the config cache changes.
+CONFIG_CACHE_FORMAT = 1
+
+
+class ScanCache:
+    """Persistent scan results keyed by blob sha and the mask.config fingerprint.
+
+    The results are kept in a SQLite database, so a lookup only touches the
+    staged blobs and not the whole cache. The least recently used entries are
+    evicted when the cache grows over 'max_entries'.
+    """
+
+    def __init__(
+        self, path: pathlib.Path, fingerprint: str, max_entries: int = 100000
+    ) -> None:
+        import sqlite3
+
+        self.max_entries = max_entries
+        # Used by one thread at a time, not always the one that opened it (the
+        # pipeline records the results from the threads that mask the files).
+        self.connection = sqlite3.connect(
+            str(path), timeout=10, check_same_thread=False
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS scans "
+            "(key TEXT PRIMARY KEY, result INTEGER, last_used INTEGER) WITHOUT ROWID"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS scans_last_used ON scans (last_used)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)"
+        )
+        inserted = self.connection.execute(
+            "INSERT OR IGNORE INTO meta VALUES ('salt', ?)", (os.urandom(16).hex(),)
+        ).rowcount
+        if inserted:
+            # Rows of older versions, keyed with the unsalted fingerprint.
+            self.connection.execute("DELETE FROM scans")
+        self.connection.commit()
+        salt = self.connection.execute(
+            "SELECT value FROM meta WHERE name = 'salt'"
+        ).fetchone()[0]
+        # The rendered config holds the secrets, so its fingerprint is salted (the
+        # salt is random per cache).
+        self.prefix = hmac.new(
+            bytes.fromhex(salt), fingerprint.encode("ascii"), hashlib.sha256
+        ).hexdigest()[:16]
+
+    def __enter__(self) -> "ScanCache":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __key(self, sha: str) -> str:
+        return self.prefix + sha
+
+    def lookup(self, shas: Iterable[str]) -> dict[str, int]:
+        """Returns the cached results of the passed blobs and marks them as used."""
+        keys = [self.__key(sha) for sha in set(shas)]
+        results = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT key, result FROM scans WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            for key, result in rows:
+                results[key[len(self.prefix) :]] = result
+        if results:
+            now = int(time.time())
+            self.connection.executemany(
+                "UPDATE scans SET last_used = ? WHERE key = ?",
+                [(now, self.__key(sha)) for sha in results],
+            )
+        return results
+
+    def store(self, sha: str, result: int) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO scans VALUES (?, ?, ?)",
+            (self.__key(sha), result, int(time.time())),
+        )
+
+    def flush(self) -> None:
+        """Evicts the least recently used entries and writes the results."""
+        count = self.connection.execute("SELECT COUNT(*) FROM scans").fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM scans WHERE key IN "
+                "(SELECT key FROM scans ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.flush()
+        self.connection.close()
+
+
+class ConfigCache:
+    """Encrypted cache of the rendered and parsed mask.config.
+
+    The cache is keyed by the hash of mask.config and the values of the env.
+    variables it references. Those values are also the key material used to
+    encrypt and authenticate the cached data, so the secrets are never written
+    in plaintext and a change of any env. variable invalidates the cache. A cache
+    written by another version of git-hooks is ignored.
+    """
+
+    version = f"{__version__}/{CONFIG_CACHE_FORMAT}"
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+
+    @staticmethod
+    def __master_key(config_hash: str, variables: list[str]) -> bytes:
+        material = [config_hash.encode("ascii")]
+        for var in variables:
+            value = os.environ.get(var)
+            material.append(
+                var.encode("utf8") + (b"=" + value.encode("utf8") if value else b"")
+            )
+        return hashlib.sha256(b"\0".join(material)).digest()
+
+    @staticmethod
+    def __keystream(key: bytes, nonce: bytes, size: int) -> bytes:
+        return hashlib.shake_256(b"encrypt" + key + nonce).digest(size)
+
+    @staticmethod
+    def __xor(data: bytes, keystream: bytes) -> bytes:
+        return (
+            int.from_bytes(data, "big") ^ int.from_bytes(keystream, "big")
+        ).to_bytes(len(data), "big")
+
+    def load(self, config: bytes) -> Optional[Any]:
+        config_hash = hashlib.sha256(config).hexdigest()
+        try:
+            header, payload = self.path.read_bytes().split(b"\n", 1)
+            header = json.loads(header)
+            if header["version"] != self.version or header["config"] != config_hash:
+                return None
+            key = self.__master_key(config_hash, header["variables"])
+            nonce = bytes.fromhex(header["nonce"])
+            mac = hmac.new(key, b"authenticate" + nonce + payload, "sha256")
+            if not hmac.compare_digest(mac.hexdigest(), header["mac"]):
+                # An env. variable changed (or the file was tampered with).
+                return None
+            return pickle.loads(
+                self.__xor(payload, self.__keystream(key, nonce, len(payload)))
+            )
+        except Exception:
+            # A corrupted cache, or one that can't be unpickled, is a miss.
+            return None
+
+    def store(self, config: bytes, variables: list[str], value: Any) -> None:
+        config_hash = hashlib.sha256(config).hexdigest()
+        key = self.__master_key(config_hash, variables)
+        nonce = os.urandom(16)
+        data = pickle.dumps(value)
+        payload = self.__xor(data, self.__keystream(key, nonce, len(data)))
+        header = {
+            "version": self.version,
+            "config": config_hash,
+            "variables": variables,
+            "nonce": nonce.hex(),
+            "mac": hmac.new(
+                key, b"authenticate" + nonce + payload, "sha256"
+            ).hexdigest(),
+        }
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_bytes(json.dumps(header).encode("utf8") + b"\n" + payload)
+        os.replace(tmp_path, self.path)
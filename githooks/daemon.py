@@ -0,0 +1,206 @@
+import contextlib
+import io
+import json
+import os
+import pathlib
+import socket
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from .git import state_dir
+
+if TYPE_CHECKING:
+    from .hooks.mask import MaskGitHook
+    from .report import TextReport
+
+# Seconds to wait for the daemon to accept a connection (or a client to send its
+# request) before giving up.
+CONNECT_TIMEOUT = 2
+
+
+def socket_path(root_dir: pathlib.Path) -> pathlib.Path:
+    return state_dir(root_dir) / "daemon.sock"
+
+
+def _send(connection: socket.socket, message: dict) -> None:
+    connection.sendall(json.dumps(message).encode("utf8") + b"\n")
+
+
+def _receive(connection: socket.socket) -> Optional[dict]:
+    with connection.makefile(mode="rb") as stream:
+        line = stream.readline()
+    return json.loads(line) if line else None
+
+
+def request(root_dir: pathlib.Path, command: str = "mask") -> Optional[dict]:
+    """Sends a command to the daemon of the repo and returns its response.
+
+    Returns None if the daemon isn't running (or died before answering), so the
+    caller can run the hook in-process instead.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    path = socket_path(root_dir)
+    if not path.exists():
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(CONNECT_TIMEOUT)
+        client.connect(str(path))
+        # Scanning a large changeset can take a while.
+        client.settimeout(None)
+        # The hook runs with the environment of the commit (GIT_INDEX_FILE, the
+        # env. variables referenced by mask.config...).
+        _send(client, {"command": command, "env": dict(os.environ)})
+        return _receive(client)
+    except (OSError, ValueError):
+        return None
+    finally:
+        client.close()
+
+
+@contextlib.contextmanager
+def _environment(env: dict[str, str]) -> Iterator[None]:
+    saved = dict(os.environ)
+    os.environ.clear()
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+class MaskDaemon:
+    """Runs the mask hook of a repo for the pre-commit hook, over a Unix socket.
+
+    The rendered config, the compiled matcher and the scan cache are kept in memory
+    between the commits. They are reloaded when mask.config, the templates it
+    includes or the values of the env. variables it references change. The
+    requests are served one at a time.
+    """
+
+    def __init__(self, root_dir: pathlib.Path, idle_timeout: int = 3600) -> None:
+        """The daemon exits after 'idle_timeout' seconds without requests (0 never)."""
+        self.root_dir = root_dir
+        self.idle_timeout = idle_timeout
+        self.path = socket_path(root_dir)
+        self.hook = None
+        self.loaded = None
+
+    def __config_state(self, files: list[pathlib.Path]) -> list[Optional[tuple]]:
+        states = []
+        for file in files:
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                states.append(None)
+                continue
+            states.append(
+                (stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+            )
+        return states
+
+    def __unload(self) -> None:
+        if self.hook is not None and self.hook.scan_cache is not None:
+            self.hook.scan_cache.close()
+        self.hook = None
+        self.loaded = None
+
+    def __load(self, report: "TextReport") -> "MaskGitHook":
+        from .exceptions import NoConfigurationFileFound
+        from .hooks.mask import MaskGitHook
+
+        if not (self.root_dir / "mask.config").exists():
+            raise NoConfigurationFileFound()
+        if self.hook is not None:
+            config_state = self.__config_state(self.hook.config_files)
+            env = [os.environ.get(var) for var in self.hook.variables]
+            if self.loaded == (config_state, env):
+                self.hook.report = report
+                return self.hook
+            self.__unload()
+        # Stated before the config is read, so a change made while it's loaded is
+        # seen by the next request.
+        config_state = self.__config_state([self.root_dir / "mask.config"])
+        hook = MaskGitHook(self.root_dir, report=report)
+        if hook.cache_size:
+            hook.scan_cache = hook.open_scan_cache()
+        config_state += self.__config_state(hook.config_files[1:])
+        env = [os.environ.get(var) for var in hook.variables]
+        self.hook, self.loaded = hook, (config_state, env)
+        return hook
+
+    def __mask(self, env: dict[str, str]) -> dict:
+        from .exceptions import NoConfigurationFileFound
+        from .report import TextReport
+
+        output = io.StringIO()
+        status = 0
+        with _environment(env), TextReport(output) as report:
+            try:
+                self.__load(report).mask()
+            except NoConfigurationFileFound as e:
+                output.write(f"{e}\n")
+                status = 1
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else 1
+        return {"status": status, "output": output.getvalue()}
+
+    def __listen(self) -> socket.socket:
+        from .exceptions import DaemonAlreadyRunning
+
+        if self.path.exists():
+            if request(self.root_dir, "ping") is not None:
+                raise DaemonAlreadyRunning(path=self.path)
+            # Left by a daemon that didn't exit cleanly.
+            self.path.unlink()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the owner of the repo can send requests.
+        umask = os.umask(0o077)
+        try:
+            server.bind(str(self.path))
+        finally:
+            os.umask(umask)
+        server.listen(8)
+        server.settimeout(self.idle_timeout or None)
+        return server
+
+    def serve(self) -> None:
+        from .utils import PrettyOutput
+
+        server = self.__listen()
+        print(PrettyOutput.info(f"[DAEMON] Serving {self.root_dir} on {self.path}"))
+        try:
+            while True:
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    print(PrettyOutput.info("[DAEMON] Idle timeout, exiting."))
+                    break
+                with connection:
+                    connection.settimeout(CONNECT_TIMEOUT)
+                    try:
+                        message = _receive(connection)
+                    except (OSError, ValueError):
+                        continue
+                    if message is None:
+                        continue
+                    command = message.get("command")
+                    if command == "mask":
+                        response = self.__mask(message.get("env", {}))
+                    elif command in ["ping", "stop"]:
+                        response = {"status": 0, "output": ""}
+                    else:
+                        response = {"status": 1, "output": f"Unknown command {command}"}
+                    connection.settimeout(None)
+                    try:
+                        _send(connection, response)
+                    except OSError:
+                        pass
+                    if command == "stop":
+                        print(PrettyOutput.info("[DAEMON] Stopped."))
+                        break
+        finally:
+            server.close()
+            self.path.unlink(missing_ok=True)
+            self.__unload()
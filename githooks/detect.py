@@ -0,0 +1,249 @@
+import math
+import re
+import string
+from collections import Counter
+from typing import Iterable, NamedTuple, Optional, Union
+
+from .matcher import mask_secret
+
+# Common key formats.
+PATTERNS = {
+    "aws": rb"(?:AKIA|ASIA|ABIA|ACCA|AGPA|AIDA|AIPA|ANPA|ANVA|AROA|APKA)[0-9A-Z]{16}",
+    "github": rb"(?:gh[pousr]_[A-Za-z0-9]{36,255}|github_pat_[A-Za-z0-9_]{22,255})",
+    "jwt": rb"eyJ[A-Za-z0-9_-]{8,}\.eyJ[A-Za-z0-9_-]{8,}\.[A-Za-z0-9_-]{8,}",
+}
+# Characters of the candidate tokens (base64, hex, ids...). The tokens are split on
+# the dots for the entropy check, the dots are only kept for the JWTs.
+TOKEN_BYTES = (string.ascii_letters + string.digits + "+/=_-.").encode("ascii")
+TOKEN_CHARS = re.escape(TOKEN_BYTES)
+# Number of tokens whose entropy is computed at once.
+ENTROPY_BATCH = 4096
+# Longest carried part of a chunk when the content is streamed.
+MAX_CARRY = 64 * 1024
+
+_numpy = None
+
+
+def _load_numpy():
+    """Returns numpy, or False if it isn't installed (it's an optional dependency)."""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy
+
+
+def shannon_entropy(
+    content: Union[bytes, memoryview],
+    spans: list[tuple[int, int]],
+    vectorized: Optional[bool] = None,
+) -> list[float]:
+    """Returns the Shannon entropy (bits per byte) of each (start, end) span.
+
+    With numpy, the entropies of all the spans are computed at once from the
+    counts of the (span, byte) pairs that occur. Without it (or with
+    'vectorized=False'), each span is counted in Python.
+    """
+    numpy = _load_numpy() if vectorized is not False else False
+    if not spans:
+        return []
+    if not numpy:
+        entropies = []
+        for start, end in spans:
+            length = end - start
+            counts = Counter(content[start:end]).values()
+            entropies.append(
+                -sum(count / length * math.log2(count / length) for count in counts)
+            )
+        return entropies
+
+    data = numpy.frombuffer(content, dtype=numpy.uint8)
+    bounds = numpy.array(spans, dtype=numpy.int64)
+    starts, lengths = bounds[:, 0], bounds[:, 1] - bounds[:, 0]
+    # The span of each byte of the spans, and its position in the content.
+    segments = numpy.repeat(numpy.arange(len(bounds)), lengths)
+    positions = numpy.arange(lengths.sum()) + numpy.repeat(
+        starts - (numpy.cumsum(lengths) - lengths), lengths
+    )
+    # Only the bytes that occur in a span are counted.
+    pairs, counts = numpy.unique(segments * 256 + data[positions], return_counts=True)
+    pair_segments = pairs >> 8
+    probabilities = counts / lengths[pair_segments]
+    terms = probabilities * numpy.log2(probabilities)
+    return (-numpy.bincount(pair_segments, terms, len(bounds))).tolist()
+
+
+def _runs(numpy, content: Union[bytes, memoryview], chars: bytes):
+    # The (starts, ends) arrays of the runs of 'chars' in the content.
+    table = numpy.zeros(256, dtype=numpy.int8)
+    table[numpy.frombuffer(chars, dtype=numpy.uint8)] = 1
+    mask = table[numpy.frombuffer(content, dtype=numpy.uint8)]
+    edges = numpy.flatnonzero(numpy.diff(mask, prepend=0, append=0))
+    return edges[0::2], edges[1::2]
+
+
+def token_spans(
+    content: Union[bytes, memoryview],
+    min_length: int,
+    vectorized: Optional[bool] = None,
+) -> list[tuple[int, int]]:
+    """Returns the (start, end) of the runs of token characters of 'min_length'.
+
+    With numpy, the runs are found from the edges of a token character mask of the
+    whole content. Without it, with a regex.
+    """
+    numpy = _load_numpy() if vectorized is not False else False
+    if not numpy:
+        regex = re.compile(
+            rb"(?<![%s])[%s]{%d,}" % (TOKEN_CHARS, TOKEN_CHARS, min_length)
+        )
+        return [match.span() for match in regex.finditer(content)]
+
+    starts, ends = _runs(numpy, content, TOKEN_BYTES)
+    keep = ends - starts >= min_length
+    return [*zip(starts[keep].tolist(), ends[keep].tolist())]
+
+
+def entropy_spans(
+    content: Union[bytes, memoryview],
+    min_length: int,
+    excluded: list[int],
+    vectorized: Optional[bool] = None,
+) -> list[tuple[int, int]]:
+    """Returns the (start, end) of the parts of the tokens checked for entropy.
+
+    The tokens are split on the dots, and only the parts of 'min_length' are kept.
+    The parts of the tokens that contain an 'excluded' position are dropped. With
+    numpy, the parts are found from the edges of a mask of the whole content.
+    """
+    numpy = _load_numpy() if vectorized is not False else False
+    if not numpy:
+        spans = []
+        positions = iter(sorted(excluded))
+        position = next(positions, None)
+        for start, end in token_spans(content, min_length, vectorized):
+            while position is not None and position < start:
+                position = next(positions, None)
+            if position is not None and position < end:
+                continue
+            offset = start
+            for part in content[start:end].split(b"."):
+                if len(part) >= min_length:
+                    spans.append((offset, offset + len(part)))
+                offset += len(part) + 1
+        return spans
+
+    starts, ends = _runs(numpy, content, TOKEN_BYTES.replace(b".", b""))
+    keep = ends - starts >= min_length
+    starts, ends = starts[keep], ends[keep]
+    if excluded:
+        token_starts, _ = _runs(numpy, content, TOKEN_BYTES)
+        tokens = numpy.searchsorted(token_starts, starts, side="right")
+        excluded_tokens = numpy.searchsorted(token_starts, excluded, side="right")
+        keep = ~numpy.isin(tokens, excluded_tokens)
+        starts, ends = starts[keep], ends[keep]
+    return [*zip(starts.tolist(), ends.tolist())]
+
+
+class Detection(NamedTuple):
+    line: int
+    # "aws", "github", "jwt" or "entropy".
+    kind: str
+    # The token with only its last characters visible.
+    preview: str
+
+
+class SecretDetector:
+    """Finds secrets that aren't listed in mask.config ([detect] table).
+
+    Known key formats are matched with a single regex. The other tokens of at least
+    'min_length' characters are flagged if their Shannon entropy is at least
+    'entropy' bits per character.
+    """
+
+    def __init__(
+        self,
+        patterns: Iterable[str] = PATTERNS,
+        entropy: Optional[float] = 4.5,
+        min_length: int = 20,
+        vectorized: Optional[bool] = None,
+    ) -> None:
+        """'entropy' None disables the entropy check."""
+        self.patterns = [*patterns]
+        self.entropy = entropy
+        self.min_length = min_length
+        self.vectorized = vectorized
+        self.regex = None
+        if self.patterns:
+            # Without named groups, the regex engine only tries the positions that
+            # start with the first byte of a format. The format of the (rare)
+            # matches is found afterwards.
+            self.regex = re.compile(
+                b"|".join(b"(?:%s)" % PATTERNS[name] for name in self.patterns)
+            )
+        self.formats = [(name, re.compile(PATTERNS[name])) for name in self.patterns]
+
+    def __preview(self, token: bytes) -> str:
+        return mask_secret(token.decode("ascii", "replace"), min(4, len(token) // 4))
+
+    def detect(self, content: bytes, first_line: int = 1) -> list[Detection]:
+        """Returns the detections in the content, ordered by position."""
+        found = []
+        if self.regex is not None:
+            # The key formats are made of token characters, so they never span
+            # two tokens.
+            for match in self.regex.finditer(content):
+                token = match.group()
+                kind = next(
+                    name for name, regex in self.formats if regex.fullmatch(token)
+                )
+                found.append((match.start(), kind, token))
+        if self.entropy is not None:
+            # A token that matched a known format is reported once.
+            spans = entropy_spans(
+                content,
+                self.min_length,
+                [start for start, _, _ in found],
+                self.vectorized,
+            )
+            for batch in range(0, len(spans), ENTROPY_BATCH):
+                batch_spans = spans[batch : batch + ENTROPY_BATCH]
+                entropies = shannon_entropy(content, batch_spans, self.vectorized)
+                for (start, end), entropy in zip(batch_spans, entropies):
+                    if entropy >= self.entropy:
+                        found.append((start, "entropy", content[start:end]))
+        found.sort()
+        detections = []
+        line, position = first_line, 0
+        for start, kind, token in found:
+            line += content.count(b"\n", position, start)
+            position = start
+            detections.append(Detection(line, kind, self.__preview(token)))
+        return detections
+
+    def detect_stream(self, chunks: Iterable[bytes]) -> list[Detection]:
+        """Like detect, for content read in chunks.
+
+        Every chunk is cut after its last newline, so no token is split (lines
+        longer than MAX_CARRY can be).
+        """
+        detections = []
+        line = 1
+        carry = b""
+        for chunk in chunks:
+            content = carry + chunk
+            cut = content.rfind(b"\n") + 1
+            if not cut and len(content) <= MAX_CARRY:
+                carry = content
+                continue
+            cut = cut or len(content)
+            detections += self.detect(content[:cut], line)
+            line += content.count(b"\n", 0, cut)
+            carry = content[cut:]
+        if carry:
+            detections += self.detect(carry, line)
+        return detections
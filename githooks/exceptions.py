@@ -8,7 +8,7 @@ class NoConfigurationFileFound(Exception):
     def __str__(self) -> str:
         message = """\
             Configuration file was not found. Run 'git-hooks init mask' to generate a 
-            template file in the following directory '.git/hooks/mask.toml'"""
+            template 'mask.config' file in your repo's root directory."""
         return PrettyOutput.error(message)
 
 
@@ -34,3 +34,15 @@ class GitPathNotFound(Exception):
             Make sure that you run the tool from your project's root directory 
             and it's a valid git repo."""
         return PrettyOutput.error(message)
+
+
+class DaemonAlreadyRunning(Exception):
+    def __init__(self, *args: object, **kwargs) -> None:
+        super().__init__(*args)
+        self.path = kwargs.get("path", "")
+
+    def __str__(self) -> str:
+        message = f"""\
+            A git-hooks daemon is already running for this repo ({self.path}).
+            Stop it with 'git-hooks daemon --stop' first."""
+        return PrettyOutput.error(message)
@@ -0,0 +1,267 @@
+import hashlib
+import itertools
+import os
+import re
+from typing import Any, Iterable, Iterator, NamedTuple, Optional, Union
+
+from .detect import _load_numpy
+
+# The rolling hashes are computed modulo 2**64.
+MASK = (1 << 64) - 1
+# Bits of the rolling hash kept in mask.config to find the candidates. It's enough
+# to filter out all but 1 in 65536 windows, and too little to tell the secret.
+CHECK_BITS = 16
+CHECK_SHIFT = 64 - CHECK_BITS
+# Number of windows whose rolling hashes are computed at once.
+BLOCK_SIZE = 1024 * 1024
+# The keys of an entry of the [fingerprints] secrets.
+FIELDS = {"length", "suffix", "check", "hash"}
+
+
+class Fingerprint(NamedTuple):
+    # Length of the secret in bytes (UTF-8).
+    length: int
+    # The visible end of the secret (its last 'show' characters).
+    suffix: bytes
+    # The top bits of the rolling hash of the secret.
+    check: int
+    # sha256 of the salt and the secret (hex).
+    hash: str
+
+    @property
+    def masked(self) -> bytes:
+        return b"*" * (self.length - len(self.suffix)) + self.suffix
+
+
+def new_salt() -> str:
+    return os.urandom(16).hex()
+
+
+def rolling_base(salt: str) -> int:
+    # Derived from the salt, so the checks differ between repos. The base is odd,
+    # so it's invertible modulo 2**64.
+    digest = hashlib.sha256(b"rolling-hash:" + salt.encode("utf8")).digest()
+    return int.from_bytes(digest[:8], "little") | 1
+
+
+def rolling_hash(data: bytes, base: int) -> int:
+    """The Rabin-Karp hash of the data: sum of byte * base**(len - 1 - index)."""
+    value = 0
+    for byte in data:
+        value = (value * base + byte) & MASK
+    return value
+
+
+def secret_hash(secret: bytes, salt: str) -> str:
+    return hashlib.sha256(salt.encode("utf8") + secret).hexdigest()
+
+
+def make_fingerprint(secret: str, show: int, salt: str) -> Fingerprint:
+    """Returns the fingerprint of a secret, with its last 'show' characters visible."""
+    data = secret.encode("utf8")
+    suffix = secret[max(len(secret) - show, 0) :] if show else ""
+    return Fingerprint(
+        len(data),
+        suffix.encode("utf8"),
+        rolling_hash(data, rolling_base(salt)) >> CHECK_SHIFT,
+        secret_hash(data, salt),
+    )
+
+
+def parse_fingerprint(entry: Any) -> Optional[Fingerprint]:
+    """Returns the fingerprint of a mask.config entry, or None if it isn't valid."""
+    if not isinstance(entry, dict) or set(entry) - FIELDS:
+        return None
+    length, suffix = entry.get("length"), entry.get("suffix", "")
+    check, digest = entry.get("check"), entry.get("hash")
+    if not (
+        isinstance(length, int)
+        and isinstance(suffix, str)
+        and isinstance(check, int)
+        and isinstance(digest, str)
+    ):
+        return None
+    suffix = suffix.encode("utf8")
+    if not (0 <= len(suffix) <= length and 0 <= check < 1 << CHECK_BITS):
+        return None
+    if not re.fullmatch("[0-9a-f]{64}", digest):
+        return None
+    return Fingerprint(length, suffix, check, digest)
+
+
+def format_fingerprint(fingerprint: Fingerprint) -> str:
+    """Returns the fingerprint as an inline table of the [fingerprints] secrets."""
+    import json
+
+    suffix = json.dumps(fingerprint.suffix.decode("utf8"), ensure_ascii=False)
+    return (
+        f"{{ length = {fingerprint.length}, suffix = {suffix}, "
+        f'check = {fingerprint.check}, hash = "{fingerprint.hash}" }}'
+    )
+
+
+class FingerprintSet:
+    """Finds the secrets of the [fingerprints] table, known only by their hashes.
+
+    The secrets are grouped by length. For each length, the rolling hash of every
+    window of the content is compared with the checks of the secrets of that
+    length, and the candidates are confirmed with the salted hash. The work is
+    linear in the size of the content for each distinct length, however many
+    secrets there are.
+
+    With numpy, the rolling hashes of a whole block are computed at once. Without
+    it (or with 'vectorized=False'), the windows that end with a visible suffix are
+    found with a regex and the other ones are hashed in Python.
+    """
+
+    def __init__(
+        self,
+        fingerprints: Iterable[Fingerprint],
+        salt: str,
+        vectorized: Optional[bool] = None,
+    ) -> None:
+        self.fingerprints = [*fingerprints]
+        self.salt = salt
+        self.base = rolling_base(salt)
+        self.vectorized = vectorized
+        # length -> check -> fingerprints
+        self.groups = {}
+        for fingerprint in self.fingerprints:
+            checks = self.groups.setdefault(fingerprint.length, {})
+            checks.setdefault(fingerprint.check, []).append(fingerprint)
+        self.max_length = max(self.groups, default=0)
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    def __vectorized_candidates(
+        self, content: Union[bytes, memoryview]
+    ) -> Iterator[tuple[int, int, int]]:
+        numpy = _load_numpy()
+        end = len(content)
+        size = min(BLOCK_SIZE, end) + self.max_length - 1
+        # base**i and base**-i for the positions of a block.
+        powers = numpy.full(size, self.base, dtype=numpy.uint64)
+        powers[0] = 1
+        powers = numpy.cumprod(powers)
+        inverses = numpy.full(size, pow(self.base, -1, 1 << 64), dtype=numpy.uint64)
+        inverses[0] = 1
+        inverses = numpy.cumprod(inverses)
+        # The checks of each length, as a lookup table.
+        targets = {}
+        for length, checks in self.groups.items():
+            targets[length] = numpy.zeros(1 << CHECK_BITS, dtype=bool)
+            targets[length][[*checks]] = True
+        data = numpy.frombuffer(content, dtype=numpy.uint8)
+        for block in range(0, end, BLOCK_SIZE):
+            values = data[block : block + BLOCK_SIZE + self.max_length - 1]
+            # prefix[j] = sum of values[t] * base**-t for t < j, so the hash of the
+            # window of 'length' at i is base**(i + length - 1) * (prefix[i + length]
+            # - prefix[i]). It's shared by all the lengths.
+            prefix = numpy.zeros(len(values) + 1, dtype=numpy.uint64)
+            numpy.cumsum(values * inverses[: len(values)], out=prefix[1:])
+            for length in self.groups:
+                count = min(BLOCK_SIZE, end - length + 1 - block)
+                if count <= 0:
+                    continue
+                hashes = powers[length - 1 : length - 1 + count] * (
+                    prefix[length : length + count] - prefix[:count]
+                )
+                tops = hashes >> numpy.uint64(CHECK_SHIFT)
+                hits = numpy.flatnonzero(targets[length][tops])
+                for index in hits.tolist():
+                    yield length, block + index, int(tops[index])
+
+    def __rolling_candidates(
+        self, content: Union[bytes, memoryview], length: int, checks: dict
+    ) -> Iterator[tuple[int, int]]:
+        base = self.base
+        # Removes the first byte of a window.
+        first = pow(base, length - 1, 1 << 64)
+        value = rolling_hash(content[:length], base)
+        end = len(content)
+        for start in range(end - length + 1):
+            if value >> CHECK_SHIFT in checks:
+                yield start, value >> CHECK_SHIFT
+            if start + length < end:
+                value = (
+                    (value - content[start] * first) * base + content[start + length]
+                ) & MASK
+
+    def __suffix_candidates(
+        self, content: Union[bytes, memoryview], length: int, suffix: bytes
+    ) -> Iterator[tuple[int, int]]:
+        # A lookahead, so the overlapping occurrences are found too.
+        for match in re.finditer(b"(?=%s)" % re.escape(suffix), content):
+            start = match.start() + len(suffix) - length
+            if start >= 0:
+                window = bytes(content[start : start + length])
+                yield start, rolling_hash(window, self.base) >> CHECK_SHIFT
+
+    def __candidates(
+        self, content: Union[bytes, memoryview]
+    ) -> Iterator[tuple[int, int, int]]:
+        """Yields the (length, offset, check) of the windows that match a check."""
+        if self.vectorized is not False and _load_numpy():
+            yield from self.__vectorized_candidates(content)
+            return
+        for length, checks in self.groups.items():
+            if length > len(content):
+                continue
+            suffixes = {fp.suffix for fps in checks.values() for fp in fps}
+            if b"" in suffixes:
+                candidates = self.__rolling_candidates(content, length, checks)
+            else:
+                candidates = itertools.chain.from_iterable(
+                    self.__suffix_candidates(content, length, suffix)
+                    for suffix in suffixes
+                )
+            for start, check in candidates:
+                yield length, start, check
+
+    def __confirmed(
+        self, content: Union[bytes, memoryview]
+    ) -> Iterator[tuple[int, bytes, Fingerprint]]:
+        if isinstance(content, (bytes, bytearray)):
+            content = memoryview(content)
+        for length, start, check in self.__candidates(content):
+            window = bytes(content[start : start + length])
+            digest = None
+            for fingerprint in self.groups[length].get(check, []):
+                if not window.endswith(fingerprint.suffix):
+                    continue
+                digest = digest or secret_hash(window, self.salt)
+                if digest == fingerprint.hash:
+                    yield start, window, fingerprint
+                    break
+
+    def find(
+        self, content: Union[bytes, memoryview]
+    ) -> list[tuple[int, bytes, Fingerprint]]:
+        """Returns the (offset, secret, fingerprint) of the secrets in the content.
+
+        Like the literal matcher, the matches don't overlap and the longest secret
+        wins at each position.
+        """
+        found = sorted(
+            self.__confirmed(content), key=lambda item: (item[0], -len(item[1]))
+        )
+        matches = []
+        end = 0
+        for start, secret, fingerprint in found:
+            if start >= end:
+                matches.append((start, secret, fingerprint))
+                end = start + len(secret)
+        return matches
+
+    def search(self, content: Union[bytes, memoryview]) -> bool:
+        """Returns True if any secret is found in the content."""
+        return next(self.__confirmed(content), None) is not None
+
+    def masked(self, secret: bytes) -> Optional[bytes]:
+        """Returns the masked form of a secret found in the content."""
+        digest = secret_hash(secret, self.salt)
+        for fingerprint in self.fingerprints:
+            if fingerprint.hash == digest:
+                return fingerprint.masked
+        return None
@@ -0,0 +1,431 @@
+import codecs
+import hashlib
+import pathlib
+import re
+import subprocess
+import threading
+from typing import BinaryIO, Iterable, Iterator, NamedTuple, Optional, Union
+
+EMPTY_TREE_SHA = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+NULL_SHA = "0" * 40
+REGULAR_FILE_MODES = ["100644", "100755"]
+
+
+def state_dir(root_dir: pathlib.Path) -> pathlib.Path:
+    """Returns the directory inside '.git' where git-hooks keeps its state."""
+    git_dir = root_dir / ".git"
+    if git_dir.is_file():
+        # Worktrees and submodules have a ".git" file pointing to the git dir.
+        git_dir = root_dir / git_dir.read_text().split("gitdir:", 1)[1].strip()
+    path = git_dir / "githooks"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+class StagedBlob(NamedTuple):
+    path: str
+    sha: str
+    mode: str
+
+
+def blob_hasher(size: int) -> "hashlib._Hash":
+    """Returns a sha1 to update with the content of a blob, to get its git sha."""
+    return hashlib.sha1(b"blob %d\0" % size)
+
+
+def decode_path(path: bytes) -> str:
+    return path.decode("utf8", errors="surrogateescape")
+
+
+def encode_path(path: str) -> bytes:
+    return path.encode("utf8", errors="surrogateescape")
+
+
+def object_exists(root_dir: pathlib.Path, sha: str) -> bool:
+    cmd = ["git", "cat-file", "-e", sha]
+    return subprocess.run(cmd, cwd=root_dir, capture_output=True).returncode == 0
+
+
+def staged_blobs(root_dir: pathlib.Path) -> list[StagedBlob]:
+    """Lists the staged regular files with their index object ids in one git call."""
+    cmd = ["git", "diff-index", "--cached", "-z", "--no-renames", "HEAD"]
+    result = subprocess.run(cmd, cwd=root_dir, capture_output=True)
+    if result.returncode != 0:
+        # No HEAD yet (initial commit), compare against the empty tree instead.
+        cmd[-1] = EMPTY_TREE_SHA
+        result = subprocess.run(cmd, cwd=root_dir, capture_output=True)
+    # Output records are ":<old mode> <new mode> <old sha> <new sha> <status>\0<path>\0"
+    fields = result.stdout.split(b"\0")
+    blobs = []
+    for header, path in zip(fields[0::2], fields[1::2]):
+        _, new_mode, _, new_sha, status = header.decode("ascii").split(" ")
+        if status in ["D", "U"] or new_sha == NULL_SHA:
+            continue
+        if new_mode not in REGULAR_FILE_MODES:
+            # Symlinks and submodules don't have content to mask.
+            continue
+        blobs.append(StagedBlob(decode_path(path), new_sha, new_mode))
+    return blobs
+
+
+def unstaged_paths(root_dir: pathlib.Path) -> set[str]:
+    """Returns the paths whose working tree content differs from the index."""
+    cmd = ["git", "diff", "--name-only", "-z"]
+    stdout = subprocess.run(cmd, cwd=root_dir, capture_output=True).stdout
+    return {decode_path(path) for path in stdout.split(b"\0") if path}
+
+
+def changed_paths(root_dir: pathlib.Path) -> list[str]:
+    """Returns the modified and the untracked (not ignored) working tree files."""
+    cmd = ["git", "ls-files", "-z", "--modified", "--others", "--exclude-standard"]
+    stdout = subprocess.run(cmd, cwd=root_dir, capture_output=True).stdout
+    return sorted({decode_path(path) for path in stdout.split(b"\0") if path})
+
+
+def ignored_paths(root_dir: pathlib.Path, paths: Iterable[str]) -> set[str]:
+    """Returns the paths ignored by the .gitignore files, in one git call.
+
+    Tracked files are never ignored. Directories must end with a '/'.
+    """
+    paths = [*paths]
+    if not paths:
+        return set()
+    result = subprocess.run(
+        ["git", "check-ignore", "-z", "--stdin"],
+        input=b"".join(encode_path(path) + b"\0" for path in paths),
+        cwd=root_dir,
+        capture_output=True,
+    )
+    return {decode_path(path) for path in result.stdout.split(b"\0") if path}
+
+
+def update_index(root_dir: pathlib.Path, paths: list[str]) -> list[str]:
+    """Adds the working tree files to the index in one git call.
+
+    Returns the paths that git rejected. 'git update-index' stops at the first
+    rejected path without writing the index, so the update is retried without it.
+    """
+    paths = list(paths)
+    rejected = []
+    while paths:
+        result = subprocess.run(
+            ["git", "update-index", "-z", "--add", "--stdin"],
+            input=b"".join(encode_path(path) + b"\0" for path in paths),
+            cwd=root_dir,
+            capture_output=True,
+        )
+        if result.returncode == 0:
+            break
+        failed = re.search(rb"Unable to process path (.*)$", result.stderr, re.M)
+        failed_path = decode_path(failed.group(1)) if failed else None
+        if failed_path not in paths:
+            rejected.extend(paths)
+            break
+        rejected.append(failed_path)
+        paths.remove(failed_path)
+    return rejected
+
+
+class AddedHunk(NamedTuple):
+    start: int
+    count: int
+    content: bytes
+
+
+def _diff_path(value: bytes) -> Optional[str]:
+    # Names with a space get a trailing tab, special characters are C-quoted.
+    value = value.rstrip(b"\t")
+    if value == b"/dev/null":
+        return None
+    if value.startswith(b'"') and value.endswith(b'"'):
+        value = codecs.escape_decode(value[1:-1])[0]
+    return decode_path(value[len(b"b/") :])
+
+
+def staged_hunks(
+    root_dir: pathlib.Path, text: bool = False, pathspecs: Iterable[str] = ()
+) -> Iterator[tuple[StagedBlob, list[AddedHunk]]]:
+    """Streams the lines added to the index from 'git diff --cached -U0'.
+
+    Yields each staged regular file with its added hunks. A hunk is a block of
+    consecutive added lines, 'start' is the number of its first line in the staged
+    blob. Binary files don't have hunks unless 'text' is True. The diff is limited
+    to the passed pathspecs.
+    """
+    cmd = [
+        "git",
+        "-c",
+        "core.quotePath=false",
+        "diff",
+        "--cached",
+        "-U0",
+        "--full-index",
+        "--no-color",
+        "--no-ext-diff",
+        "--no-textconv",
+        "--no-renames",
+        "--no-relative",
+        "--src-prefix=a/",
+        "--dst-prefix=b/",
+    ]
+    if text:
+        cmd.append("--text")
+    cmd += ["--", *pathspecs]
+    process = subprocess.Popen(
+        cmd, cwd=root_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    path = sha = mode = None
+    hunks = []
+    added = []
+    old_lines = new_lines = start = 0
+    last_added = False
+
+    def staged_file() -> Optional[tuple[StagedBlob, list[AddedHunk]]]:
+        if path is None or sha is None or mode not in REGULAR_FILE_MODES:
+            # Deleted files, symlinks and submodules don't have content to mask.
+            return None
+        if not hunks:
+            return None
+        return StagedBlob(path, sha, mode), hunks
+
+    try:
+        for line in process.stdout:
+            if old_lines or new_lines:
+                if line.startswith(b"-"):
+                    old_lines -= 1
+                    last_added = False
+                elif line.startswith(b"+"):
+                    new_lines -= 1
+                    last_added = True
+                    added.append(line[1:])
+                if not (old_lines or new_lines) and added:
+                    hunks.append(AddedHunk(start, len(added), b"".join(added)))
+                    added = []
+            elif line.startswith(b"@@ "):
+                header = re.match(rb"@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@", line)
+                old_lines = int(header.group(1) or 1)
+                start = int(header.group(2))
+                new_lines = int(header.group(3) or 1)
+                last_added = False
+            elif line.startswith(b"\\"):
+                # "\ No newline at end of file" after the last added line.
+                if last_added and hunks:
+                    hunk = hunks[-1]
+                    hunks[-1] = hunk._replace(content=hunk.content[:-1])
+                last_added = False
+            elif line.startswith(b"diff --git "):
+                result = staged_file()
+                if result is not None:
+                    yield result
+                path = sha = mode = None
+                hunks = []
+            elif line.startswith((b"new file mode ", b"new mode ")):
+                mode = line.split()[-1].decode("ascii")
+            elif line.startswith(b"index "):
+                fields = line.split()
+                sha = fields[1].split(b"..")[1].decode("ascii")
+                if len(fields) == 3:
+                    mode = fields[2].decode("ascii")
+            elif line.startswith(b"+++ "):
+                path = _diff_path(line[4:].rstrip(b"\n"))
+        result = staged_file()
+        if result is not None:
+            yield result
+    finally:
+        process.stdout.close()
+        process.wait()
+
+
+def _split_stream(stream: BinaryIO, separator: bytes) -> Iterator[bytes]:
+    carry = b""
+    for chunk in iter(lambda: stream.read(64 * 1024), b""):
+        fields = (carry + chunk).split(separator)
+        carry = fields.pop()
+        yield from fields
+    if carry:
+        yield carry
+
+
+def history_blobs(
+    root_dir: pathlib.Path, revs: list[str], pathspecs: Iterable[str] = ()
+) -> Iterator[tuple[str, StagedBlob]]:
+    """Streams the regular file blobs added or changed by each commit of 'revs'.
+
+    Yields the commit and the blob, newest commits first. The same blob can be
+    yielded more than once (by different commits or paths).
+    """
+    cmd = [
+        "git",
+        "log",
+        "--raw",
+        "-z",
+        "--no-abbrev",
+        "--no-renames",
+        "--no-color",
+        "--root",
+        "--diff-merges=first-parent",
+        # The history isn't simplified when limited to pathspecs.
+        "--full-history",
+        "--format=%H",
+        *revs,
+        "--",
+        *pathspecs,
+    ]
+    process = subprocess.Popen(cmd, cwd=root_dir, stdout=subprocess.PIPE)
+    commit = None
+    header = None
+    try:
+        for field in _split_stream(process.stdout, b"\0"):
+            if header is not None:
+                # The path of the previous ":<old mode> <new mode> ..." record.
+                _, new_mode, _, new_sha, status = header.decode("ascii").split(" ")
+                header = None
+                if status != "D" and new_mode in REGULAR_FILE_MODES:
+                    yield commit, StagedBlob(decode_path(field), new_sha, new_mode)
+                continue
+            field = field.lstrip(b"\n")
+            if field.startswith(b":"):
+                header = field[1:]
+            elif field:
+                commit = field.decode("ascii")
+    finally:
+        process.stdout.close()
+        process.wait()
+
+
+def write_blobs(root_dir: pathlib.Path, files: list[pathlib.Path]) -> list[str]:
+    """Writes the files to the object database in one git call. Returns their shas."""
+    result = subprocess.run(
+        ["git", "hash-object", "-w", "--no-filters", "--stdin-paths"],
+        input="\n".join(str(file) for file in files).encode("utf8"),
+        cwd=root_dir,
+        capture_output=True,
+    )
+    return result.stdout.decode("ascii").split()
+
+
+def update_index_info(root_dir: pathlib.Path, blobs: list[StagedBlob]) -> bool:
+    """Points the index entries to the passed blobs in one git call."""
+    index_info = b"".join(
+        f"{blob.mode} {blob.sha}\t".encode("ascii") + encode_path(blob.path) + b"\0"
+        for blob in blobs
+    )
+    result = subprocess.run(
+        ["git", "update-index", "-z", "--index-info"],
+        input=index_info,
+        cwd=root_dir,
+        capture_output=True,
+    )
+    return result.returncode == 0
+
+
+class BlobStream:
+    """The content of a large object, read in chunks from the cat-file pipe.
+
+    It must be consumed before the next object is read from the same pipe.
+    """
+
+    def __init__(self, stdout: BinaryIO, size: int, chunk_size: int) -> None:
+        self.stdout = stdout
+        self.size = size
+        self.remaining = size
+        self.chunk_size = chunk_size
+
+    def __iter__(self) -> Iterator[bytes]:
+        while self.remaining:
+            chunk = self.stdout.read(min(self.chunk_size, self.remaining))
+            self.remaining -= len(chunk)
+            yield chunk
+
+    def drain(self) -> None:
+        for _ in self:
+            pass
+
+
+class BlobReader:
+    """Reads git objects through a single long-lived 'git cat-file --batch' process."""
+
+    def __init__(self, root_dir: pathlib.Path) -> None:
+        self.process = subprocess.Popen(
+            ["git", "cat-file", "--batch"],
+            cwd=root_dir,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        # The thread writing the requests of read_many.
+        self.writer = None
+
+    def __enter__(self) -> "BlobReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __read_object(
+        self, max_size: Optional[int], chunk_size: int
+    ) -> Union[bytes, BlobStream, None]:
+        header = self.process.stdout.readline().decode("ascii").split()
+        if len(header) != 3:
+            # "<sha> missing" or "<sha> ambiguous"
+            return None
+        size = int(header[2])
+        if max_size is not None and size > max_size:
+            return BlobStream(self.process.stdout, size, chunk_size)
+        content = self.process.stdout.read(size)
+        self.process.stdout.read(1)  # Trailing LF
+        return content
+
+    def read(self, sha: str) -> Optional[bytes]:
+        self.process.stdin.write(sha.encode("ascii") + b"\n")
+        self.process.stdin.flush()
+        return self.__read_object(None, 0)
+
+    def read_many(
+        self,
+        shas: Iterable[str],
+        max_size: Optional[int] = None,
+        chunk_size: int = 1024 * 1024,
+    ) -> Iterator[tuple[str, Union[bytes, BlobStream, None]]]:
+        """Streams the content of all the objects in order.
+
+        The requests are written from a separate thread, so git never waits for us
+        to read a response before it gets the next object id. Objects larger than
+        'max_size' are returned as a BlobStream instead of being loaded in memory.
+        """
+        shas = list(shas)
+
+        def write_requests() -> None:
+            try:
+                for sha in shas:
+                    self.process.stdin.write(sha.encode("ascii") + b"\n")
+                self.process.stdin.flush()
+            except (BrokenPipeError, ValueError):
+                # The reader was closed before all the objects were read.
+                pass
+
+        self.writer = threading.Thread(target=write_requests, daemon=True)
+        self.writer.start()
+        for sha in shas:
+            content = self.__read_object(max_size, chunk_size)
+            yield sha, content
+            if isinstance(content, BlobStream):
+                content.drain()
+                self.process.stdout.read(1)  # Trailing LF
+        self.writer.join()
+
+    def close(self) -> None:
+        if self.process.poll() is None:
+            if self.writer is not None and self.writer.is_alive():
+                # Closed before all the objects were read: git waits for its output
+                # to be read and the writer (holding the stdin lock) waits for git.
+                # git is stopped first, so the writer gets a broken pipe.
+                self.process.terminate()
+                self.process.stdout.close()
+                self.writer.join()
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+            # Unread output (e.g. a stream that wasn't consumed) must not block git.
+            self.process.stdout.close()
+            self.process.wait()
@@ -1,168 +1,1545 @@
+import functools
+import hashlib
+import itertools
+import mmap
 import os
 import pathlib
 import re
 import shutil
-import subprocess
 import sys
-from collections import OrderedDict
-
-import toml
-from jinja2 import Environment, FileSystemLoader, meta
+import tempfile
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, Optional
 
+from ..backup import BackupStore, clone_file, link_file, write_atomic
+from ..cache import ConfigCache
 from ..exceptions import *
+from ..git import (
+    NULL_SHA,
+    AddedHunk,
+    BlobReader,
+    BlobStream,
+    StagedBlob,
+    blob_hasher,
+    encode_path,
+    object_exists,
+    staged_blobs,
+    staged_hunks,
+    state_dir,
+    unstaged_paths,
+    update_index,
+    update_index_info,
+    write_blobs,
+)
+from ..ignore import IgnoreMatcher
+from ..matcher import BINARY_SNIFF_SIZE, SecretMatcher, is_binary
+from ..report import FileResult, TextReport
+from ..timings import NO_TIMINGS
 from ..utils import PrettyOutput
 
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    from ..cache import ScanCache
+    from ..fingerprint import FingerprintSet
+    from ..store import MaskedFile
+    from ..timings import Timings
+
+# The heavy modules (jinja2, toml, sqlite3, multiprocessing...) are imported where
+# they are used, so a commit without anything to mask stays fast.
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Number of batches waiting between two stages of the pipeline, and the size of
+# the blobs read in a batch.
+PIPELINE_QUEUE_SIZE = 4
+PIPELINE_BATCH_SIZE = 1024 * 1024
+
+_worker_matcher = None
+_worker_binary = "skip"
+
+
+def _plain_tables(value: Any) -> Any:
+    # The inline tables parsed by toml are instances of local classes, which can't be
+    # pickled (by the config cache).
+    if isinstance(value, dict):
+        return {key: _plain_tables(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_plain_tables(item) for item in value]
+    return value
+
+
+def _mask_content(
+    matcher: SecretMatcher,
+    content: Optional[bytes],
+    binary: str,
+    matches: Optional[list] = None,
+) -> Optional[bytes]:
+    # Returns the masked content, or None if there is nothing to mask.
+    if content is None:
+        return None
+    if binary == "skip" and is_binary(content[:BINARY_SNIFF_SIZE]):
+        return None
+    if not matcher.search(content):
+        return None
+    return matcher.mask(content, matches)
+
+
+def _mask_hunks(
+    matcher: SecretMatcher,
+    content: bytes,
+    hunks: list[AddedHunk],
+    matches: Optional[list] = None,
+) -> bytes:
+    # Only the lines of the hunks are masked, the rest of the file is left as is.
+    lines = content.split(b"\n")
+    offsets = [0, *itertools.accumulate(len(line) + 1 for line in lines)]
+    # From the last hunk, so a masked newline (in a secret) doesn't shift the others.
+    for hunk in reversed(hunks):
+        first = hunk.start - 1
+        block = b"\n".join(lines[first : first + hunk.count])
+        hunk_matches = None if matches is None else []
+        lines[first : first + hunk.count] = matcher.mask(block, hunk_matches).split(
+            b"\n"
+        )
+        if matches is not None:
+            matches.extend((offsets[first] + start, key) for start, key in hunk_matches)
+    return b"\n".join(lines)
+
+
+def _stream_needs_masking(
+    matcher: SecretMatcher, content: Iterable[bytes], binary: str
+) -> bool:
+    chunks = iter(content)
+    head = next(chunks, b"")
+    if binary == "skip" and is_binary(head):
+        return False
+    return matcher.contains_stream(itertools.chain([head], chunks))
+
+
+def _init_scan_worker(matcher: SecretMatcher, binary: str) -> None:
+    global _worker_matcher, _worker_binary
+    _worker_matcher = matcher
+    _worker_binary = binary
+
+
+def _scan_worker(content: Optional[bytes]) -> Optional[bytes]:
+    return _mask_content(_worker_matcher, content, _worker_binary)
+
+
+def _scan_batch(
+    matcher: SecretMatcher, binary: str, contents: list[Optional[bytes]]
+) -> list[Optional[bytes]]:
+    return [_mask_content(matcher, content, binary) for content in contents]
+
+
+def _scan_batch_worker(contents: list[Optional[bytes]]) -> list[Optional[bytes]]:
+    return _scan_batch(_worker_matcher, _worker_binary, contents)
+
+
+def _unmask_exact(
+    file: pathlib.Path, masks: list[tuple[int, bytes]], secrets: dict, dry_run: bool
+) -> Optional[int]:
+    # Patches the recorded positions in place and returns the number of restored
+    # secrets, or None if the file changed since it was masked. Every position is
+    # checked first, so a changed file is never partially patched.
+    with file.open(mode="rb" if dry_run else "r+b") as f:
+        patches = []
+        for offset, secret_id in masks:
+            if secret_id not in secrets:
+                return None
+            secret, masked = secrets[secret_id]
+            f.seek(offset)
+            if f.read(len(masked)) != masked:
+                return None
+            patches.append((offset, secret))
+        if not dry_run:
+            for offset, secret in patches:
+                f.seek(offset)
+                f.write(secret)
+    return len(patches)
+
+
+def _masked_in(
+    file: pathlib.Path, masks: list[tuple[int, bytes]], secrets: dict
+) -> list[tuple[int, bytes]]:
+    # The recorded masks whose masked secret is in the file.
+    with file.open(mode="rb") as f:
+        still_masked = []
+        for offset, secret_id in masks:
+            if secret_id not in secrets:
+                continue
+            f.seek(offset)
+            if f.read(len(secrets[secret_id][1])) == secrets[secret_id][1]:
+                still_masked.append((offset, secret_id))
+    return still_masked
+
+
+def _unmask_file(
+    reverse: SecretMatcher,
+    secrets: dict,
+    file: pathlib.Path,
+    masks: Optional[list[tuple[int, bytes]]],
+    dry_run: bool,
+    backup: Optional[tuple[BackupStore, str]] = None,
+) -> tuple[int, bool, Optional[str]]:
+    """Restores the secrets of a masked file.
+
+    Returns the number of restored secrets, whether the recorded positions were
+    used and the error, if the file couldn't be read or written. When the
+    positions aren't known (or the file changed), all the masked secrets in the
+    file are replaced, and the file is only rewritten if it has any. With a
+    'backup' (store, sha), the file is first replaced by its unmasked copy, and
+    'masks' are the secrets still masked in that copy.
+    """
+    try:
+        if backup is not None and not dry_run:
+            backup[0].restore(backup[1], file)
+        if masks is not None:
+            count = _unmask_exact(file, masks, secrets, dry_run)
+            if count is not None:
+                return count, True, None
+        content = file.read_bytes()
+        matches = []
+        unmasked_content = reverse.mask(content, matches)
+        if matches and not dry_run:
+            write_atomic(file, unmasked_content)
+        return len(matches), False, None
+    except Exception as e:
+        return 0, False, str(e)
+
+
+_worker_reverse = None
+_worker_secrets = None
+
+
+def _init_unmask_worker(reverse: SecretMatcher, secret_ids: dict) -> None:
+    global _worker_reverse, _worker_secrets
+    _worker_reverse = reverse
+    _worker_secrets = secret_ids
+
+
+def _unmask_worker(job: tuple) -> tuple[int, bool, Optional[str]]:
+    return _unmask_file(_worker_reverse, _worker_secrets, *job)
+
 
 class MaskGitHook:
-    def __init__(self, root_dir: pathlib.Path) -> None:
+    def __init__(
+        self,
+        root_dir: pathlib.Path,
+        timings: Optional["Timings"] = None,
+        report: Optional[TextReport] = None,
+    ) -> None:
+        """'timings' records the time spent in each phase of the hook.
+
+        The output goes to 'report' (printed right away without it).
+        """
         self.root_dir = root_dir
-        try:
-            self.configs = toml.loads(self.__render_toml_template())
-        except toml.decoder.TomlDecodeError as e:
-            print(PrettyOutput.error("[mask.config] " + e.__str__()))
-            print(PrettyOutput.error("Please revise your mask.config"))
+        self.timings = timings or NO_TIMINGS
+        self.report = report or TextReport(buffered=False)
+        # A scan cache kept open between the runs (by the daemon).
+        self.scan_cache = None
+        self.__secret_ids = None
+        with self.timings.phase("load config"):
+            self.__load_config()
+
+    def __load_config(self) -> None:
+        config_file = self.root_dir / "mask.config"
+        if not config_file.exists():
+            raise NoConfigurationFileFound()
+        config = config_file.read_bytes()
+        # When neither mask.config nor the env. variables it references changed,
+        # the rendered config and the compiled matcher are loaded from the cache.
+        config_cache = ConfigCache(state_dir(self.root_dir) / "config.cache")
+        cached = config_cache.load(config)
+        includes = []
+        if cached is None:
+            with self.timings.phase("render config"):
+                variables, rendered_config, includes = self.__render_toml_template(
+                    config
+                )
+            # Identifies the rendered config without keeping the secrets in plaintext.
+            self.fingerprint = hashlib.sha256(
+                rendered_config.encode("utf8")
+            ).hexdigest()
+            import toml
+
+            try:
+                self.configs = _plain_tables(toml.loads(rendered_config))
+            except toml.decoder.TomlDecodeError as e:
+                self.report.message("error", "[mask.config] " + e.__str__())
+                self.report.message("error", "Please revise your mask.config")
+                sys.exit(1)
+        else:
+            variables, self.configs, self.fingerprint, self.matcher = cached
+        # The env. variables referenced by mask.config.
+        self.variables = variables
+        # mask.config and the templates it includes (the daemon reloads the config
+        # when one of them changes).
+        self.config_files = [config_file, *(self.root_dir / name for name in includes)]
+        for var in variables:
+            if not os.environ.get(var):
+                self.report.message(
+                    "warning", f"Env. variable '{var}' in mask.config is not set."
+                )
+        self.ignore = IgnoreMatcher(self.configs.get("ignore", {}).get("files", []))
+        self.options = self.configs.get("options", {})
+        matcher = self.__option(
+            "matcher",
+            "literal",
+            lambda value: value in ["literal", "regex"],
+            "must be 'literal' or 'regex'.",
+        )
+        utf16 = self.__option(
+            "utf16", False, lambda value: isinstance(value, bool), "must be a boolean."
+        )
+        if cached is None:
+            self.configs.setdefault("show", {})
+            fingerprints = None
+            if "fingerprints" in self.configs:
+                fingerprints = self.__load_fingerprints()
+            self.matcher = SecretMatcher(
+                self.configs["show"],
+                regex=(matcher == "regex"),
+                utf16=utf16,
+                fingerprints=fingerprints,
+            )
+        self.binary = self.__option(
+            "binary",
+            "skip",
+            lambda value: value in ["skip", "scan"],
+            "must be 'skip' or 'scan'.",
+        )
+        self.workers = self.__option(
+            "workers",
+            1,
+            lambda value: isinstance(value, int) and value >= 0,
+            "must be 0 (all CPUs) or a positive integer.",
+        )
+        self.cache_size = self.__option(
+            "cache_size",
+            100000,
+            lambda value: isinstance(value, int) and value >= 0,
+            "must be 0 (no cache) or a positive integer.",
+        )
+        self.stream_threshold = self.__option(
+            "stream_threshold",
+            32 * 1024 * 1024,
+            lambda value: isinstance(value, int) and value >= 0,
+            "must be 0 (never stream) or a positive integer.",
+        )
+        self.backup = self.__option(
+            "backup",
+            "sibling",
+            lambda value: value in ["sibling", "store"],
+            "must be 'sibling' or 'store'.",
+        )
+        self.diff_only = self.__option(
+            "diff_only",
+            False,
+            lambda value: isinstance(value, bool),
+            "must be a boolean.",
+        )
+        self.pipeline = self.__option(
+            "pipeline",
+            False,
+            lambda value: isinstance(value, bool),
+            "must be a boolean.",
+        )
+        self.detector = None
+        if "detect" in self.configs:
+            self.__load_detector()
+        if cached is None and not includes:
+            # The cache is keyed on mask.config only, a change in the included
+            # templates wouldn't be seen.
+            config_cache.store(
+                config,
+                variables,
+                (variables, self.configs, self.fingerprint, self.matcher),
+            )
+
+    def __load_fingerprints(self) -> "FingerprintSet":
+        from ..fingerprint import FingerprintSet, parse_fingerprint
+
+        salt = self.__option(
+            "salt",
+            None,
+            lambda value: isinstance(value, str) and value != "",
+            "must be a non empty string.",
+            table="fingerprints",
+        )
+        secrets = self.__option(
+            "secrets",
+            [],
+            lambda value: isinstance(value, list)
+            and all(parse_fingerprint(entry) for entry in value),
+            "must be a list of { length, suffix, check, hash } tables "
+            "(see 'git-hooks fingerprint').",
+            table="fingerprints",
+        )
+        return FingerprintSet(map(parse_fingerprint, secrets), salt)
+
+    def __load_detector(self) -> None:
+        from ..detect import PATTERNS, SecretDetector
+
+        patterns = self.__option(
+            "patterns",
+            [*PATTERNS],
+            lambda value: isinstance(value, list)
+            and all(pattern in PATTERNS for pattern in value),
+            f"must be a list of: {', '.join(PATTERNS)}.",
+            table="detect",
+        )
+        entropy = self.__option(
+            "entropy",
+            4.5,
+            lambda value: isinstance(value, (int, float)) and 0 <= value <= 8,
+            "must be a number of bits per character (0 disables the entropy check).",
+            table="detect",
+        )
+        min_length = self.__option(
+            "min_length",
+            20,
+            lambda value: isinstance(value, int) and value >= 8,
+            "must be an integer of at least 8.",
+            table="detect",
+        )
+        self.detect_action = self.__option(
+            "action",
+            "warn",
+            lambda value: value in ["warn", "block"],
+            "must be 'warn' or 'block'.",
+            table="detect",
+        )
+        self.detector = SecretDetector(
+            patterns, entropy=entropy or None, min_length=min_length
+        )
+
+    def __option(
+        self,
+        name: str,
+        default: Any,
+        valid: Callable[[Any], bool],
+        message: str,
+        table: str = "options",
+    ) -> Any:
+        value = self.configs.get(table, {}).get(name, default)
+        if not valid(value):
+            self.report.message("error", f"[mask.config] '{name}' {message}")
             sys.exit(1)
+        return value
+
+    def __render_toml_template(self, config: bytes) -> tuple[list[str], str, list[str]]:
+        """Returns the env. variables referenced by mask.config and its rendering.
+
+        The last value lists the templates included or imported by mask.config,
+        directly or not (they are loaded from the root of the repo).
+        """
+        from jinja2 import Environment, FileSystemLoader, TemplateNotFound, meta
 
-    def __render_toml_template(self) -> str:
         jinja_env = Environment(loader=FileSystemLoader(str(self.root_dir)))
-        parsed_template = jinja_env.parse(
-            jinja_env.loader.get_source(jinja_env, "mask.config")
-        )
-        vars = meta.find_undeclared_variables(parsed_template)
+        source = config.decode("utf8")
+        parsed_template = jinja_env.parse(source)
+        vars = sorted(meta.find_undeclared_variables(parsed_template))
+        includes = []
+        pending = [parsed_template]
+        while pending:
+            # The names computed at render time (None) can't be known in advance.
+            for name in meta.find_referenced_templates(pending.pop()):
+                if name is None or name in includes:
+                    continue
+                includes.append(name)
+                try:
+                    included, _, _ = jinja_env.loader.get_source(jinja_env, name)
+                except TemplateNotFound:
+                    continue
+                pending.append(jinja_env.parse(included))
         env_vars = {var: os.environ.get(var, None) for var in vars}
-        for var, value in env_vars.items():
-            if not value:
-                print(
-                    PrettyOutput.warning(
-                        f"Env. variable '{var}' in mask.config is not set."
-                    )
-                )
         env_vars = {var: value for var, value in env_vars.items() if value}
-        template = jinja_env.get_template("mask.config")
+        template = jinja_env.from_string(source)
         result = template.render(env_vars)
-        result = re.sub(r"\n\s+=.*\n?", "\n", result)
-        return result
-
-    def __get_modified_files(self) -> list[pathlib.Path]:
-        cmd_str = "git diff-index --cached --name-only HEAD"
-        cmd_stdout = subprocess.run(cmd_str, capture_output=True, shell=True).stdout
-        files_modified = cmd_stdout.decode("utf8").strip().split("\n")
-        files_modified = [
-            pathlib.Path(file)
-            for file in files_modified
-            if file not in self.configs["ignore"]["files"]
-        ]
+        result = re.sub(r"(?m)^\s*=.*\n?", "", result)
+        return vars, result, includes
+
+    def __get_modified_files(
+        self, staged: Optional[list[StagedBlob]] = None
+    ) -> list[StagedBlob]:
+        if staged is None:
+            staged = staged_blobs(self.root_dir)
+        files_modified = [blob for blob in staged if not self.ignore.match(blob.path)]
         return files_modified
 
-    def __read_file(self, file: pathlib.Path) -> str:
-        with file.open(mode="r") as f:
-            file_content = f.read()
-        return file_content
+    def __backup_file(self, file: pathlib.Path) -> Optional[str]:
+        """Keeps a copy of the unmasked file before it's masked.
 
-    def __write_file(self, file: pathlib.Path, content: str) -> None:
-        with file.open(mode="w") as f:
-            f.write(content)
+        The copy is a reflink or a hard link (the masked file is written to a new
+        file renamed over the original) next to the file, or is added to the backup
+        store. Returns the sha of the file in the backup store, if it was used.
+        """
+        with self.timings.phase("backup"):
+            if self.backup == "sibling":
+                target = file.parent / ("_unmasked_" + file.name)
+                if clone_file(file, target) or link_file(file, target):
+                    return None
+            store = BackupStore(state_dir(self.root_dir) / "backups")
+            sha = store.add(file)
+            if self.backup == "sibling":
+                self.report.message(
+                    "warning",
+                    f"[BACKUP] {target.name} can't be a reflink or a hard link, the "
+                    f"unmasked copy of {file} is kept in {store.get(sha)} instead.",
+                )
+            return sha
 
-    @staticmethod
-    def __mask_data(key: str, show_char: int) -> str:
-        mask_stop = len(key) - show_char
-        return ("*" * mask_stop) + key[mask_stop:]
-
-    def mask(self) -> None:
-        modified_files = self.__get_modified_files()
-        if len(modified_files) == 0:
-            PrettyOutput.info("[MASK GITHOOK] There aren't any modified files.")
+    def __mask_index_only(
+        self, blobs: list[tuple[StagedBlob, Optional[bytes]]]
+    ) -> list[str]:
+        # The working tree has unstaged changes, so only the staged blobs are masked.
+        # Large blobs (without masked content) are streamed again from git.
+        with tempfile.TemporaryDirectory(
+            dir=state_dir(self.root_dir)
+        ) as tmp_dir, BlobReader(self.root_dir) as reader:
+            files = []
+            for idx, (blob, masked_content) in enumerate(blobs):
+                file = pathlib.Path(tmp_dir) / str(idx)
+                if masked_content is not None:
+                    file.write_bytes(masked_content)
+                else:
+                    with file.open(mode="wb") as f:
+                        for _, stream in reader.read_many([blob.sha], max_size=0):
+                            for chunk in self.matcher.mask_stream(stream):
+                                f.write(chunk)
+                files.append(file)
+            masked_shas = write_blobs(self.root_dir, files)
+        masked_blobs = [
+            StagedBlob(blob.path, sha, blob.mode)
+            for (blob, _), sha in zip(blobs, masked_shas)
+        ]
+        if len(masked_blobs) == len(blobs) and update_index_info(
+            self.root_dir, masked_blobs
+        ):
+            return []
+        return [blob.path for blob, _ in blobs]
+
+    def __record_masked_file(
+        self,
+        file: pathlib.Path,
+        blob_sha: str,
+        matches: list[tuple[int, bytes]],
+        backup: Optional[str],
+    ) -> None:
+        # The records are written to the unmask store at once, at the end of the run.
+        self.masked_records.append((file, blob_sha, matches, backup))
+
+    def __count_matches(self, matches: Optional[list]) -> Optional[dict[str, int]]:
+        # The secrets are identified like in the unmask store (salted hashes).
+        if matches is None or self.matcher.regex:
+            return None
+        # The fingerprinted secrets are only known once they are found.
+        known = self.__secret_ids or {}
+        missing = {secret for _, secret in matches if secret not in known}
+        if self.__secret_ids is None or missing:
+            from ..store import UnmaskStore
+
+            with UnmaskStore(state_dir(self.root_dir) / "unmask.db") as store:
+                if self.__secret_ids is None:
+                    self.__secret_ids = {
+                        secret: store.secret_id(secret).hex()
+                        for secret in self.matcher.byte_replacements
+                    }
+                for secret in missing:
+                    self.__secret_ids[secret] = store.secret_id(secret).hex()
+        counts = {}
+        for _, secret in matches:
+            secret_id = self.__secret_ids[secret]
+            counts[secret_id] = counts.get(secret_id, 0) + 1
+        return counts
+
+    def __file_result(
+        self,
+        path: str,
+        action: str,
+        size: int,
+        matches: Optional[list],
+        start: float,
+    ) -> None:
+        """Reports the result of a file (only if the report uses them).
+
+        The results of the masked files are kept until they are added to the index.
+        """
+        if not self.report.detailed:
+            return
+        result = FileResult(
+            path,
+            action,
+            size,
+            self.__count_matches(matches),
+            time.perf_counter() - start,
+        )
+        if action in ["masked", "masked_index"]:
+            self.file_results[path] = result
         else:
-            for file in modified_files:
-                try:
-                    file_content = self.__read_file(file)
-                except FileNotFoundError:
-                    continue
-                except PermissionError:
-                    continue
-                except IsADirectoryError:
+            self.report.file(result)
+
+    def __save_masked_records(self) -> None:
+        if not self.masked_records:
+            return
+        from ..store import UnmaskStore
+
+        with self.timings.phase("unmask store"), UnmaskStore(
+            state_dir(self.root_dir) / "unmask.db"
+        ) as store:
+            masked_secrets = {
+                store.secret_id(secret): masked
+                for secret, masked in self.matcher.byte_replacements.items()
+            }
+            # The backups of the previous records that no file uses anymore.
+            unused = []
+            for file, blob_sha, matches, backup in self.masked_records:
+                path = file.relative_to(self.root_dir).as_posix()
+                if self.matcher.regex:
+                    # A regex match isn't a known secret, it can't be restored exactly.
+                    unused.append(store.record(path, blob_sha, None, backup))
                     continue
+                masks = {offset: store.secret_id(secret) for offset, secret in matches}
+                previous = store.file(path)
+                if previous is not None and not previous.exact:
+                    # The secrets masked by the previous runs aren't known.
+                    masks = None
+                elif previous is not None:
+                    # Secrets masked by a previous run that are still in place.
+                    with file.open(mode="rb") as f:
+                        for offset, secret_id in store.masks(path):
+                            masked = masked_secrets.get(secret_id)
+                            if masked is None or offset in masks:
+                                continue
+                            f.seek(offset)
+                            if f.read(len(masked)) == masked:
+                                masks[offset] = secret_id
+                            else:
+                                # The file was edited and the masked secret moved,
+                                # all the masked secrets are replaced on unmask.
+                                masks = None
+                                break
+                unused.append(
+                    store.record(
+                        path,
+                        blob_sha,
+                        None if masks is None else sorted(masks.items()),
+                        backup,
+                    )
+                )
+            backups = BackupStore(state_dir(self.root_dir) / "backups")
+            for sha in filter(None, unused):
+                backups.remove(sha)
+        self.masked_records = []
+
+    def __mask_working_tree_stream(self, file: pathlib.Path) -> Optional[list]:
+        # Masks the file chunk by chunk, so the memory used doesn't depend on its size.
+        # Returns the matches, or None if the file wasn't masked.
+        matches = []
+        try:
+            backup = self.__backup_file(file)
+            with file.open(mode="rb") as source, tempfile.NamedTemporaryFile(
+                mode="wb", dir=file.parent, delete=False
+            ) as target:
+                # Masking keeps the size of the file.
+                hasher = blob_hasher(os.fstat(source.fileno()).st_size)
+                chunks = iter(lambda: source.read(STREAM_CHUNK_SIZE), b"")
+                for chunk in self.matcher.mask_stream(chunks, matches):
+                    hasher.update(chunk)
+                    target.write(chunk)
+                target.flush()
+                os.fsync(target.fileno())
+            shutil.copymode(file, target.name)
+            os.replace(target.name, file)
+        except (FileNotFoundError, PermissionError, IsADirectoryError):
+            return None
+        self.__record_masked_file(file, hasher.hexdigest(), matches, backup)
+        return matches
+
+    def __mask_working_tree(self, file: pathlib.Path) -> Optional[list]:
+        # The file is scanned as bytes through a memory map, it's never decoded.
+        # Returns the matches, or None if the file wasn't masked.
+        matches = []
+        try:
+            with file.open(mode="rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                    masked_content = _mask_content(
+                        self.matcher, content, self.binary, matches
+                    )
+        except FileNotFoundError:
+            return None
+        except PermissionError:
+            return None
+        except IsADirectoryError:
+            return None
+
+        if masked_content is not None:
+            backup = self.__backup_file(file)
+            write_atomic(file, masked_content)
+            hasher = blob_hasher(len(masked_content))
+            hasher.update(masked_content)
+            self.__record_masked_file(file, hasher.hexdigest(), matches, backup)
+            return matches
+        return None
+
+    def __mask_working_tree_hunks(
+        self, file: pathlib.Path, hunks: list[AddedHunk]
+    ) -> Optional[list]:
+        try:
+            content = file.read_bytes()
+        except (FileNotFoundError, PermissionError, IsADirectoryError):
+            return None
+        if self.binary == "skip" and is_binary(content[:BINARY_SNIFF_SIZE]):
+            return None
+        matches = []
+        masked_content = _mask_hunks(self.matcher, content, hunks, matches)
+        if masked_content == content:
+            return None
+        backup = self.__backup_file(file)
+        write_atomic(file, masked_content)
+        hasher = blob_hasher(len(masked_content))
+        hasher.update(masked_content)
+        self.__record_masked_file(file, hasher.hexdigest(), matches, backup)
+        return matches
+
+    def __mask_staged_hunks(
+        self,
+    ) -> tuple[list[str], list[tuple[StagedBlob, Optional[bytes]]]]:
+        """Scans and masks only the lines added to the staged files.
 
-                original_content = file_content
-
-                for mask_key, show_char_count in self.configs["show"].items():
-                    # mask_stop = len(mask_key) - show_char_count
-                    # replacement = ("*" * mask_stop) + mask_key[mask_stop:]
-                    replacement = self.__mask_data(mask_key, show_char_count)
-                    file_content = re.sub(mask_key, replacement, file_content)
-
-                if original_content != file_content:
-                    shutil.copy2(file, file.parent / ("_unmasked_" + file.name))
-                    self.__write_file(file, file_content)
-                    subprocess.run(f"git add {str(file)}", shell=True)
-                    # Write a .masked file
-                    masked_file = self.root_dir / ".ghunmask"
-                    mode = "+r" if masked_file.exists() else "w"
-                    with masked_file.open(mode=mode) as f:
-                        if mode == "w":
-                            f.write(str(file.absolute()))
+        The diff is read as a stream, so the work depends on the size of the change
+        and not on the size of the files. Returns the masked working tree files and
+        the staged blobs to mask in the index only.
+        """
+        # git treats UTF-16 files as binary, they are only diffed as text on demand.
+        text = self.binary == "scan" or self.matcher.utf16
+        unstaged = None
+        masked_files = []
+        index_only_hunks = []
+        # The ignored paths are excluded from the diff by git.
+        hunks_by_file = self.timings.iterate(
+            "diff",
+            staged_hunks(self.root_dir, text=text, pathspecs=self.ignore.pathspecs()),
+        )
+        start = time.perf_counter()
+        for blob, hunks in hunks_by_file:
+            if self.ignore.match(blob.path):
+                continue
+            size = sum(len(hunk.content) for hunk in hunks)
+            if self.detector is not None:
+                self.detect_hunks.append((blob.path, hunks))
+            hunks = [hunk for hunk in hunks if self.matcher.search(hunk.content)]
+            if not hunks:
+                self.__file_result(blob.path, "clean", size, [], start)
+                start = time.perf_counter()
+                continue
+            if unstaged is None:
+                unstaged = unstaged_paths(self.root_dir)
+            if blob.path in unstaged:
+                index_only_hunks.append((blob, hunks, size, start))
+            else:
+                with self.timings.phase("mask working tree"):
+                    matches = self.__mask_working_tree_hunks(
+                        self.root_dir / blob.path, hunks
+                    )
+                if matches is not None:
+                    masked_files.append(blob.path)
+                self.__file_result(
+                    blob.path,
+                    "skipped" if matches is None else "masked",
+                    size,
+                    matches,
+                    start,
+                )
+            start = time.perf_counter()
+
+        index_only_files = []
+        if index_only_hunks:
+            with BlobReader(self.root_dir) as reader:
+                contents = reader.read_many(blob.sha for blob, *_ in index_only_hunks)
+                for (blob, hunks, size, start), (_, content) in zip(
+                    index_only_hunks, contents
+                ):
+                    if content is None or (
+                        self.binary == "skip" and is_binary(content[:BINARY_SNIFF_SIZE])
+                    ):
+                        self.__file_result(blob.path, "skipped", size, None, start)
+                        continue
+                    matches = []
+                    index_only_files.append(
+                        (blob, _mask_hunks(self.matcher, content, hunks, matches))
+                    )
+                    self.__file_result(blob.path, "masked_index", size, matches, start)
+        return masked_files, index_only_files
+
+    def __scan(
+        self, modified_files: list[StagedBlob], workers: int
+    ) -> Iterator[tuple[StagedBlob, bool, Optional[bytes], int]]:
+        """Yields each staged file, if it needs masking, its masked content and size.
+
+        The files are yielded in the staged order. Blobs larger than the stream
+        threshold are scanned chunk by chunk and their masked content is None.
+        """
+        max_size = None
+        if self.stream_threshold and self.matcher.streamable:
+            max_size = self.stream_threshold
+        with BlobReader(self.root_dir) as reader:
+            contents = reader.read_many(
+                (blob.sha for blob in modified_files),
+                max_size=max_size,
+                chunk_size=STREAM_CHUNK_SIZE,
+            )
+            if workers == 1 or len(modified_files) < 2:
+                for blob, (_, content) in zip(modified_files, contents):
+                    if isinstance(content, BlobStream):
+                        yield blob, _stream_needs_masking(
+                            self.matcher, content, self.binary
+                        ), None, content.size
+                    else:
+                        masked_content = _mask_content(
+                            self.matcher, content, self.binary
+                        )
+                        yield blob, masked_content is not None, masked_content, len(
+                            content or b""
+                        )
+                return
+
+            from concurrent.futures import Future, ProcessPoolExecutor
+
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_scan_worker,
+                initargs=(self.matcher, self.binary),
+            ) as pool:
+                # Keep a bounded window of pending scans, so reading the next blobs
+                # overlaps with scanning without loading the whole changeset.
+                pending = deque()
+                for blob, (_, content) in zip(modified_files, contents):
+                    if isinstance(content, BlobStream):
+                        # Streams are read from the shared pipe, so they are
+                        # scanned here.
+                        future = Future()
+                        future.set_result(
+                            _stream_needs_masking(self.matcher, content, self.binary)
+                        )
+                        pending.append((blob, future, True, content.size))
+                    else:
+                        future = pool.submit(_scan_worker, content)
+                        pending.append((blob, future, False, len(content or b"")))
+                    if len(pending) >= workers * 4:
+                        yield self.__scan_result(*pending.popleft())
+                while pending:
+                    yield self.__scan_result(*pending.popleft())
+
+    @staticmethod
+    def __scan_result(
+        blob: StagedBlob, future: "Future", streamed: bool, size: int
+    ) -> tuple[StagedBlob, bool, Optional[bytes], int]:
+        result = future.result()
+        if streamed:
+            return blob, bool(result), None, size
+        return blob, result is not None, result, size
+
+    def open_scan_cache(self) -> "ScanCache":
+        from ..cache import ScanCache
+
+        return ScanCache(
+            state_dir(self.root_dir) / "scan-cache.db",
+            self.fingerprint,
+            self.cache_size,
+        )
+
+    def __lookup_scan_cache(
+        self, modified_files: list[StagedBlob]
+    ) -> tuple[Optional["ScanCache"], list[StagedBlob]]:
+        """Opens the scan cache and drops the blobs that are known to be clean."""
+        if not self.cache_size:
+            return None, modified_files
+        from ..cache import CLEAN
+
+        cache = self.scan_cache or self.open_scan_cache()
+        # Blobs that are known to be clean are never read again.
+        with self.timings.phase("scan cache"):
+            cached = cache.lookup(blob.sha for blob in modified_files)
+        start = time.perf_counter()
+        for blob in modified_files:
+            if cached.get(blob.sha) == CLEAN:
+                self.__file_result(blob.path, "cached", 0, [], start)
+        return cache, [blob for blob in modified_files if cached.get(blob.sha) != CLEAN]
+
+    def __close_scan_cache(self, cache: Optional["ScanCache"]) -> None:
+        if cache is None:
+            return
+        with self.timings.phase("scan cache"):
+            if cache is self.scan_cache:
+                cache.flush()
+            else:
+                cache.close()
+
+    def __mask_file(
+        self, file: pathlib.Path, masked_content: Optional[bytes]
+    ) -> Optional[list]:
+        # Large blobs are scanned as streams, so their masked content isn't kept.
+        with self.timings.phase("mask working tree"):
+            if masked_content is None:
+                return self.__mask_working_tree_stream(file)
+            return self.__mask_working_tree(file)
+
+    def __apply_scan_results(
+        self,
+        results: Iterable[tuple[StagedBlob, bool, Optional[bytes], int]],
+        cache: Optional["ScanCache"],
+        unstaged: Callable[[], set[str]],
+        index_only_files: list[tuple[StagedBlob, Optional[bytes]]],
+    ) -> list[str]:
+        """Applies the scan results, in order, and returns the masked files.
+
+        The results are recorded in the scan cache. The files with unstaged changes
+        are added to 'index_only_files', the others are masked in the working tree.
+        'unstaged' returns the paths with unstaged changes (only called if a file
+        needs masking).
+        """
+        from ..cache import CLEAN, NEEDS_MASKING
+
+        masked_files = []
+        start = time.perf_counter()
+        for blob, needs_masking, masked_content, size in results:
+            if cache is not None:
+                cache.store(blob.sha, NEEDS_MASKING if needs_masking else CLEAN)
+            if not needs_masking:
+                self.__file_result(blob.path, "clean", size, [], start)
+                start = time.perf_counter()
+                continue
+            if blob.path in unstaged():
+                index_only_files.append((blob, masked_content))
+                # The matches of the staged version aren't collected by the scan.
+                self.__file_result(blob.path, "masked_index", size, None, start)
+                start = time.perf_counter()
+                continue
+            matches = self.__mask_file(self.root_dir / blob.path, masked_content)
+            if matches is not None:
+                masked_files.append(blob.path)
+            self.__file_result(
+                blob.path,
+                "skipped" if matches is None else "masked",
+                size,
+                matches,
+                start,
+            )
+            start = time.perf_counter()
+        return masked_files
+
+    def __mask_staged_blobs(
+        self, modified_files: list[StagedBlob], workers: int
+    ) -> tuple[list[str], list[tuple[StagedBlob, Optional[bytes]]]]:
+        """Scans and masks the whole staged files.
+
+        Returns the masked working tree files and the staged blobs to mask in the
+        index only.
+        """
+        cache, modified_files = self.__lookup_scan_cache(modified_files)
+        # The staged blobs are scanned, so the result matches what will be
+        # committed. The working tree is only touched for files that need masking.
+        # Results are applied here, in the staged order, even when scanning runs
+        # in parallel.
+        index_only_files = []
+        scan = self.timings.iterate(
+            "read and scan", self.__scan(modified_files, workers)
+        )
+        masked_files = self.__apply_scan_results(
+            scan,
+            cache,
+            functools.cache(functools.partial(unstaged_paths, self.root_dir)),
+            index_only_files,
+        )
+        self.__close_scan_cache(cache)
+        return masked_files, index_only_files
+
+    def __mask_staged_pipeline(
+        self, modified_files: list[StagedBlob], workers: int
+    ) -> tuple[list[str], list[tuple[StagedBlob, Optional[bytes]]], list[str]]:
+        """Like __mask_staged_blobs, with the stages running at the same time.
+
+        Also adds the masked files to the index, and returns the rejected paths.
+        """
+        import asyncio
+
+        cache, modified_files = self.__lookup_scan_cache(modified_files)
+        try:
+            with self.timings.phase("pipeline", len(modified_files)):
+                return asyncio.run(self.__pipeline(modified_files, cache, workers))
+        finally:
+            self.__close_scan_cache(cache)
+
+    async def __pipeline(
+        self,
+        modified_files: list[StagedBlob],
+        cache: Optional["ScanCache"],
+        workers: int,
+    ) -> tuple[list[str], list[tuple[StagedBlob, Optional[bytes]]], list[str]]:
+        """Runs the read, scan, mask and index stages concurrently.
+
+        The blobs are read from 'git cat-file' in a thread, scanned in the worker
+        processes (or a thread), masked in the working tree in threads and streamed
+        to a 'git update-index' process. The stages are connected by bounded
+        queues, so a slow stage holds back the others instead of the changeset
+        piling up in memory. The results are applied in the staged order.
+        """
+        import asyncio
+        import threading
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        loop = asyncio.get_running_loop()
+        stopped = threading.Event()
+        # The blobs go through the stages in batches, not one by one.
+        read_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        # Bounds the number of batches being scanned.
+        scan_queue = asyncio.Queue(workers * 2)
+        index_queue = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        masked_files = []
+        index_only_files = []
+
+        def read() -> None:
+            def put(batch: Optional[list]) -> None:
+                asyncio.run_coroutine_threadsafe(read_queue.put(batch), loop).result()
+
+            max_size = None
+            if self.stream_threshold and self.matcher.streamable:
+                max_size = self.stream_threshold
+            try:
+                with BlobReader(self.root_dir) as reader:
+                    contents = reader.read_many(
+                        (blob.sha for blob in modified_files),
+                        max_size=max_size,
+                        chunk_size=STREAM_CHUNK_SIZE,
+                    )
+                    batch, batch_size = [], 0
+                    for blob, (_, content) in self.timings.iterate(
+                        "read", zip(modified_files, contents)
+                    ):
+                        if stopped.is_set():
+                            return
+                        if isinstance(content, BlobStream):
+                            # Streams are read from the shared pipe, so they are
+                            # scanned here.
+                            needs_masking = _stream_needs_masking(
+                                self.matcher, content, self.binary
+                            )
+                            batch.append((blob, needs_masking, True, content.size))
                         else:
-                            contents = f.read()
-                            if file.name not in contents:
-                                f.seek(0)
-                                f.write(contents.strip() + f"\n{str(file.absolute())}")
-                                f.truncate()
-
-                    print(
-                        PrettyOutput.success(
-                            f"[MASK GITHOOK] Sensitive data were masked in: {file.absolute()}"
+                            size = len(content or b"")
+                            batch.append((blob, content, False, size))
+                            batch_size += size
+                        if batch_size >= PIPELINE_BATCH_SIZE or len(batch) >= 256:
+                            put(batch)
+                            batch, batch_size = [], 0
+                    if batch:
+                        put(batch)
+            finally:
+                if not stopped.is_set():
+                    put(None)
+
+        async def scan(executor) -> None:
+            while (batch := await read_queue.get()) is not None:
+                contents = [
+                    None if streamed else content for _, content, streamed, _ in batch
+                ]
+                if workers == 1:
+                    future = loop.run_in_executor(
+                        executor, _scan_batch, self.matcher, self.binary, contents
+                    )
+                else:
+                    future = loop.run_in_executor(
+                        executor, _scan_batch_worker, contents
+                    )
+                await scan_queue.put((batch, future))
+            await scan_queue.put(None)
+
+        async def mask() -> None:
+            unstaged = functools.cache(functools.partial(unstaged_paths, self.root_dir))
+            while (item := await scan_queue.get()) is not None:
+                batch, future = item
+                results = [
+                    (blob, content if streamed else result is not None, result, size)
+                    for (blob, content, streamed, size), result in zip(
+                        batch, await future
+                    )
+                ]
+                # The working tree files of a batch are masked in a thread.
+                masked_paths = await asyncio.to_thread(
+                    self.__apply_scan_results,
+                    results,
+                    cache,
+                    unstaged,
+                    index_only_files,
+                )
+                if masked_paths:
+                    masked_files.extend(masked_paths)
+                    await index_queue.put(masked_paths)
+            await index_queue.put(None)
+
+        async def add_to_index() -> list[str]:
+            # 'git update-index' hashes every file as soon as it gets its path, and
+            # writes the index once, at the end.
+            process = None
+            paths = []
+            try:
+                while (batch := await index_queue.get()) is not None:
+                    if process is None:
+                        process = await asyncio.create_subprocess_exec(
+                            "git",
+                            "update-index",
+                            "-z",
+                            "--add",
+                            "--stdin",
+                            cwd=self.root_dir,
+                            stdin=asyncio.subprocess.PIPE,
+                            stdout=asyncio.subprocess.DEVNULL,
+                            stderr=asyncio.subprocess.DEVNULL,
                         )
+                    process.stdin.write(
+                        b"".join(encode_path(path) + b"\0" for path in batch)
                     )
+                    await process.stdin.drain()
+                    paths += batch
+                if process is None:
+                    return []
+                process.stdin.close()
+                if await process.wait() == 0:
+                    return []
+            finally:
+                if process is not None and process.returncode is None:
+                    # Interrupted, the index isn't written.
+                    process.terminate()
+                    await process.wait()
+            # git rejected a path and didn't write the index, the paths are added
+            # again without the rejected ones.
+            with self.timings.phase("update index", len(paths)):
+                return await asyncio.to_thread(update_index, self.root_dir, paths)
 
-    def reverse_mask(self, file: str):
-        masked_secrets = OrderedDict(
-            [
-                (self.__mask_data(key, show), key)
-                for key, show in self.configs["show"].items()
+        if workers == 1:
+            # The scans run in a thread, while git reads and writes the blobs.
+            executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_scan_worker,
+                initargs=(self.matcher, self.binary),
+            )
+            # The workers are started before git is, so they don't inherit its
+            # pipes (git would never see the end of its input).
+            await loop.run_in_executor(executor, int)
+        with executor:
+            reader = asyncio.ensure_future(asyncio.to_thread(read))
+            tasks = [
+                reader,
+                asyncio.ensure_future(scan(executor)),
+                asyncio.ensure_future(mask()),
+                asyncio.ensure_future(add_to_index()),
             ]
-        )
-        mask_count = 0
-        _masked_secrets = masked_secrets.copy()
-        for masked, original in _masked_secrets.items():
-            if all([c == "*" for c in masked]):
-                if len(masked) > mask_count:
-                    mask_count = len(masked)
-                    masked_secrets.move_to_end(masked, last=False)
+            try:
+                *_, rejected = await asyncio.gather(*tasks)
+            except BaseException:
+                stopped.set()
+                for task in tasks[1:]:
+                    task.cancel()
+                # Unblock the reader thread, it stops at the next blob.
+                while not reader.done():
+                    while not read_queue.empty():
+                        read_queue.get_nowait()
+                    await asyncio.wait([reader], timeout=0.01)
+                raise
+        return masked_files, index_only_files, rejected
+
+    def mask(
+        self,
+        workers: Optional[int] = None,
+        staged: Optional[list[StagedBlob]] = None,
+        diff_only: Optional[bool] = None,
+        pipeline: Optional[bool] = None,
+    ) -> None:
+        """Masks the secrets in the staged files and adds them to the index.
+
+        'workers', 'diff_only' and 'pipeline' override the mask.config options.
+        """
+        diff_only = self.diff_only if diff_only is None else diff_only
+        pipeline = self.pipeline if pipeline is None else pipeline
+        self.masked_records = []
+        self.file_results = {}
+        self.detect_hunks = []
+        # The paths rejected by git, when the files were added to the index already.
+        rejected = None
+        if diff_only:
+            masked_files, index_only_files = self.__mask_staged_hunks()
+        else:
+            with self.timings.phase("staged files"):
+                modified_files = self.__get_modified_files(staged)
+            if len(modified_files) == 0:
+                self.report.message(
+                    "info", "[MASK GITHOOK] There aren't any modified files."
+                )
+                return
+            workers = self.workers if workers is None else workers
+            workers = workers or os.cpu_count() or 1
+            if pipeline:
+                (
+                    masked_files,
+                    index_only_files,
+                    rejected,
+                ) = self.__mask_staged_pipeline(modified_files, workers)
+            else:
+                masked_files, index_only_files = self.__mask_staged_blobs(
+                    modified_files, workers
+                )
+
+        self.__save_masked_records()
+        if rejected is None:
+            # All the masked files are added to the index at once.
+            with self.timings.phase("update index", len(masked_files)):
+                rejected = update_index(self.root_dir, masked_files)
+        if index_only_files:
+            with self.timings.phase("mask index only", len(index_only_files)):
+                rejected += self.__mask_index_only(index_only_files)
+        for path, result in self.file_results.items():
+            if path in rejected:
+                result = result._replace(action="rejected")
+            self.report.file(result)
+        for path in masked_files:
+            if path not in rejected:
+                self.report.message(
+                    "success",
+                    f"[MASK GITHOOK] Sensitive data were masked in: {(self.root_dir / path).absolute()}",
+                )
+        for blob, _ in index_only_files:
+            if blob.path not in rejected:
+                self.report.message(
+                    "warning",
+                    f"[MASK GITHOOK] Sensitive data were masked in the staged version of: {blob.path}. "
+                    "The file has unstaged changes, so the working tree copy was not modified.",
+                )
+        for path in rejected:
+            self.report.message(
+                "error",
+                f"[MASK GITHOOK] The masked file could not be added to the index: {path}",
+            )
+        blocked = False
+        if self.detector is not None:
+            with self.timings.phase("detect"):
+                if diff_only:
+                    detections = [*self.__detect_hunks()]
+                else:
+                    detections = [*self.__detect_staged(modified_files)]
+            blocked = self.__report_detections(detections)
+        if rejected or blocked:
+            sys.exit(1)
+
+    def __detect_staged(
+        self, modified_files: list[StagedBlob]
+    ) -> Iterator[tuple[str, list]]:
+        """Runs the detector on the staged files, once they are masked."""
+        paths = {blob.path for blob in modified_files}
+        # The masked files have new blobs in the index.
+        blobs = [blob for blob in staged_blobs(self.root_dir) if blob.path in paths]
+        max_size = self.stream_threshold or None
+        with BlobReader(self.root_dir) as reader:
+            contents = reader.read_many(
+                (blob.sha for blob in blobs),
+                max_size=max_size,
+                chunk_size=STREAM_CHUNK_SIZE,
+            )
+            for blob, (_, content) in zip(blobs, contents):
+                if content is None:
+                    continue
+                if isinstance(content, BlobStream):
+                    chunks = iter(content)
+                    head = next(chunks, b"")
+                    if self.binary == "skip" and is_binary(head):
+                        content.drain()
+                        continue
+                    yield blob.path, self.detector.detect_stream(
+                        itertools.chain([head], chunks)
+                    )
+                elif not (
+                    self.binary == "skip" and is_binary(content[:BINARY_SNIFF_SIZE])
+                ):
+                    yield blob.path, self.detector.detect(content)
+
+    def __detect_hunks(self) -> Iterator[tuple[str, list]]:
+        """Runs the detector on the added lines (masked), in diff only mode."""
+        for path, hunks in self.detect_hunks:
+            detections = []
+            for hunk in hunks:
+                masked = self.matcher.mask(hunk.content)
+                detections += self.detector.detect(masked, hunk.start)
+            yield path, detections
+
+    def __report_detections(self, detections: Iterable[tuple[str, list]]) -> bool:
+        """Reports the detected secrets. Returns True if the commit is blocked."""
+        level = "error" if self.detect_action == "block" else "warning"
+        found = False
+        for path, file_detections in detections:
+            for detection in file_detections:
+                found = True
+                self.report.message(
+                    level,
+                    f"[DETECT] Possible {detection.kind} secret in {path}:{detection.line}: {detection.preview}",
+                )
+        if found and self.detect_action == "block":
+            self.report.message(
+                "error",
+                "[DETECT] The commit is aborted. Add the secrets to the [show] table of mask.config "
+                "to mask them, or set 'action = \"warn\"' in the [detect] table.",
+            )
+            return True
+        return False
+
+    def __unmask(
+        self, jobs: list[tuple], secrets: dict, workers: int, dry_run: bool
+    ) -> Iterator[tuple[int, bool, Optional[str]]]:
+        """Yields the result of each (file, masks, backup) job, in order."""
+        reverse = self.matcher.reversed()
+        if workers == 1 or len(jobs) < 2:
+            for file, masks, backup in jobs:
+                yield _unmask_file(reverse, secrets, file, masks, dry_run, backup)
+            return
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_unmask_worker,
+            initargs=(reverse, secrets),
+        ) as pool:
+            yield from pool.map(
+                _unmask_worker,
+                [(file, masks, dry_run, backup) for file, masks, backup in jobs],
+                chunksize=max(1, len(jobs) // (workers * 4)),
+            )
+
+    @staticmethod
+    def __usable_backup(
+        backups: BackupStore, file: pathlib.Path, record: "MaskedFile"
+    ) -> Optional[str]:
+        """Returns the backup of the file, if the file didn't change since then."""
+        if record.backup is None or not backups.get(record.backup).exists():
+            return None
+        try:
+            with file.open(mode="rb") as f:
+                hasher = blob_hasher(os.fstat(f.fileno()).st_size)
+                for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+                    hasher.update(chunk)
+        except OSError:
+            return None
+        return record.backup if hasher.hexdigest() == record.blob else None
 
+    def reverse_mask(
+        self, file: str, workers: Optional[int] = None, dry_run: bool = False
+    ):
+        """Puts the secrets back in the masked files (or only in 'file').
+
+        The files are processed on 'workers' processes (defaults to 'workers' in
+        mask.config, 0 uses all CPUs). Only the files that had masked secrets are
+        rewritten and reported. With 'dry_run', the number of secrets that would be
+        restored in each file is reported and nothing is changed.
+        """
+        from ..store import UnmaskStore
+
+        store = UnmaskStore(state_dir(self.root_dir) / "unmask.db")
+        secrets = {
+            store.secret_id(secret): (secret, masked)
+            for secret, masked in self.matcher.byte_replacements.items()
+        }
+        if self.matcher.fingerprints is not None:
+            self.report.message(
+                "warning",
+                "[UNMASK] The secrets of the [fingerprints] table can't be restored, "
+                "get them from the unmasked copies of the files.",
+            )
         if not file:
+            masked_files = [self.root_dir / path for path in store.paths()]
+            # Files listed by older versions in the .ghunmask file.
             ghunmask_file = self.root_dir / ".ghunmask"
             if ghunmask_file.exists():
                 with ghunmask_file.open("r") as f:
-                    masked_files = [
-                        pathlib.Path(file.strip()) for file in f.readlines()
+                    masked_files += [
+                        pathlib.Path(file.strip())
+                        for file in f.readlines()
+                        if file.strip()
                     ]
-            else:
-                print(
-                    PrettyOutput.error(
-                        "[UNMASK] Can not find .ghunmask in repo root. use 'git-hooks exec -rf /path/to/file' mask instead."
-                    )
+            if not masked_files:
+                store.close()
+                self.report.message(
+                    "error",
+                    "[UNMASK] There aren't any masked files recorded in this repo. use 'git-hooks exec -rf /path/to/file' mask instead.",
                 )
                 sys.exit(1)
         else:
             masked_files = [pathlib.Path(file)]
 
+        backups = BackupStore(state_dir(self.root_dir) / "backups")
+        # (file, path in the store, recorded masks, backup, secrets restored by the
+        # backup) of each file, once.
+        files = {}
         for mfile in masked_files:
+            resolved = mfile.resolve()
+            if resolved in files:
+                continue
             try:
-                with mfile.open("+r") as f:
-                    content = f.read()
-                    new_content = content
-                    for masked, original in masked_secrets.items():
-                        new_content = new_content.replace(masked, original)
-                    if content != new_content:
-                        f.seek(0)
-                        f.write(new_content)
-                        f.truncate()
-                print(
-                    PrettyOutput.success(f"File {str(mfile.absolute())} is unmasked.")
-                )
-            except Exception as e:
-                print(
-                    PrettyOutput.warning(f"Can not open file {str(mfile.absolute())}.")
-                )
-                print(e)
+                path = resolved.relative_to(self.root_dir.resolve()).as_posix()
+            except ValueError:
+                path = None
+            record = store.file(path) if path else None
+            if record is None:
+                path = None
+            masks, backup, from_backup = None, None, 0
+            if record is not None and record.exact:
+                recorded = store.masks(path)
+                backup = self.__usable_backup(backups, resolved, record)
+                if backup is not None:
+                    # The unmasked copy is restored, the secrets masked by the
+                    # previous runs are still masked in it.
+                    still_masked = _masked_in(backups.get(backup), recorded, secrets)
+                    from_backup = len(recorded) - len(still_masked)
+                    recorded = still_masked
+                # Only the [show] secrets can be put back.
+                masks = [
+                    (offset, secret_id)
+                    for offset, secret_id in recorded
+                    if secret_id in secrets
+                ]
+            files[resolved] = (mfile, path, masks, backup, from_backup)
+
+        workers = self.workers if workers is None else workers
+        workers = workers or os.cpu_count() or 1
+        jobs = [
+            (mfile, masks, backup and (backups, backup))
+            for mfile, _, masks, backup, _ in files.values()
+        ]
+        results = self.__unmask(jobs, secrets, workers, dry_run)
+        unmasked, restored = 0, 0
+        for (mfile, path, masks, backup, from_backup), (count, exact, error) in zip(
+            files.values(), self.timings.iterate("unmask", results)
+        ):
+            if error is not None:
+                self.report.message(
+                    "warning", f"Can not open file {str(mfile.absolute())}.\n{error}"
+                )
+                continue
+            count += from_backup
+            if masks is not None and not exact:
+                self.report.message(
+                    "warning",
+                    f"File {str(mfile.absolute())} changed since it was masked, "
+                    "all the masked secrets are replaced instead.",
+                )
+            if path is not None and not dry_run:
+                unused = store.remove(path)
+                if unused is not None and unused == backup:
+                    backups.remove(unused)
+                elif unused is not None:
+                    # The file changed since it was masked, the copy wasn't used.
+                    self.report.message(
+                        "warning",
+                        f"The unmasked copy of {str(mfile.absolute())} is kept in "
+                        f"{backups.get(unused)}, delete it once it isn't needed.",
+                    )
+            if not count:
+                # Nothing was masked in the file, it's left untouched.
                 continue
+            unmasked += 1
+            restored += count
+            secrets_text = f"{count} secret" + ("s" if count > 1 else "")
+            if dry_run:
+                self.report.message(
+                    "info",
+                    f"File {str(mfile.absolute())} would be unmasked ({secrets_text}).",
+                )
+            else:
+                self.report.message(
+                    "success",
+                    f"File {str(mfile.absolute())} is unmasked ({secrets_text}).",
+                )
+        store.close()
+        verb = "would be" if dry_run else ("was" if restored == 1 else "were")
+        secrets_text = f"{restored} secret" + ("" if restored == 1 else "s")
+        self.report.message(
+            "info",
+            f"[UNMASK] {secrets_text} {verb} restored in {unmasked} of {len(files)} files.",
+        )
+
+
+def main(root_dir: Optional[pathlib.Path] = None) -> int:
+    """Runs the mask hook in-process (used by the pre-commit script).
+
+    Returns the exit status of the hook, so a failure blocks the commit.
+    """
+    # git runs the hooks from the root of the working tree.
+    root_dir = root_dir or pathlib.Path.cwd()
+    staged = staged_blobs(root_dir)
+    if not staged:
+        # Nothing to scan, don't even load mask.config.
+        return 0
+    # A running daemon has the config and the matcher already loaded.
+    from ..daemon import request
+
+    response = request(root_dir)
+    if response is not None:
+        sys.stdout.write(response["output"])
+        return response["status"]
+    # The output is written at once, when the hook is done.
+    with TextReport() as report:
+        try:
+            MaskGitHook(root_dir, report=report).mask(staged=staged)
+        except NoConfigurationFileFound as e:
+            print(e)
+            return 1
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+    return 0
+
+
+def pre_push(
+    remote: str, refs: Iterable[str], root_dir: Optional[pathlib.Path] = None
+) -> int:
+    """Scans the commits being pushed (used by the pre-push script).
+
+    'refs' are the "<local ref> <local sha> <remote ref> <remote sha>" lines git
+    passes to the hook. Only the blobs of the commits that the remote doesn't have
+    are scanned, each once. Returns 1 (the push is aborted) if a secret is found.
+    """
+    from ..scan import HistoryScan
+
+    root_dir = root_dir or pathlib.Path.cwd()
+    revs = []
+    for line in refs:
+        fields = line.split()
+        if len(fields) != 4 or fields[1] == NULL_SHA:
+            # A deleted remote ref doesn't push any commit.
+            continue
+        _, local_sha, _, remote_sha = fields
+        revs.append(local_sha)
+        if remote_sha != NULL_SHA and object_exists(root_dir, remote_sha):
+            revs.append("^" + remote_sha)
+    if not revs:
+        return 0
+    # The commits that are already on the remote (as far as we know) are skipped.
+    revs += ["--not", f"--remotes={remote}"]
+    try:
+        history_scan = HistoryScan(root_dir, revs, checkpoint=False)
+    except NoConfigurationFileFound as e:
+        print(e)
+        return 1
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 1
+    if history_scan.run():
+        print(
+            PrettyOutput.error(
+                "[MASK GITHOOK] The push is aborted, the commits being pushed contain sensitive data."
+            )
+        )
+        return 1
+    return 0
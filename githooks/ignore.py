@@ -0,0 +1,114 @@
+import re
+from typing import Iterable
+
+GLOB_CHARS = "*?[\\"
+
+
+def _glob_regex(pattern: str) -> str:
+    """Translates a gitignore style glob to a regex ('*' doesn't match '/')."""
+    regex = []
+    idx = 0
+    while idx < len(pattern):
+        if pattern.startswith("**/", idx):
+            regex.append("(?:.*/)?")
+            idx += 3
+        elif pattern.startswith("**", idx):
+            regex.append(".*")
+            idx += 2
+        elif pattern[idx] == "*":
+            regex.append("[^/]*")
+            idx += 1
+        elif pattern[idx] == "?":
+            regex.append("[^/]")
+            idx += 1
+        elif pattern[idx] == "[" and "]" in pattern[idx + 2 :]:
+            end = pattern.index("]", idx + 2)
+            chars = pattern[idx + 1 : end]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            regex.append("[" + chars.replace("\\", "\\\\") + "]")
+            idx = end + 1
+        elif pattern[idx] == "\\" and idx + 1 < len(pattern):
+            regex.append(re.escape(pattern[idx + 1]))
+            idx += 2
+        else:
+            regex.append(re.escape(pattern[idx]))
+            idx += 1
+    return "".join(regex)
+
+
+class IgnoreMatcher:
+    """Matches the paths against the [ignore] files patterns (gitignore style).
+
+    - A pattern without a '/' (except at its end) matches a name at any depth.
+    - A pattern with a '/' is relative to the repo root.
+    - '*' and '?' don't match '/', '**' matches any number of directories.
+    - A pattern ending with '/' only matches directories.
+    - The files inside a matched directory are ignored too.
+
+    Plain paths are kept in sets and the globs are compiled once into one regex.
+    A path is matched by looking up its parent directories and by a single regex
+    match, so the cost depends on the length of the path and not on the number
+    of patterns.
+    """
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        self.patterns = []
+        self.files = set()
+        self.dirs = set()
+        regexes = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            anchored = "/" in pattern
+            pattern = pattern.lstrip("/")
+            if not pattern:
+                continue
+            self.patterns.append((pattern, anchored, dir_only))
+            if anchored and not any(char in pattern for char in GLOB_CHARS):
+                if not dir_only:
+                    self.files.add(pattern)
+                self.dirs.add(pattern)
+                continue
+            regex = _glob_regex(pattern)
+            if not anchored:
+                regex = "(?:.*/)?" + regex
+            regexes.append(regex + ("/.*" if dir_only else "(?:/.*)?"))
+        self.regex = None
+        if regexes:
+            self.regex = re.compile("|".join(f"(?:{regex})" for regex in regexes))
+
+    def __bool__(self) -> bool:
+        return bool(self.patterns)
+
+    def match(self, path: str) -> bool:
+        """Returns True if the path (relative to the repo root, with '/') is ignored."""
+        if path in self.files:
+            return True
+        if self.dirs:
+            idx = path.find("/")
+            while idx != -1:
+                if path[:idx] in self.dirs:
+                    return True
+                idx = path.find("/", idx + 1)
+        return self.regex is not None and self.regex.fullmatch(path) is not None
+
+    def pathspecs(self) -> list[str]:
+        """Returns git pathspecs that exclude the ignored paths.
+
+        git skips the ignored directories itself, before reading their content.
+        """
+        pathspecs = []
+        for pattern, anchored, dir_only in self.patterns:
+            if anchored and not any(char in pattern for char in GLOB_CHARS):
+                pathspecs.append(f":(exclude,literal){pattern}")
+                continue
+            if not anchored:
+                pattern = "**/" + pattern
+            if not dir_only:
+                pathspecs.append(f":(exclude,glob){pattern}")
+            pathspecs.append(f":(exclude,glob){pattern}/**")
+        return pathspecs
@@ -0,0 +1,373 @@
+import heapq
+import re
+from typing import TYPE_CHECKING, AnyStr, Iterable, Iterator, Optional, Union
+
+if TYPE_CHECKING:
+    from .fingerprint import FingerprintSet
+
+BINARY_SNIFF_SIZE = 8000
+# Deepest nesting of the trie groups, deeper tries (keys that are prefixes of each
+# other) are matched with a flat alternation instead.
+MAX_TRIE_DEPTH = 100
+# Fewer keys are searched one by one (see _KeyScanner), the regex engine finds a
+# literal much faster than it walks a trie (or an alternation) at each position.
+MIN_TRIE_KEYS = 250
+UTF16_BOMS = [b"\xff\xfe", b"\xfe\xff"]
+
+Content = Union[str, bytes, bytearray, memoryview]
+
+
+def mask_secret(key: str, show_char: int) -> str:
+    mask_stop = len(key) - show_char
+    return ("*" * mask_stop) + key[mask_stop:]
+
+
+def is_binary(head: bytes) -> bool:
+    """Sniffs the first block of a file the same way git does (a NUL byte)."""
+    head = head[:BINARY_SNIFF_SIZE]
+    if any(head.startswith(bom) for bom in UTF16_BOMS):
+        return False
+    return b"\0" in head
+
+
+def _trie_pattern(keys: list[AnyStr]) -> AnyStr:
+    # Build a trie of the keys and flatten it into a regex, so that the regex
+    # engine walks the trie at each position instead of trying every key.
+    # The keys are either all str or all bytes.
+    empty = keys[0][:0]
+    lit = (lambda text: text.encode("ascii")) if isinstance(empty, bytes) else str
+    trie = {}
+    for key in keys:
+        node = trie
+        for idx in range(len(key)):
+            node = node.setdefault(key[idx : idx + 1], {})
+        node[empty] = {}
+
+    def collapse(node: dict) -> tuple[AnyStr, dict]:
+        # Collapse single child chains iteratively to avoid deep recursion.
+        pattern = empty
+        while len(node) == 1 and empty not in node:
+            char, node = next(iter(node.items()))
+            pattern += re.escape(char)
+        return pattern, node
+
+    # The depth of the groups, measured without recursion.
+    depth = 0
+    stack = [(trie, 0)]
+    while stack:
+        node, level = stack.pop()
+        _, node = collapse(node)
+        children = [child for char, child in node.items() if char != empty]
+        if children:
+            depth = max(depth, level + 1)
+            stack += [(child, level + 1) for child in children]
+    if depth > MAX_TRIE_DEPTH:
+        # The longer keys are tried first (longest-match-first).
+        return lit("|").join(
+            re.escape(key) for key in sorted(set(keys), key=len, reverse=True)
+        )
+
+    def walk(node: dict) -> AnyStr:
+        pattern, node = collapse(node)
+        branches = [
+            re.escape(char) + walk(child)
+            for char, child in sorted(node.items())
+            if char != empty
+        ]
+        if not branches:
+            return pattern
+        group = lit("(?:") + lit("|").join(branches) + lit(")")
+        # A greedy optional group tries the longer keys first (longest-match-first).
+        return pattern + (group + lit("?") if empty in node else group)
+
+    return walk(trie)
+
+
+class _KeyScanner:
+    """Finds the leftmost longest key like the trie regex, with a search per key.
+
+    Only the methods of re.Pattern used by SecretMatcher are implemented.
+    """
+
+    def __init__(self, keys: list[AnyStr]) -> None:
+        self.patterns = [re.compile(re.escape(key)) for key in keys]
+
+    def search(self, content: Content) -> Optional[re.Match]:
+        """Returns a match of any key (not necessarily the leftmost one)."""
+        for pattern in self.patterns:
+            match = pattern.search(content)
+            if match is not None:
+                return match
+        return None
+
+    def finditer(self, content: Content) -> Iterator[re.Match]:
+        # The next match of every key, the leftmost (then longest) one first.
+        heap = []
+
+        def push(index: int, position: int) -> None:
+            match = self.patterns[index].search(content, position)
+            if match is not None:
+                heapq.heappush(
+                    heap, (match.start(), -len(match.group(0)), index, match)
+                )
+
+        for index in range(len(self.patterns)):
+            push(index, 0)
+        while heap:
+            _, _, index, match = heapq.heappop(heap)
+            yield match
+            end = match.end()
+            # The keys found within the match are searched again after it.
+            pending = [index]
+            while heap and heap[0][0] < end:
+                pending.append(heapq.heappop(heap)[2])
+            for index in pending:
+                push(index, end)
+
+    def sub(self, replace, content: Content) -> AnyStr:
+        parts = []
+        position = 0
+        for match in self.finditer(content):
+            parts += [content[position : match.start()], replace(match)]
+            position = match.end()
+        parts.append(content[position:])
+        if isinstance(content, str):
+            return "".join(parts)
+        return b"".join(parts)
+
+
+def _compile_keys(keys: list[AnyStr]) -> Union[re.Pattern, _KeyScanner]:
+    if len(keys) < MIN_TRIE_KEYS:
+        return _KeyScanner(keys)
+    return re.compile(_trie_pattern(keys))
+
+
+class SecretMatcher:
+    """Masks all the [show] secrets in a single pass over the content.
+
+    By default every key is matched literally. All the keys are compiled once into
+    one trie shaped regex (or searched one by one when there are few of them), and
+    at each position the longest key wins. With ``regex=True`` the legacy behavior
+    is used instead: every key is a regular expression applied with its own
+    ``re.sub`` pass, in the [show] order.
+
+    The content can be text or any bytes-like object (bytes, mmap, ...). Bytes
+    are searched for the UTF-8 encoding of the secrets, and for their UTF-16
+    encodings too with ``utf16=True``, so they never have to be decoded.
+
+    The secrets of 'fingerprints' (the [fingerprints] table) are known only by
+    their hashes. They are masked after the [show] secrets, in bytes content only.
+    """
+
+    def __init__(
+        self,
+        secrets: dict[str, int],
+        regex: bool = False,
+        utf16: bool = False,
+        fingerprints: Optional["FingerprintSet"] = None,
+    ) -> None:
+        self.regex = regex
+        self.utf16 = utf16
+        self.fingerprints = fingerprints or None
+        replacements = {
+            key: mask_secret(key, show) for key, show in secrets.items() if key
+        }
+        # Secrets that are fully shown don't change anything when masked.
+        self.replacements = {
+            key: replacement
+            for key, replacement in replacements.items()
+            if key != replacement
+        }
+        encodings = ["utf8"]
+        if utf16 and not regex:
+            encodings += ["utf-16-le", "utf-16-be"]
+        self.byte_replacements = {
+            key.encode(encoding): replacement.encode(encoding)
+            for encoding in encodings
+            for key, replacement in self.replacements.items()
+        }
+        if regex:
+            self.patterns = [
+                (re.compile(key), replacement)
+                for key, replacement in self.replacements.items()
+            ]
+            self.byte_patterns = [
+                (re.compile(key.encode("utf8")), replacement.encode("utf8"))
+                for key, replacement in self.replacements.items()
+            ]
+        else:
+            self.pattern = None
+            self.byte_pattern = None
+            if self.replacements:
+                self.pattern = _compile_keys(list(self.replacements))
+                self.byte_pattern = _compile_keys(list(self.byte_replacements))
+
+    def reversed(self) -> "SecretMatcher":
+        """Returns a literal matcher that puts the secrets back in masked content.
+
+        It replaces the masked forms of the secrets with the secrets, in a single
+        pass where the longest masked form wins. Secrets with the same masked form
+        can't be told apart, the first one in the [show] order is restored. The
+        fingerprinted secrets can't be restored.
+        """
+        reverse = SecretMatcher({}, utf16=self.utf16)
+        for key, replacement in self.replacements.items():
+            reverse.replacements.setdefault(replacement, key)
+        for key, replacement in self.byte_replacements.items():
+            reverse.byte_replacements.setdefault(replacement, key)
+        if reverse.replacements:
+            reverse.pattern = _compile_keys(list(reverse.replacements))
+            reverse.byte_pattern = _compile_keys(list(reverse.byte_replacements))
+        return reverse
+
+    @property
+    def streamable(self) -> bool:
+        # The length of a regex match isn't bounded, so it can't be streamed. The
+        # fingerprints are searched in the whole content.
+        return not self.regex and self.fingerprints is None
+
+    @property
+    def max_length(self) -> int:
+        return max((len(key) for key in self.replacements), default=0)
+
+    @property
+    def max_byte_length(self) -> int:
+        return max((len(key) for key in self.byte_replacements), default=0)
+
+    def __literal(self, text: bool) -> tuple[re.Pattern, dict, int]:
+        if text:
+            return self.pattern, self.replacements, self.max_length
+        return self.byte_pattern, self.byte_replacements, self.max_byte_length
+
+    def mask(self, content: Content, matches: Optional[list] = None) -> AnyStr:
+        """Returns the masked content (str for text, bytes for bytes-like content).
+
+        With the literal matcher, the offset and the secret of every masked match
+        are appended to 'matches' if it's passed. A masked secret keeps its length,
+        so the offsets are the same in the content and in the masked content.
+        """
+        if self.fingerprints is None or isinstance(content, str):
+            return self.__mask_secrets(content, matches)
+        secret_matches = None if matches is None else []
+        content = self.__mask_secrets(content, secret_matches)
+        found = self.fingerprints.find(content)
+        if matches is not None:
+            matches.extend(
+                sorted(secret_matches + [(start, secret) for start, secret, _ in found])
+            )
+        if not found:
+            return content
+        parts = []
+        position = 0
+        for start, secret, fingerprint in found:
+            parts += [content[position:start], fingerprint.masked]
+            position = start + len(secret)
+        parts.append(content[position:])
+        return b"".join(parts)
+
+    def __mask_secrets(
+        self, content: Content, matches: Optional[list] = None
+    ) -> AnyStr:
+        text = isinstance(content, str)
+        if self.regex:
+            for pattern, replacement in self.patterns if text else self.byte_patterns:
+                content = pattern.sub(replacement, content)
+            return content if text else bytes(content)
+        pattern, replacements, _ = self.__literal(text)
+        if pattern is None:
+            return content if text else bytes(content)
+        if matches is None:
+            return pattern.sub(lambda match: replacements[match.group(0)], content)
+
+        def replace(match: re.Match) -> AnyStr:
+            matches.append((match.start(), match.group(0)))
+            return replacements[match.group(0)]
+
+        return pattern.sub(replace, content)
+
+    def search(self, content: Content) -> bool:
+        """Returns True if any secret is found in the content."""
+        if self.fingerprints is not None and not isinstance(content, str):
+            if self.fingerprints.search(content):
+                return True
+        if self.regex:
+            patterns = self.patterns if isinstance(content, str) else self.byte_patterns
+            return any(pattern.search(content) for pattern, _ in patterns)
+        pattern, _, _ = self.__literal(isinstance(content, str))
+        return pattern is not None and pattern.search(content) is not None
+
+    def masked(self, secret: bytes) -> bytes:
+        """Returns the masked form of a secret found in bytes content."""
+        if secret in self.byte_replacements:
+            return self.byte_replacements[secret]
+        return self.fingerprints.masked(secret)
+
+    def contains_stream(self, chunks: Iterable[AnyStr]) -> bool:
+        """Returns True if any secret is found in the chunks (literal matcher only)."""
+        carry = None
+        for chunk in chunks:
+            if carry is None:
+                pattern, _, max_length = self.__literal(isinstance(chunk, str))
+                if pattern is None:
+                    return False
+                overlap = max_length - 1
+                carry = chunk[:0]
+            buffer = carry + chunk
+            if pattern.search(buffer):
+                return True
+            carry = buffer[-overlap:] if overlap else buffer[:0]
+        return False
+
+    def mask_stream(
+        self, chunks: Iterable[AnyStr], matches: Optional[list] = None
+    ) -> Iterator[AnyStr]:
+        """Masks the content chunk by chunk (literal matcher only).
+
+        The last 'max_length - 1' characters (or bytes) of each chunk are carried
+        over to the next one, so secrets that span chunk boundaries are still
+        found. The output (and 'matches', see mask) is the same as masking the
+        whole content at once. A match is appended to 'matches' before the chunk
+        that contains it is yielded.
+        """
+        chunks = iter(chunks)
+        carry = None
+        # Offset of the carry in the whole content.
+        offset = 0
+        for chunk in chunks:
+            if carry is None:
+                pattern, replacements, max_length = self.__literal(
+                    isinstance(chunk, str)
+                )
+                if pattern is None:
+                    yield chunk
+                    yield from chunks
+                    return
+                overlap = max_length - 1
+                carry = chunk[:0]
+            buffer = carry + chunk
+            # A match starting before the cutoff is complete within the buffer.
+            cutoff = len(buffer) - overlap
+            if cutoff <= 0:
+                carry = buffer
+                continue
+            parts = []
+            position = 0
+            for match in pattern.finditer(buffer):
+                if match.start() >= cutoff:
+                    break
+                parts.append(buffer[position : match.start()])
+                parts.append(replacements[match.group(0)])
+                if matches is not None:
+                    matches.append((offset + match.start(), match.group(0)))
+                position = match.end()
+            end = max(position, cutoff)
+            parts.append(buffer[position:end])
+            yield buffer[:0].join(parts)
+            carry = buffer[end:]
+            offset += end
+        if carry:
+            carry_matches = None if matches is None else []
+            masked = self.mask(carry, carry_matches)
+            if matches is not None:
+                matches.extend((offset + start, key) for start, key in carry_matches)
+            yield masked
@@ -0,0 +1,130 @@
+import sys
+import time
+from typing import NamedTuple, Optional, TextIO
+
+from .utils import PrettyOutput
+
+FORMATS = ["text", "json", "ndjson"]
+
+
+class FileResult(NamedTuple):
+    path: str
+    # "masked", "masked_index" (the staged version only), "clean", "cached" (clean
+    # in the scan cache), "skipped" (the file couldn't be read) or "rejected" (the
+    # masked file couldn't be added to the index).
+    action: str
+    # Number of bytes scanned (0 for the cached files).
+    size: int
+    # Number of matches per secret id, None when the positions aren't known.
+    matches: Optional[dict[str, int]]
+    # Seconds spent on the file by the hook (waiting for its scan included).
+    elapsed: float
+
+
+class TextReport:
+    """Human readable output of the hooks.
+
+    When buffered, the messages are written at once when the report is closed,
+    instead of one write per file.
+    """
+
+    # The hooks only collect the file results if the report uses them.
+    detailed = False
+
+    def __init__(self, stream: Optional[TextIO] = None, buffered: bool = True) -> None:
+        self.stream = stream
+        self.buffered = buffered
+        self.lines = []
+
+    def __enter__(self) -> "TextReport":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def message(self, level: str, text: str) -> None:
+        """'level' is the PrettyOutput method: error, success, info or warning."""
+        line = getattr(PrettyOutput, level)(text)
+        if self.buffered:
+            self.lines.append(line)
+        else:
+            print(line, file=self.stream or sys.stdout)
+
+    def file(self, result: FileResult) -> None:
+        pass
+
+    def close(self) -> None:
+        if self.lines:
+            stream = self.stream or sys.stdout
+            stream.write("\n".join(self.lines) + "\n")
+            stream.flush()
+            self.lines = []
+
+
+class JsonReport(TextReport):
+    """Machine readable output: the file results, the messages and the run totals.
+
+    With 'ndjson', every record is written as a JSON line as soon as it's known, so
+    large runs are streamed. Otherwise a single JSON document is written at the end.
+    """
+
+    detailed = True
+
+    def __init__(self, stream: Optional[TextIO] = None, ndjson: bool = False) -> None:
+        super().__init__(stream)
+        self.ndjson = ndjson
+        self.start = time.perf_counter()
+        self.files = []
+        self.messages = []
+        self.totals = {
+            "files": 0,
+            "bytes": 0,
+            "masked": 0,
+            "matches": 0,
+            "errors": 0,
+        }
+
+    def __write(self, record: dict) -> None:
+        import json
+
+        stream = self.stream or sys.stdout
+        stream.write(json.dumps(record) + "\n")
+        stream.flush()
+
+    def message(self, level: str, text: str) -> None:
+        message = {"level": level, "text": text}
+        self.totals["errors"] += level == "error"
+        if self.ndjson:
+            self.__write({"type": "message", **message})
+        else:
+            self.messages.append(message)
+
+    def file(self, result: FileResult) -> None:
+        record = result._asdict()
+        record["elapsed"] = round(result.elapsed, 6)
+        self.totals["files"] += 1
+        self.totals["bytes"] += result.size
+        self.totals["masked"] += result.action in ["masked", "masked_index"]
+        self.totals["matches"] += sum((result.matches or {}).values())
+        if self.ndjson:
+            self.__write({"type": "file", **record})
+        else:
+            self.files.append(record)
+
+    def close(self) -> None:
+        if self.start is None:
+            return
+        totals = {**self.totals, "elapsed": round(time.perf_counter() - self.start, 6)}
+        self.start = None
+        if self.ndjson:
+            self.__write({"type": "totals", **totals})
+        else:
+            self.__write(
+                {"files": self.files, "messages": self.messages, "totals": totals}
+            )
+
+
+def make_report(format: str) -> TextReport:
+    if format == "text":
+        return TextReport()
+    return JsonReport(ndjson=(format == "ndjson"))
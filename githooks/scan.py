@@ -0,0 +1,264 @@
+import contextlib
+import hashlib
+import hmac
+import itertools
+import os
+import pathlib
+from collections import deque
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Union
+
+from .git import BlobReader, StagedBlob, history_blobs, state_dir
+from .hooks.mask import STREAM_CHUNK_SIZE, MaskGitHook
+from .matcher import BINARY_SNIFF_SIZE, SecretMatcher, is_binary
+from .utils import PrettyOutput
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+BATCH_SIZE = 1000
+
+_worker_matcher = None
+_worker_binary = "skip"
+
+
+def find_secrets(
+    matcher: SecretMatcher, content: Union[bytes, Iterable[bytes]], binary: str
+) -> list[tuple[int, bytes]]:
+    """Returns the line and the masked form of every secret in the content.
+
+    The content is either bytes or an iterable of chunks (literal matcher only).
+    """
+    chunks = iter([content] if isinstance(content, bytes) else content)
+    head = next(chunks, b"")
+    if binary == "skip" and is_binary(head[:BINARY_SNIFF_SIZE]):
+        return []
+    if matcher.regex:
+        found = []
+        for pattern, replacement in matcher.byte_patterns:
+            for match in pattern.finditer(head):
+                found.append((head.count(b"\n", 0, match.start()) + 1, replacement))
+        return sorted(found)
+    if not matcher.streamable:
+        # The fingerprinted secrets are searched in the whole content.
+        matches = []
+        matcher.mask(head, matches)
+        return [
+            (head.count(b"\n", 0, offset) + 1, matcher.masked(secret))
+            for offset, secret in matches
+        ]
+
+    # The lines are counted on the masked output, which has the same length as the
+    # content, plus the newlines hidden by the masked secrets.
+    matches = []
+    found = []
+    position = 0
+    newlines = 0
+    for chunk in matcher.mask_stream(itertools.chain([head], chunks), matches):
+        end = position + len(chunk)
+        while len(found) < len(matches) and matches[len(found)][0] < end:
+            offset, secret = matches[len(found)]
+            replacement = matcher.byte_replacements[secret]
+            line = newlines + chunk.count(b"\n", 0, offset - position) + 1
+            found.append((line, replacement))
+            newlines += secret.count(b"\n") - replacement.count(b"\n")
+        newlines += chunk.count(b"\n")
+        position = end
+    return found
+
+
+def _init_find_worker(matcher: SecretMatcher, binary: str) -> None:
+    global _worker_matcher, _worker_binary
+    _worker_matcher = matcher
+    _worker_binary = binary
+
+
+def _find_worker(content: bytes) -> list[tuple[int, bytes]]:
+    return find_secrets(_worker_matcher, content, _worker_binary)
+
+
+class HistoryScan:
+    """Scans the blobs of the git history for the [show] secrets of mask.config.
+
+    Every blob is scanned once, even if it's in many commits. The scanned blobs and
+    the hits are kept in a SQLite database (the checkpoint), so the memory used
+    doesn't depend on the size of the history and an interrupted scan can resume.
+    """
+
+    def __init__(
+        self, root_dir: pathlib.Path, revs: list[str], checkpoint: bool = True
+    ) -> None:
+        """Without 'checkpoint', the state is kept in memory and can't be resumed."""
+        import sqlite3
+
+        self.root_dir = root_dir
+        self.revs = revs or ["--all"]
+        self.hook = MaskGitHook(root_dir)
+        self.matcher = self.hook.matcher
+        # The printable (text) form of the masked secrets.
+        encodings = ["utf8"] + (
+            ["utf-16-le", "utf-16-be"] if self.matcher.utf16 else []
+        )
+        self.masked_secrets = {
+            replacement.encode(encoding): replacement
+            for replacement in self.matcher.replacements.values()
+            for encoding in encodings
+        }
+        self.connection = sqlite3.connect(
+            str(state_dir(root_dir) / "history-scan.db") if checkpoint else ":memory:",
+            timeout=10,
+        )
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);"
+            "CREATE TABLE IF NOT EXISTS seen (sha TEXT PRIMARY KEY) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS hits "
+            "(sha TEXT, revision TEXT, path TEXT, line INTEGER, secret TEXT);"
+        )
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE name = 'salt'"
+        ).fetchone()
+        if row is None:
+            row = (os.urandom(16).hex(),)
+            self.connection.execute("INSERT INTO meta VALUES ('salt', ?)", row)
+            self.connection.commit()
+        self.salt = bytes.fromhex(row[0])
+
+    def __checkpoint_id(self) -> str:
+        # The rendered config holds the secrets, so its hash is salted (the salt
+        # is random per checkpoint database).
+        key = "\0".join([self.hook.fingerprint, *self.revs]).encode("utf8")
+        return hmac.new(self.salt, key, hashlib.sha256).hexdigest()[:32]
+
+    def __start(self, resume: bool) -> bool:
+        """Clears the previous checkpoint, unless it's resumed. Returns if resumed."""
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE name = 'checkpoint'"
+        ).fetchone()
+        if resume and row is not None and row[0] == self.__checkpoint_id():
+            return True
+        if resume:
+            print(
+                PrettyOutput.warning(
+                    "[SCAN] There isn't a checkpoint for these revisions and mask.config, starting a new scan."
+                )
+            )
+        self.connection.execute("DELETE FROM seen")
+        self.connection.execute("DELETE FROM hits")
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('checkpoint', ?)",
+            (self.__checkpoint_id(),),
+        )
+        self.connection.commit()
+        return False
+
+    def __unseen(self, blobs: Iterable[tuple[str, StagedBlob]]) -> list:
+        # The first commit and path of each blob that wasn't scanned yet.
+        batch = {}
+        for commit, blob in blobs:
+            if not self.hook.ignore.match(blob.path) and blob.sha not in batch:
+                batch[blob.sha] = (commit, blob)
+        shas = list(batch)
+        for start in range(0, len(shas), 500):
+            chunk = shas[start : start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for (sha,) in self.connection.execute(
+                f"SELECT sha FROM seen WHERE sha IN ({placeholders})", chunk
+            ):
+                del batch[sha]
+        return list(batch.values())
+
+    def __find(
+        self,
+        blobs: list[tuple[str, StagedBlob]],
+        reader: BlobReader,
+        pool: Optional["ProcessPoolExecutor"],
+        workers: int,
+    ) -> Iterator[tuple[str, StagedBlob, list[tuple[int, bytes]]]]:
+        max_size = None
+        if self.hook.stream_threshold and self.matcher.streamable:
+            max_size = self.hook.stream_threshold
+        contents = reader.read_many(
+            (blob.sha for _, blob in blobs),
+            max_size=max_size,
+            chunk_size=STREAM_CHUNK_SIZE,
+        )
+        # Keep a bounded window of pending scans, like the mask hook does.
+        pending = deque()
+        for (commit, blob), (_, content) in zip(blobs, contents):
+            if pool is None or not isinstance(content, bytes):
+                # Streams are read from the shared pipe, so they are scanned here.
+                future = Future()
+                future.set_result(
+                    find_secrets(self.matcher, content, self.hook.binary)
+                    if content is not None
+                    else []
+                )
+            else:
+                future = pool.submit(_find_worker, content)
+            pending.append((commit, blob, future))
+            if len(pending) >= workers * 4:
+                commit, blob, future = pending.popleft()
+                yield commit, blob, future.result()
+        while pending:
+            commit, blob, future = pending.popleft()
+            yield commit, blob, future.result()
+
+    def __pool(
+        self, workers: int
+    ) -> Union["ProcessPoolExecutor", contextlib.nullcontext]:
+        if workers == 1:
+            return contextlib.nullcontext()
+        from concurrent.futures import ProcessPoolExecutor
+
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_find_worker,
+            initargs=(self.matcher, self.hook.binary),
+        )
+
+    def __print_hit(self, commit: str, path: str, line: int, secret: str) -> None:
+        print(PrettyOutput.error(f"[SCAN] {commit} {path}:{line} {secret}"))
+
+    def run(self, workers: Optional[int] = None, resume: bool = False) -> int:
+        """Scans the history and returns the number of hits (including resumed)."""
+        if self.__start(resume):
+            for commit, path, line, secret in self.connection.execute(
+                "SELECT revision, path, line, secret FROM hits ORDER BY rowid"
+            ):
+                self.__print_hit(commit, path, line, secret)
+        workers = self.hook.workers if workers is None else workers
+        workers = workers or os.cpu_count() or 1
+        scanned = 0
+        # The pool is shut down before the reader is closed. The workers inherit
+        # the pipes of git, which would never see the end of its input otherwise.
+        with BlobReader(self.root_dir) as reader, self.__pool(workers) as pool:
+            blobs = history_blobs(
+                self.root_dir, self.revs, pathspecs=self.hook.ignore.pathspecs()
+            )
+            while True:
+                batch = [*itertools.islice(blobs, BATCH_SIZE)]
+                if not batch:
+                    break
+                unseen = self.__unseen(batch)
+                for commit, blob, found in self.__find(unseen, reader, pool, workers):
+                    for line, replacement in found:
+                        secret = self.masked_secrets.get(
+                            replacement, replacement.decode("utf8", "replace")
+                        )
+                        self.connection.execute(
+                            "INSERT INTO hits VALUES (?, ?, ?, ?, ?)",
+                            (blob.sha, commit, blob.path, line, secret),
+                        )
+                        self.__print_hit(commit, blob.path, line, secret)
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO seen VALUES (?)",
+                    [(blob.sha,) for _, blob in unseen],
+                )
+                # Checkpoint
+                self.connection.commit()
+                scanned += len(unseen)
+        hits = self.connection.execute("SELECT COUNT(*) FROM hits").fetchone()[0]
+        self.connection.close()
+        message = f"[SCAN] {scanned} blobs scanned, {hits} secrets found."
+        print(PrettyOutput.error(message) if hits else PrettyOutput.success(message))
+        return hits
@@ -1,13 +1,17 @@
 import pathlib
 import shutil
+import stat
 import subprocess
 import sys
 import textwrap
+from typing import Callable, Optional
 
 import click
 
 from ..exceptions import *
 from ..hooks.mask import MaskGitHook
+from ..report import FORMATS, TextReport, make_report
+from ..timings import profiled
 from ..utils import PrettyOutput
 
 
@@ -20,8 +24,48 @@ def get_current_repo_root_path() -> pathlib.Path:
     return pathlib.Path(cmd_git_dir)
 
 
+def is_mask_script(script: pathlib.Path) -> bool:
+    # Other tools may have installed their own pre-push hook.
+    return script.exists() and "githooks.hooks.mask" in script.read_text()
+
+
+def make_executable(script: pathlib.Path) -> None:
+    # git ignores the hooks that aren't executable.
+    script.chmod(script.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
 supported_hooks = ["mask", "test"]
 
+workspace_option = click.option(
+    "--workspace",
+    default=None,
+    type=click.Path(exists=True, file_okay=False, path_type=pathlib.Path),
+    help="Run the command in every git repo found under this directory",
+)
+
+
+def in_workspace(
+    workspace: pathlib.Path,
+    command: Callable[[pathlib.Path, TextReport], str],
+    column: str,
+    levels: tuple[str, ...] = ("error", "warning"),
+) -> None:
+    """Runs the command in the repos of the workspace and prints a results table.
+
+    The messages of the 'levels' are printed below the table, for each repo.
+    """
+    from ..workspace import discover_repos, print_results, run_in_repos
+
+    workspace = workspace.resolve()
+    repos = discover_repos(workspace)
+    if not repos:
+        print(PrettyOutput.warning(f"No git repo was found in {workspace}."))
+        sys.exit(1)
+    results = run_in_repos(repos, command, levels)
+    print_results(workspace, results, column)
+    if not all(result.ok for result in results):
+        sys.exit(1)
+
 
 @click.group()
 def cli():
@@ -29,84 +73,123 @@ def cli():
     pass
 
 
+def init_mask(repo_root_dir: pathlib.Path, pre_push: bool, report: TextReport) -> str:
+    """Adds the mask hook and the template mask.config to the repo."""
+    templates_dir = pathlib.Path(__file__).parents[1] / "templates"
+    git_dir = repo_root_dir / ".git"
+    hooks_dir = git_dir / "hooks"
+
+    if not git_dir.exists():
+        raise GitPathNotFound()
+
+    hooks_dir.mkdir(exist_ok=True)
+
+    # pre-commit file
+    pre_commit_script = hooks_dir / "pre-commit"
+    code = textwrap.dedent(
+        f"""\
+        #!{str(pathlib.Path(sys.executable))}
+        import sys
+
+        from githooks.hooks.mask import main
+
+        sys.exit(main())
+        """
+    )
+    with pre_commit_script.open(mode="w") as script:
+        script.writelines(code)
+    make_executable(pre_commit_script)
+    report.message("info", f"pre-commit is created in {hooks_dir}")
+
+    if pre_push:
+        # pre-push file
+        pre_push_script = hooks_dir / "pre-push"
+        code = textwrap.dedent(
+            f"""\
+            #!{str(pathlib.Path(sys.executable))}
+            import sys
+
+            from githooks.hooks.mask import pre_push
+
+            sys.exit(pre_push(sys.argv[1], sys.stdin))
+            """
+        )
+        with pre_push_script.open(mode="w") as script:
+            script.writelines(code)
+        make_executable(pre_push_script)
+        report.message("info", f"pre-push is created in {hooks_dir}")
+
+    # mask.config file
+    config_toml = templates_dir / "mask.config"
+    if not (repo_root_dir / "mask.config").exists():
+        shutil.copy2(config_toml, repo_root_dir)
+        report.message("info", f"mask.config is created in {repo_root_dir}")
+    else:
+        report.message(
+            "info",
+            f"mask.config already exists in {repo_root_dir}. Skipping creation.",
+        )
+
+    # Add _unmasked_* to .gitignore
+    gitignore = repo_root_dir / ".gitignore"
+    content = ""
+    if gitignore.exists():
+        with gitignore.open(mode="r") as f:
+            content = f.read()
+
+    if ("_unmasked_*" not in content) or (not gitignore.exists()):
+        with gitignore.open(mode="a") as f:
+            f.write(f"\n_unmasked_*")
+            report.message("info", "'_unmasked_*' was added to gitignore.")
+            f.write(f"\n/mask.config")
+            report.message("info", "'/mask.config' was added to gitignore.")
+    elif ("_unmasked_*" in content) and ("/mask.config" not in content):
+        report.message(
+            "warning",
+            """\
+            ******************************************************************
+            /mask.config is NOT in .gitignore. Your secrets will be committed.
+            If you do not want that, add it manually to .gitignore.
+            ******************************************************************""",
+        )
+
+    report.message(
+        "success",
+        """\
+        =============================================================
+        Mask git hook is initiated successfully.
+        Please edit 'mask.config' in your repo's root directory.
+        You can use '{{ ENV_VAR }}' to include environment variables.
+        You can remove 'mask.config' form the gitignore file if you want to commit it""",
+    )
+    return "Initialized" + (" (with pre-push)" if pre_push else "")
+
+
 @cli.command()
 @click.argument("hook")
-def init(hook: str) -> None:
+@click.option(
+    "--pre-push",
+    is_flag=True,
+    default=False,
+    help="Also add a pre-push hook that scans the commits being pushed (mask hook only).",
+)
+@workspace_option
+def init(hook: str, pre_push: bool, workspace: Optional[pathlib.Path]) -> None:
     """Adds the hook and template config to '.git/hooks'.
     Currently the 'hook' arg can take only 'mask' value.
     """
     try:
-        templates_dir = pathlib.Path(__file__).parents[1] / "templates"
-        repo_root_dir = get_current_repo_root_path()
-        git_dir = repo_root_dir / ".git"
-        hooks_dir = git_dir / "hooks"
-
-        if not git_dir.exists():
-            raise GitPathNotFound()
-
-        hooks_dir.mkdir(exist_ok=True)
-
         if hook.lower() == "mask":
-            # pre-commit file
-            pre_commit_script = hooks_dir / "pre-commit"
-            code = textwrap.dedent(
-                f"""\
-                #!{str(pathlib.Path(sys.executable))}
-                import subprocess
-
-                subprocess.run('git-hooks exec mask', shell=True)
-                """
-            )
-            with pre_commit_script.open(mode="w") as script:
-                script.writelines(code)
-            print(PrettyOutput.info(f"pre-commit is created in {hooks_dir}"))
-
-            # mask.config file
-            config_toml = templates_dir / "mask.config"
-            if not (repo_root_dir / "mask.config").exists():
-                shutil.copy2(config_toml, repo_root_dir)
-                print(PrettyOutput.info(f"mask.config is created in {repo_root_dir}"))
-            else:
-                print(
-                    PrettyOutput.info(
-                        f"mask.config already exists in {repo_root_dir}. Skipping creation."
-                    )
+            if workspace is not None:
+                in_workspace(
+                    workspace,
+                    lambda repo, report: init_mask(repo, pre_push, report),
+                    "init mask",
                 )
-
-            # Add _unmasked_* to .gitignore
-            gitignore = repo_root_dir / ".gitignore"
-            content = ""
-            if gitignore.exists():
-                with gitignore.open(mode="r") as f:
-                    content = f.read()
-
-            if ("_unmasked_*" not in content) or (not gitignore.exists()):
-                with gitignore.open(mode="a") as f:
-                    f.write(f"\n_unmasked_*")
-                    print(PrettyOutput.info("'_unmasked_*' was added to gitignore."))
-                    f.write(f"\n/mask.config")
-                    print(PrettyOutput.info("'/mask.config' was added to gitignore."))
-            elif ("_unmasked_*" in content) and ("/mask.config" not in content):
-                print(
-                    PrettyOutput.warning(
-                        """\
-                        ******************************************************************
-                        /mask.config is NOT in .gitignore. Your secrets will be committed.
-                        If you do not want that, add it manually to .gitignore.
-                        ******************************************************************"""
-                    )
-                )
-
-            print(
-                PrettyOutput.success(
-                    """\
-                    =============================================================
-                    Mask git hook is initiated successfully.
-                    Please edit 'mask.config' in your repo's root directory.
-                    You can use '{{ ENV_VAR }}' to include environment variables.
-                    You can remove 'mask.config' form the gitignore file if you want to commit it"""
-                )
-            )
+                return
+            repo_root_dir = get_current_repo_root_path()
+            with TextReport(buffered=False) as report:
+                init_mask(repo_root_dir, pre_push, report)
         elif hook.lower() == "test":
             sys.exit(0)
         else:
@@ -143,16 +226,136 @@ def init(hook: str) -> None:
     "--file",
     default=None,
     type=click.Path(exists=True),
-    help="Specify the file for the reverse operation. If not specified, all files in the .ghunmask file will be unmasked",
+    help="Specify the file for the reverse operation. If not specified, all the masked files will be unmasked",
+)
+@click.option(
+    "-j",
+    "--workers",
+    default=None,
+    type=click.IntRange(min=0),
+    help="Number of worker processes used to scan (or unmask) the files (0 uses all CPUs). Overrides 'workers' in mask.config",
 )
-def exec(hook: str, reverse: bool, file: pathlib.Path) -> None:
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    default=False,
+    help="With --reverse, only report how many secrets would be restored in each file",
+)
+@click.option(
+    "--diff-only",
+    is_flag=True,
+    default=False,
+    help="Only scan and mask the lines added to the staged files. Overrides 'diff_only' in mask.config",
+)
+@click.option(
+    "--pipeline",
+    is_flag=True,
+    default=False,
+    help="Read, scan, mask and add the staged files to the index concurrently. Overrides 'pipeline' in mask.config",
+)
+@click.option(
+    "--timings",
+    is_flag=True,
+    default=False,
+    help="Print the wall time and count of each phase of the hook",
+)
+@click.option(
+    "--profile",
+    default=None,
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    help="Write a profile of the hook: a Chrome trace of the phases for a '.json' file, a cProfile dump otherwise. Implies --timings",
+)
+@click.option(
+    "--format",
+    "output_format",
+    default="text",
+    show_default=True,
+    type=click.Choice(FORMATS),
+    help="Output format. 'json' writes the results of every file and the run totals as one document, 'ndjson' writes them as JSON lines while the hook runs",
+)
+@workspace_option
+def exec(
+    hook: str,
+    reverse: bool,
+    file: pathlib.Path,
+    workers: int,
+    dry_run: bool,
+    diff_only: bool,
+    pipeline: bool,
+    timings: bool,
+    profile: Optional[pathlib.Path],
+    output_format: str,
+    workspace: Optional[pathlib.Path],
+) -> None:
     """Executes the passed hook."""
     if hook.lower() == "mask":
-        masker = MaskGitHook(get_current_repo_root_path())
-        if not reverse:
-            masker.mask()
-        else:
-            masker.reverse_mask(file)
+        if workspace is not None:
+            if (
+                file
+                or workers is not None
+                or timings
+                or profile is not None
+                or output_format != "text"
+            ):
+                raise click.UsageError(
+                    "--workspace can't be combined with --file, --workers, "
+                    "--timings, --profile or --format."
+                )
+
+            # The repos are handled on threads, the processes of a worker pool
+            # would be forked from them.
+            def mask_repo(repo_root_dir: pathlib.Path, report: TextReport) -> str:
+                MaskGitHook(repo_root_dir, report=report).mask(
+                    workers=1,
+                    diff_only=diff_only or None,
+                    pipeline=pipeline or None,
+                )
+                masked = report.counts["success"]
+                return f"{masked} file" + ("s" if masked != 1 else "") + " masked"
+
+            def unmask_repo(repo_root_dir: pathlib.Path, report: TextReport) -> str:
+                MaskGitHook(repo_root_dir, report=report).reverse_mask(
+                    None, workers=1, dry_run=dry_run
+                )
+                # The summary line of the reverse operation.
+                return report.last["info"].replace("[UNMASK] ", "")
+
+            in_workspace(
+                workspace,
+                unmask_repo if reverse else mask_repo,
+                "exec -r mask" if reverse else "exec mask",
+                levels=("error", "warning", "success"),
+            )
+            return
+        phase_timings = None
+        if timings or profile is not None:
+            from ..timings import Timings
+
+            phase_timings = Timings(
+                trace=profile is not None and profile.suffix == ".json"
+            )
+        # The report is written before the timings summary, which goes to stderr
+        # with the machine readable formats.
+        stream = sys.stderr if output_format != "text" else None
+        with profiled(phase_timings, profile, stream), make_report(
+            output_format
+        ) as report:
+            try:
+                masker = MaskGitHook(
+                    get_current_repo_root_path(), timings=phase_timings, report=report
+                )
+            except NoConfigurationFileFound as e:
+                # Keep the machine readable output parsable.
+                print(e, file=sys.stderr if report.detailed else sys.stdout)
+                sys.exit(1)
+            if not reverse:
+                masker.mask(
+                    workers=workers,
+                    diff_only=diff_only or None,
+                    pipeline=pipeline or None,
+                )
+            else:
+                masker.reverse_mask(file, workers=workers, dry_run=dry_run)
 
     elif hook.lower() == "test":
         sys.exit(0)
@@ -165,24 +368,184 @@ def exec(hook: str, reverse: bool, file: pathlib.Path) -> None:
         sys.exit(1)
 
 
+@cli.command()
+@click.argument("revs", nargs=-1)
+@click.option(
+    "-j",
+    "--workers",
+    default=None,
+    type=click.IntRange(min=0),
+    help="Number of worker processes used to scan the blobs (0 uses all CPUs). Overrides 'workers' in mask.config",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Resume the last scan from its checkpoint instead of starting over.",
+)
+def scan(revs: tuple[str], workers: int, resume: bool) -> None:
+    """Scans the history for the secrets in mask.config.
+    All the refs are scanned, unless revisions or ranges (e.g. 'main..feature') are passed.
+    """
+    from ..scan import HistoryScan
+
+    try:
+        history_scan = HistoryScan(get_current_repo_root_path(), [*revs])
+    except NoConfigurationFileFound as e:
+        print(e)
+        sys.exit(1)
+    if history_scan.run(workers=workers, resume=resume):
+        sys.exit(1)
+
+
+@cli.command()
+@click.option(
+    "--stop",
+    is_flag=True,
+    default=False,
+    help="Stop the daemon of the current repo",
+)
+@click.option(
+    "--idle-timeout",
+    default=3600,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Seconds without commits before the daemon exits (0 never exits)",
+)
+def daemon(stop: bool, idle_timeout: int) -> None:
+    """Keeps the mask hook loaded for the pre-commit hook of the current repo."""
+    import socket
+
+    from ..daemon import MaskDaemon, request
+
+    root_dir = get_current_repo_root_path()
+    if stop:
+        if request(root_dir, "stop") is None:
+            print(PrettyOutput.warning("The daemon isn't running."))
+            sys.exit(1)
+        print(PrettyOutput.success("The daemon is stopped."))
+        return
+    if not hasattr(socket, "AF_UNIX"):
+        print(PrettyOutput.error("The daemon needs Unix sockets."))
+        sys.exit(1)
+    try:
+        MaskDaemon(root_dir, idle_timeout).serve()
+    except DaemonAlreadyRunning as e:
+        print(e)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command()
+@click.option(
+    "--debounce",
+    default=0.2,
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="Seconds without changes before the saved files are scanned",
+)
+@click.option(
+    "--poll",
+    is_flag=True,
+    default=False,
+    help="Poll the working tree instead of using inotify",
+)
+@click.option(
+    "--interval",
+    default=1.0,
+    show_default=True,
+    type=click.FloatRange(min=0.1),
+    help="Seconds between two polls of the working tree",
+)
+def watch(debounce: float, poll: bool, interval: float) -> None:
+    """Scans the files of the current repo as they are saved, so commits are instant.
+
+    The results are recorded in the scan cache, where the pre-commit hook finds them.
+    """
+    from ..watch import MaskWatcher
+
+    try:
+        watcher = MaskWatcher(
+            get_current_repo_root_path(),
+            debounce=debounce,
+            poll=poll,
+            interval=interval,
+        )
+    except NoConfigurationFileFound as e:
+        print(e)
+        sys.exit(1)
+    try:
+        if watcher.run():
+            sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+@cli.command()
+@click.option(
+    "-s",
+    "--show",
+    default=0,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Number of characters of the secret left visible (from the right)",
+)
+def fingerprint(show: int) -> None:
+    """Prints the [fingerprints] entry of a secret read from the prompt.
+
+    Add the entry to the 'secrets' list of the [fingerprints] table of mask.config,
+    the secret itself is never written.
+    """
+    from ..fingerprint import format_fingerprint, make_fingerprint, new_salt
+
+    salt = None
+    repo_root_dir = get_current_repo_root_path()
+    if (repo_root_dir / "mask.config").exists():
+        try:
+            configs = MaskGitHook(repo_root_dir).configs
+        except NoConfigurationFileFound as e:
+            print(e)
+            sys.exit(1)
+        salt = configs.get("fingerprints", {}).get("salt")
+    secret = click.prompt("Secret", hide_input=True, err=True)
+    if salt is not None:
+        print(f"    {format_fingerprint(make_fingerprint(secret, show, salt))},")
+        return
+    # The salt of a new [fingerprints] table.
+    salt = new_salt()
+    print("[fingerprints]")
+    print(f'salt = "{salt}"')
+    print("secrets = [")
+    print(f"    {format_fingerprint(make_fingerprint(secret, show, salt))},")
+    print("]")
+
+
+def disable_mask(repo_root_dir: pathlib.Path, report: TextReport) -> str:
+    hooks_dir = repo_root_dir / ".git" / "hooks"
+    pre_commit_script = hooks_dir / "pre-commit"
+    pre_push_script = hooks_dir / "pre-push"
+    if pre_commit_script.exists():
+        shutil.move(pre_commit_script, pre_commit_script.parent / "_pre-commit")
+        if is_mask_script(pre_push_script):
+            shutil.move(pre_push_script, pre_push_script.parent / "_pre-push")
+        report.message("success", "Mask git hook is disabled")
+        return "Disabled"
+    report.message("warning", "Mask git hook is not initiated. Nothing will happen.")
+    return "Not initialized"
+
+
 @cli.command()
 @click.argument("hook")
-def disable(hook: str) -> None:
+@workspace_option
+def disable(hook: str, workspace: Optional[pathlib.Path]) -> None:
     """Disables the passed hook"""
-    git_dir = get_current_repo_root_path() / ".git"
-    hooks_dir = git_dir / "hooks"
-
     if hook.lower() == "mask":
-        pre_commit_script = hooks_dir / "pre-commit"
-        if pre_commit_script.exists():
-            shutil.move(pre_commit_script, pre_commit_script.parent / "_pre-commit")
-            print(PrettyOutput.success("Mask git hook is disabled"))
-        else:
-            print(
-                PrettyOutput.warning(
-                    "Mask git hook is not initiated. Nothing will happen."
-                )
-            )
+        if workspace is not None:
+            in_workspace(workspace, disable_mask, "disable mask")
+            return
+        with TextReport(buffered=False) as report:
+            disable_mask(get_current_repo_root_path(), report)
     elif hook.lower() == "test":
         sys.exit(0)
     else:
@@ -194,24 +557,34 @@ def disable(hook: str) -> None:
         sys.exit(1)
 
 
+def enable_mask(repo_root_dir: pathlib.Path, report: TextReport) -> str:
+    hooks_dir = repo_root_dir / ".git" / "hooks"
+    pre_commit_script = hooks_dir / "_pre-commit"
+    pre_push_script = hooks_dir / "_pre-push"
+    if pre_commit_script.exists():
+        shutil.move(pre_commit_script, pre_commit_script.parent / "pre-commit")
+        if is_mask_script(pre_push_script):
+            shutil.move(pre_push_script, pre_push_script.parent / "pre-push")
+        report.message("success", "Mask git hook is enabled")
+        return "Enabled"
+    report.message(
+        "warning",
+        "Mask git hook is not initiated or already enabled. Nothing will happen.",
+    )
+    return mask_status(repo_root_dir)
+
+
 @cli.command()
 @click.argument("hook")
-def enable(hook: str) -> None:
+@workspace_option
+def enable(hook: str, workspace: Optional[pathlib.Path]) -> None:
     """Enables the passed hook. Must be initiated first."""
-    git_dir = get_current_repo_root_path() / ".git"
-    hooks_dir = git_dir / "hooks"
-
     if hook.lower() == "mask":
-        pre_commit_script = hooks_dir / "_pre-commit"
-        if pre_commit_script.exists():
-            shutil.move(pre_commit_script, pre_commit_script.parent / "pre-commit")
-            print(PrettyOutput.success("Mask git hook is enabled"))
-        else:
-            print(
-                PrettyOutput.warning(
-                    "Mask git hook is not initiated or already enabled. Nothing will happen."
-                )
-            )
+        if workspace is not None:
+            in_workspace(workspace, enable_mask, "enable mask")
+            return
+        with TextReport(buffered=False) as report:
+            enable_mask(get_current_repo_root_path(), report)
     elif hook.lower() == "test":
         sys.exit(0)
     else:
@@ -232,21 +605,33 @@ def list():
         print(str(idx + 1).rjust(2) + "- " + hook)
 
 
+def mask_status(repo_root_dir: pathlib.Path) -> str:
+    hooks_dir = repo_root_dir / ".git" / "hooks"
+    status = (
+        "Enabled"
+        if (hooks_dir / "pre-commit").exists()
+        else "Disabled"
+        if (hooks_dir / "_pre-commit").exists()
+        else "Not initialized"
+    )
+    if is_mask_script(hooks_dir / "pre-push") or is_mask_script(
+        hooks_dir / "_pre-push"
+    ):
+        status += " (with pre-push)"
+    return status
+
+
 @cli.command()
-def status():
+@workspace_option
+def status(workspace: Optional[pathlib.Path]):
     """Lists the status of currently enabled or disabled hooks."""
-    git_dir = get_current_repo_root_path() / ".git"
-    hooks_dir = git_dir / "hooks"
+    if workspace is not None:
+        in_workspace(workspace, lambda repo, report: mask_status(repo), "mask")
+        return
+    repo_root_dir = get_current_repo_root_path()
     for hook in supported_hooks:
         if hook == "mask":
-            status = (
-                "Enabled"
-                if (hooks_dir / "pre-commit").exists()
-                else "Disabled"
-                if (hooks_dir / "_pre-commit").exists()
-                else "Not initialized"
-            )
-            print("mask".ljust(8) + status)
+            print("mask".ljust(8) + mask_status(repo_root_dir))
         else:
             pass  # Future implementation
 
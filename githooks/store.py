@@ -0,0 +1,115 @@
+import hashlib
+import hmac
+import os
+import pathlib
+from typing import Iterable, NamedTuple, Optional
+
+
+class MaskedFile(NamedTuple):
+    blob: str
+    exact: bool
+    backup: Optional[str]
+
+
+class UnmaskStore:
+    """Records where the secrets were masked, so they can be restored exactly.
+
+    For every masked working tree file, the store keeps the sha of the masked blob,
+    the sha of its backup in the backup store (if it has one) and the offset and id
+    of each masked secret. The ids are salted hashes of the
+    secrets (the salt is random per store), so no secret is written in plaintext.
+    Files masked with the regex matcher don't have exact positions and are
+    recorded without them.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        import sqlite3
+
+        self.connection = sqlite3.connect(str(path), timeout=10)
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value BLOB);"
+            "CREATE TABLE IF NOT EXISTS files "
+            "(path TEXT PRIMARY KEY, blob TEXT, exact INTEGER, backup TEXT) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS masks (path TEXT, offset INTEGER, "
+            "secret BLOB, PRIMARY KEY (path, offset)) WITHOUT ROWID;"
+        )
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE name = 'salt'"
+        ).fetchone()
+        if row is None:
+            row = (os.urandom(16),)
+            self.connection.execute("INSERT INTO meta VALUES ('salt', ?)", row)
+        self.salt = row[0]
+
+    def __enter__(self) -> "UnmaskStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def secret_id(self, secret: bytes) -> bytes:
+        return hmac.new(self.salt, secret, hashlib.sha256).digest()[:16]
+
+    def paths(self) -> list[str]:
+        rows = self.connection.execute("SELECT path FROM files ORDER BY path")
+        return [path for path, in rows]
+
+    def file(self, path: str) -> Optional[MaskedFile]:
+        row = self.connection.execute(
+            "SELECT blob, exact, backup FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            return None
+        return MaskedFile(row[0], bool(row[1]), row[2])
+
+    def masks(self, path: str) -> list[tuple[int, bytes]]:
+        """Returns the offsets and ids of the secrets masked in the file."""
+        return self.connection.execute(
+            "SELECT offset, secret FROM masks WHERE path = ? ORDER BY offset", (path,)
+        ).fetchall()
+
+    def record(
+        self,
+        path: str,
+        blob: str,
+        masks: Optional[Iterable[tuple[int, bytes]]],
+        backup: Optional[str] = None,
+    ) -> Optional[str]:
+        """Replaces the record of the file with the masked secrets (offset, id).
+
+        'masks' is None when the exact positions aren't known. Returns the backup
+        of the previous record, if no file uses it anymore.
+        """
+        previous = self.file(path)
+        self.remove(path)
+        self.connection.execute(
+            "INSERT INTO files VALUES (?, ?, ?, ?)",
+            (path, blob, masks is not None, backup),
+        )
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO masks VALUES (?, ?, ?)",
+            [(path, offset, secret_id) for offset, secret_id in masks or []],
+        )
+        return self.__unused_backup(previous.backup if previous else None)
+
+    def remove(self, path: str) -> Optional[str]:
+        """Removes the record of the file.
+
+        Returns its backup, if no other file uses it (the backups are deduplicated).
+        """
+        previous = self.file(path)
+        self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+        self.connection.execute("DELETE FROM masks WHERE path = ?", (path,))
+        return self.__unused_backup(previous.backup if previous else None)
+
+    def __unused_backup(self, backup: Optional[str]) -> Optional[str]:
+        if backup is None:
+            return None
+        row = self.connection.execute(
+            "SELECT 1 FROM files WHERE backup = ? LIMIT 1", (backup,)
+        ).fetchone()
+        return None if row else backup
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,126 @@
+import contextlib
+import os
+import pathlib
+import threading
+import time
+from typing import Iterable, Iterator, Optional, TextIO, TypeVar
+
+T = TypeVar("T")
+
+
+class Timings:
+    """Records the wall time and count of each phase of a hook.
+
+    The phases can be nested, each one is timed on its own. With 'trace', every
+    occurrence of a phase is kept, so it can be written as a Chrome trace.
+    """
+
+    def __init__(self, trace: bool = False) -> None:
+        self.phases = {}
+        self.events = [] if trace else None
+        self.start = time.perf_counter()
+        # The phases can be timed from several threads (the mask pipeline).
+        self.lock = threading.Lock()
+
+    def __record(self, name: str, start: float, end: float, count: int) -> None:
+        with self.lock:
+            seconds, total = self.phases.get(name, (0.0, 0))
+            self.phases[name] = (seconds + end - start, total + count)
+            if self.events is not None:
+                # Recorded by the thread that ran the phase.
+                self.events.append((name, start, end, threading.get_ident()))
+
+    @contextlib.contextmanager
+    def phase(self, name: str, count: int = 1) -> Iterator[None]:
+        # The phases are listed in the order they start.
+        self.phases.setdefault(name, (0.0, 0))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.__record(name, start, time.perf_counter(), count)
+
+    def iterate(self, name: str, items: Iterable[T]) -> Iterator[T]:
+        """Times the production of each item (not the work done with it)."""
+        iterator = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.__record(name, start, time.perf_counter(), 0)
+                return
+            self.__record(name, start, time.perf_counter(), 1)
+            yield item
+
+    def summary(self) -> str:
+        total = time.perf_counter() - self.start
+        width = max([len(name) for name in self.phases] + [len("total")])
+        lines = [f"{'phase':<{width}}  {'seconds':>9}  {'%':>6}  {'count':>7}"]
+        for name, (seconds, count) in self.phases.items():
+            share = 100 * seconds / total if total else 0
+            lines.append(f"{name:<{width}}  {seconds:>9.4f}  {share:>6.1f}  {count:>7}")
+        lines.append(f"{'total':<{width}}  {total:>9.4f}  {100:>6.1f}")
+        return "\n".join(lines)
+
+    def write_trace(self, file: pathlib.Path) -> None:
+        """Writes the phases as Chrome trace events (chrome://tracing, Perfetto)."""
+        import json
+
+        pid = os.getpid()
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self.start) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": pid,
+                "tid": tid,
+            }
+            for name, start, end, tid in self.events or []
+        ]
+        file.write_text(json.dumps({"traceEvents": events}))
+
+
+class NoTimings:
+    """Used when the timings are disabled, records nothing."""
+
+    __null = contextlib.nullcontext()
+
+    def phase(self, name: str, count: int = 1) -> contextlib.nullcontext:
+        return self.__null
+
+    def iterate(self, name: str, items: Iterable[T]) -> Iterable[T]:
+        return items
+
+
+NO_TIMINGS = NoTimings()
+
+
+@contextlib.contextmanager
+def profiled(
+    timings: Optional[Timings],
+    profile: Optional[pathlib.Path],
+    stream: Optional[TextIO] = None,
+) -> Iterator[None]:
+    """Prints the timings summary and writes the profile at the end of the block.
+
+    A '.json' profile is a Chrome trace of the phases, any other file is a cProfile
+    dump (read it with 'python -m pstats').
+    """
+    profiler = None
+    if profile is not None and profile.suffix != ".json":
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(str(profile))
+        if timings is not None:
+            if profile is not None and profile.suffix == ".json":
+                timings.write_trace(profile)
+            print(timings.summary(), file=stream)
@@ -1,21 +1,28 @@
 import textwrap
 
-from colorama import Back, Fore, Style
-
 
 class PrettyOutput:
+    # colorama is imported on first use, so the hooks don't pay for it on import.
     @staticmethod
     def error(text: str) -> str:
+        from colorama import Fore, Style
+
         return Fore.RED + f"[ERROR] {textwrap.dedent(text)}" + Style.RESET_ALL
 
     @staticmethod
     def success(text: str) -> str:
+        from colorama import Fore, Style
+
         return Fore.GREEN + f"[SUCCESS] {textwrap.dedent(text)}" + Style.RESET_ALL
 
     @staticmethod
     def info(text: str) -> str:
+        from colorama import Fore, Style
+
         return Fore.BLUE + f"[INFO] {textwrap.dedent(text)}" + Style.RESET_ALL
 
     @staticmethod
     def warning(text: str) -> str:
+        from colorama import Fore, Style
+
         return Fore.RED + f"[WARNING] {textwrap.dedent(text)}" + Style.RESET_ALL
@@ -0,0 +1,507 @@
+import errno
+import os
+import pathlib
+import select
+import stat
+import struct
+import threading
+import time
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional
+
+from .git import blob_hasher, changed_paths, decode_path, encode_path, ignored_paths
+from .utils import PrettyOutput
+
+if TYPE_CHECKING:
+    from .hooks.mask import MaskGitHook
+
+# Seconds without any change before the modified files are scanned, and the longest
+# a change waits, so a stream of saves doesn't postpone the scan forever.
+DEBOUNCE = 0.2
+MAX_DELAY = 5
+# Seconds between two polls of the working tree (without inotify).
+POLL_INTERVAL = 1.0
+# Longest wait for an event, so a stop request is seen quickly.
+WAIT_TIMEOUT = 0.5
+# The scan results are written every FLUSH_EVERY files, so the pre-commit hook
+# never waits long for the cache.
+FLUSH_EVERY = 256
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_EVENTS = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _join(directory: str, name: str) -> str:
+    return f"{directory}/{name}" if directory else name
+
+
+def _excluded(path: str) -> bool:
+    # The git dir (and the ones of nested repos) are never watched.
+    return "/.git/" in f"/{path}/"
+
+
+class _Inotify:
+    """Watches the directories of the working tree with inotify (Linux only)."""
+
+    name = "inotify"
+
+    def __init__(self, root_dir: pathlib.Path) -> None:
+        import ctypes
+        import ctypes.util
+
+        self.root_dir = root_dir
+        # AttributeError if the libc doesn't have inotify.
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.rm_watch = libc.inotify_rm_watch
+        self.rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.get_errno = ctypes.get_errno
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self.get_errno(), "inotify_init1 failed")
+        # watch descriptor -> directory (relative to the root dir)
+        self.directories = {}
+        self.descriptors = {}
+
+    def __len__(self) -> int:
+        return len(self.descriptors)
+
+    def watch(self, directory: str) -> bool:
+        """Returns False if the directory can't be watched (e.g. too many watches)."""
+        path = encode_path(str(self.root_dir / directory))
+        descriptor = self.add_watch(
+            self.fd, path, IN_EVENTS | IN_ONLYDIR | IN_DONT_FOLLOW
+        )
+        if descriptor < 0:
+            # A directory removed since it was listed isn't an error.
+            return self.get_errno() in [errno.ENOENT, errno.ENOTDIR]
+        self.directories[descriptor] = directory
+        self.descriptors[directory] = descriptor
+        return True
+
+    def __unwatch(self, directory: str) -> None:
+        # A moved directory keeps its watch, with the old path. It's watched again
+        # under its new path.
+        prefix = directory + "/"
+        for path in [*self.descriptors]:
+            if path == directory or path.startswith(prefix):
+                descriptor = self.descriptors.pop(path)
+                del self.directories[descriptor]
+                self.rm_watch(self.fd, descriptor)
+
+    def read(self, timeout: float) -> Optional[list[tuple[str, bool]]]:
+        """Returns the (path, is directory) of the changed entries.
+
+        Returns None if the kernel dropped events, the whole tree must be checked.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = b""
+        while True:
+            try:
+                data += os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+        changes = []
+        overflow = False
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, _, size = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = decode_path(data[offset : offset + size].rstrip(b"\0"))
+            offset += size
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED:
+                # The directory was removed.
+                directory = self.directories.pop(descriptor, None)
+                if self.descriptors.get(directory) == descriptor:
+                    del self.descriptors[directory]
+                continue
+            if descriptor not in self.directories:
+                continue
+            path = _join(self.directories[descriptor], name)
+            is_directory = bool(mask & IN_ISDIR)
+            if mask & IN_MOVED_FROM:
+                if is_directory:
+                    self.__unwatch(path)
+                continue
+            # New files are scanned once they are written (IN_CLOSE_WRITE).
+            if mask & IN_CREATE and not is_directory:
+                continue
+            changes.append((path, is_directory))
+        return None if overflow else changes
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class _Poller:
+    """Finds the changed entries of the watched directories by listing them."""
+
+    name = "polling"
+
+    def __init__(self, root_dir: pathlib.Path, interval: float) -> None:
+        self.root_dir = root_dir
+        self.interval = interval
+        self.next_poll = time.monotonic() + interval
+        # directory -> {name: (is directory, mtime, size, inode)}
+        self.snapshots = {}
+
+    def __len__(self) -> int:
+        return len(self.snapshots)
+
+    def __snapshot(self, directory: str) -> Optional[dict[str, tuple]]:
+        snapshot = {}
+        try:
+            with os.scandir(self.root_dir / directory) as entries:
+                for entry in entries:
+                    try:
+                        info = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        continue
+                    snapshot[entry.name] = (
+                        stat.S_ISDIR(info.st_mode),
+                        info.st_mtime_ns,
+                        info.st_size,
+                        info.st_ino,
+                    )
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return snapshot
+
+    def watch(self, directory: str) -> bool:
+        if directory not in self.snapshots:
+            snapshot = self.__snapshot(directory)
+            if snapshot is not None:
+                self.snapshots[directory] = snapshot
+        return True
+
+    def read(self, timeout: float) -> Optional[list[tuple[str, bool]]]:
+        """Returns the (path, is directory) of the changed entries."""
+        wait = self.next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+        self.next_poll = time.monotonic() + self.interval
+        changes = []
+        for directory, old in [*self.snapshots.items()]:
+            new = self.__snapshot(directory)
+            if new is None:
+                del self.snapshots[directory]
+                continue
+            self.snapshots[directory] = new
+            for name, state in new.items():
+                if old.get(name) != state:
+                    if state[0] and name in old:
+                        # The content of a directory is checked on its own.
+                        continue
+                    changes.append((_join(directory, name), state[0]))
+        return changes
+
+    def close(self) -> None:
+        pass
+
+
+class MaskWatcher:
+    """Scans the files of the working tree as they are saved, for the mask hook.
+
+    The results are written to the scan cache, keyed by the git sha of the file
+    content, so the pre-commit hook doesn't scan the staged files that were already
+    found clean. The changes are collected until nothing changed for 'debounce'
+    seconds, and each file is scanned once per batch, so a checkout of thousands of
+    files is a single batch. The [ignore] files and the .gitignore files are
+    honored, and the ignored directories aren't watched at all.
+    """
+
+    def __init__(
+        self,
+        root_dir: pathlib.Path,
+        debounce: float = DEBOUNCE,
+        poll: bool = False,
+        interval: float = POLL_INTERVAL,
+    ) -> None:
+        self.root_dir = root_dir
+        self.debounce = debounce
+        self.poll = poll
+        self.interval = interval
+        self.hook = self.__load()
+        self.cache = None
+        self.source = None
+        # Set once the working tree is watched.
+        self.ready = threading.Event()
+
+    def __config_state(self) -> Optional[tuple]:
+        try:
+            info = (self.root_dir / "mask.config").stat()
+        except FileNotFoundError:
+            return None
+        return (info.st_ino, info.st_size, info.st_mtime_ns, info.st_ctime_ns)
+
+    def __load(self) -> "MaskGitHook":
+        from .hooks.mask import MaskGitHook
+
+        config_state = self.__config_state()
+        hook = MaskGitHook(self.root_dir)
+        self.config_state = config_state
+        return hook
+
+    def __open_source(self) -> None:
+        if not self.poll:
+            try:
+                self.source = _Inotify(self.root_dir)
+                if self.__watch_tree():
+                    return
+                self.source.close()
+                print(
+                    PrettyOutput.warning(
+                        "[WATCH] Too many directories for inotify, polling instead."
+                    )
+                )
+            except (AttributeError, OSError):
+                pass
+        self.source = _Poller(self.root_dir, self.interval)
+        self.__watch_tree()
+
+    def __watch_tree(self) -> bool:
+        return self.__watch([""]) is not None
+
+    def __watch(self, directories: Iterable[str]) -> Optional[list[str]]:
+        """Watches the directories and their subdirectories, except the ignored ones.
+
+        Returns the files found in them, or None if a directory couldn't be watched.
+        The directories are walked level by level, with one git call per level.
+        """
+        files = []
+        level = [
+            directory
+            for directory in directories
+            if not _excluded(directory) and not self.hook.ignore.match(directory + "/")
+        ]
+        while level:
+            ignored = ignored_paths(
+                self.root_dir, (directory + "/" for directory in level if directory)
+            )
+            next_level = []
+            for directory in level:
+                if directory + "/" in ignored:
+                    continue
+                if not self.source.watch(directory):
+                    return None
+                try:
+                    with os.scandir(self.root_dir / directory) as entries:
+                        for entry in entries:
+                            path = _join(directory, entry.name)
+                            if entry.is_dir(follow_symlinks=False):
+                                if not _excluded(path) and not self.hook.ignore.match(
+                                    path + "/"
+                                ):
+                                    next_level.append(path)
+                            else:
+                                files.append(path)
+                except (FileNotFoundError, NotADirectoryError):
+                    continue
+            level = next_level
+        return files
+
+    def __filter(self, paths: Iterable[str]) -> list[str]:
+        paths = [
+            path
+            for path in paths
+            if not _excluded(path) and not self.hook.ignore.match(path)
+        ]
+        ignored = ignored_paths(self.root_dir, paths)
+        files = []
+        for path in sorted(set(paths) - ignored):
+            try:
+                # Symlinks don't have content to mask.
+                if stat.S_ISREG(os.lstat(self.root_dir / path).st_mode):
+                    files.append(path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        return files
+
+    def __chunks(self, file, hasher, size: int) -> Iterator[bytes]:
+        from .hooks.mask import STREAM_CHUNK_SIZE
+
+        read = 0
+        for chunk in iter(lambda: file.read(STREAM_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+            read += len(chunk)
+            yield chunk
+        if read != size:
+            raise InterruptedError()
+
+    def __scan_file(self, path: str) -> Optional[tuple[str, Optional[bool]]]:
+        """Returns the blob sha of the file and if it needs masking.
+
+        The same content is hashed and scanned, and it isn't scanned (None) if its
+        sha is already in the cache. Returns None if the file changed or was removed
+        while it was read, its next event scans it again.
+        """
+        from .cache import CLEAN, NEEDS_MASKING
+        from .hooks.mask import _mask_content, _stream_needs_masking
+
+        hook = self.hook
+        try:
+            with (self.root_dir / path).open(mode="rb") as file:
+                size = os.fstat(file.fileno()).st_size
+                if hook.stream_threshold and hook.matcher.streamable:
+                    if size > hook.stream_threshold:
+                        # Large files are hashed and scanned in a single pass.
+                        hasher = blob_hasher(size)
+                        chunks = self.__chunks(file, hasher, size)
+                        needs_masking = _stream_needs_masking(
+                            hook.matcher, chunks, hook.binary
+                        )
+                        # The rest of the file is only hashed.
+                        for _ in chunks:
+                            pass
+                        return hasher.hexdigest(), needs_masking
+                content = file.read()
+        except (OSError, InterruptedError):
+            return None
+        hasher = blob_hasher(len(content))
+        hasher.update(content)
+        sha = hasher.hexdigest()
+        if self.cache.lookup([sha]).get(sha) in [CLEAN, NEEDS_MASKING]:
+            return sha, None
+        return sha, _mask_content(hook.matcher, content, hook.binary) is not None
+
+    def __scan(self, paths: Iterable[str]) -> None:
+        from .cache import CLEAN, NEEDS_MASKING
+
+        start = time.perf_counter()
+        scanned = cached = found = 0
+        for path in self.__filter(paths):
+            result = self.__scan_file(path)
+            if result is None:
+                continue
+            sha, needs_masking = result
+            if needs_masking is None:
+                cached += 1
+                continue
+            self.cache.store(sha, NEEDS_MASKING if needs_masking else CLEAN)
+            scanned += 1
+            found += needs_masking
+            if scanned % FLUSH_EVERY == 0:
+                self.cache.flush()
+        self.cache.flush()
+        if scanned:
+            elapsed = time.perf_counter() - start
+            files_text = f"{scanned} file" + ("s" if scanned > 1 else "")
+            print(
+                PrettyOutput.info(
+                    f"[WATCH] {files_text} scanned ({found} to mask, {cached} "
+                    f"already scanned) in {elapsed:.2f}s."
+                )
+            )
+
+    def __reload(self) -> bool:
+        """Loads mask.config again. Returns False if it isn't valid."""
+        from .exceptions import NoConfigurationFileFound
+
+        try:
+            hook = self.__load()
+        except NoConfigurationFileFound as e:
+            print(e)
+            return False
+        except SystemExit:
+            # The error was reported by the hook.
+            return False
+        if not hook.cache_size:
+            print(
+                PrettyOutput.error("[WATCH] The scan cache is disabled (cache_size).")
+            )
+            return False
+        self.cache.close()
+        self.hook = hook
+        self.cache = hook.open_scan_cache()
+        print(PrettyOutput.info("[WATCH] mask.config changed, reloaded."))
+        return True
+
+    def __process(self, paths: set[str], directories: set[str], resync: bool) -> None:
+        reload = "mask.config" in paths
+        if reload and self.__config_state() != self.config_state and self.__reload():
+            # The files are scanned again with the new secrets.
+            paths.update(changed_paths(self.root_dir))
+        if directories:
+            found = self.__watch(directories)
+            if found is None:
+                print(PrettyOutput.warning("[WATCH] Too many directories to watch."))
+            else:
+                # Files written before their directory was watched.
+                paths.update(found)
+        if resync or any(path.rsplit("/", 1)[-1] == ".gitignore" for path in paths):
+            # Directories may not be ignored anymore (or their events were lost).
+            if not self.__watch_tree():
+                print(PrettyOutput.warning("[WATCH] Too many directories to watch."))
+        self.__scan(paths)
+
+    def run(self, stop: Optional[threading.Event] = None) -> int:
+        """Watches the working tree until 'stop' is set (or a KeyboardInterrupt)."""
+        if not self.hook.cache_size:
+            print(
+                PrettyOutput.error("[WATCH] The scan cache is disabled (cache_size).")
+            )
+            return 1
+        stop = stop or threading.Event()
+        self.cache = self.hook.open_scan_cache()
+        try:
+            self.__open_source()
+            print(
+                PrettyOutput.info(
+                    f"[WATCH] Watching {self.root_dir} ({self.source.name}, "
+                    f"{len(self.source)} directories)."
+                )
+            )
+            # The files that changed before the watcher started.
+            paths, directories = set(changed_paths(self.root_dir)), set()
+            resync = False
+            first = last = time.monotonic() if paths else None
+            self.ready.set()
+            while not stop.is_set():
+                timeout = WAIT_TIMEOUT
+                if first is not None:
+                    deadline = min(last + self.debounce, first + MAX_DELAY)
+                    timeout = min(max(deadline - time.monotonic(), 0), timeout)
+                changes = self.source.read(timeout)
+                now = time.monotonic()
+                if changes is None:
+                    # Events were lost, everything that changed is scanned.
+                    paths.update(changed_paths(self.root_dir))
+                    changes = []
+                    resync = True
+                    last = now
+                for path, is_directory in changes:
+                    if _excluded(path):
+                        continue
+                    (directories if is_directory else paths).add(path)
+                    last = now
+                if first is None and (paths or directories or resync):
+                    first = now
+                if first is None:
+                    continue
+                if now >= last + self.debounce or now >= first + MAX_DELAY:
+                    self.__process(paths, directories, resync)
+                    paths, directories, first = set(), set(), None
+                    resync = False
+        finally:
+            self.ready.set()
+            if self.source is not None:
+                self.source.close()
+            self.cache.close()
+        return 0
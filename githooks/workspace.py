@@ -0,0 +1,148 @@
+import os
+import pathlib
+from collections import Counter
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from .exceptions import NoConfigurationFileFound
+from .report import TextReport
+from .utils import PrettyOutput
+
+# How deep the repos are looked for under the workspace directory.
+MAX_DEPTH = 4
+# Number of repos handled at the same time.
+MAX_WORKERS = 8
+
+
+def discover_repos(
+    workspace: pathlib.Path, max_depth: int = MAX_DEPTH
+) -> list[pathlib.Path]:
+    """Returns the git repos under the workspace, without running git.
+
+    A directory with a '.git' entry (a directory, or a file for the worktrees and
+    the submodules) is a repo. The walk doesn't enter the repos, the hidden
+    directories and the symlinks, and stops 'max_depth' levels below the workspace.
+    """
+    repos = []
+    level = [workspace]
+    for _ in range(max_depth + 1):
+        next_level = []
+        for directory in level:
+            try:
+                with os.scandir(directory) as entries:
+                    entries = [*entries]
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+            if any(entry.name == ".git" for entry in entries):
+                repos.append(pathlib.Path(directory))
+                continue
+            next_level += [
+                entry.path
+                for entry in entries
+                if not entry.name.startswith(".")
+                and entry.is_dir(follow_symlinks=False)
+            ]
+        level = next_level
+    return sorted(repos)
+
+
+class WorkspaceReport(TextReport):
+    """Keeps the messages of a repo, they are printed with the workspace results.
+
+    Only the messages of the 'levels' are kept (the errors and warnings by default).
+    """
+
+    def __init__(self, levels: Iterable[str] = ("error", "warning")) -> None:
+        super().__init__(buffered=True)
+        self.levels = [*levels]
+        self.counts = Counter()
+        # The last message of each level.
+        self.last = {}
+
+    def message(self, level: str, text: str) -> None:
+        self.counts[level] += 1
+        self.last[level] = text
+        if level in self.levels:
+            super().message(level, text)
+
+    def close(self) -> None:
+        pass
+
+
+class RepoResult(NamedTuple):
+    repo: pathlib.Path
+    # The command didn't fail in the repo.
+    ok: bool
+    # One line for the results table.
+    summary: str
+    messages: list[str]
+    # The repo doesn't have a mask.config.
+    skipped: bool = False
+
+
+def _run(
+    command: Callable[[pathlib.Path, TextReport], str],
+    repo: pathlib.Path,
+    levels: Iterable[str],
+) -> RepoResult:
+    report = WorkspaceReport(levels)
+    try:
+        summary = command(repo, report)
+    except NoConfigurationFileFound:
+        # The repos without the mask hook aren't failures.
+        return RepoResult(repo, True, "Skipped (no mask.config)", report.lines, True)
+    except SystemExit as e:
+        # The error was reported by the hook.
+        code = e.code if isinstance(e.code, int) else 1
+        return RepoResult(repo, code == 0, "Failed" if code else "OK", report.lines)
+    except Exception as e:
+        # The exceptions of git-hooks are already formatted.
+        error = str(e) if "[ERROR]" in str(e) else PrettyOutput.error(str(e))
+        return RepoResult(repo, False, "Failed", report.lines + [error])
+    return RepoResult(repo, not report.counts["error"], summary, report.lines)
+
+
+def run_in_repos(
+    repos: list[pathlib.Path],
+    command: Callable[[pathlib.Path, TextReport], str],
+    levels: Iterable[str] = ("error", "warning"),
+    workers: Optional[int] = None,
+) -> list[RepoResult]:
+    """Runs the command in every repo, on a bounded pool of threads.
+
+    The command gets the root of the repo (it never looks it up with git) and the
+    report of the repo, and returns the summary of its result. The messages of the
+    'levels' are kept. The results are in the order of the repos.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers or MAX_WORKERS) as pool:
+        return [*pool.map(lambda repo: _run(command, repo, levels), repos)]
+
+
+def print_results(
+    workspace: pathlib.Path, results: list[RepoResult], column: str
+) -> None:
+    """Prints one table of the results, then the messages of each repo."""
+    names = [
+        str(result.repo.relative_to(workspace)) if result.repo != workspace else "."
+        for result in results
+    ]
+    width = max(len("Repository"), *(len(name) for name in names)) + 2
+    print("Repository".ljust(width) + column)
+    for name, result in zip(names, results):
+        print(name.ljust(width) + result.summary)
+    for name, result in zip(names, results):
+        if result.messages:
+            print(f"\n{name}:")
+            for message in result.messages:
+                print(message)
+    skipped = sum(result.skipped for result in results)
+    if skipped:
+        print(
+            PrettyOutput.warning(
+                f"Skipped {skipped} of {len(results)} repositories without mask.config."
+            )
+        )
+    failed = sum(not result.ok for result in results)
+    if failed:
+        print(PrettyOutput.error(f"Failed in {failed} of {len(results)} repositories."))
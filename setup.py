@@ -1,14 +1,19 @@
 from setuptools import setup, find_packages
 import pathlib
+import re
 
 template_files = [str(file) for file in pathlib.Path("githooks/templates").iterdir()]
+version = re.search(
+    r'__version__ = "(.+)"', pathlib.Path("githooks/__init__.py").read_text()
+).group(1)
 
 setup(
     name="git-hooks",
-    version="0.0.4",
+    version=version,
     packages=find_packages(),
     include_package_data=True,
     install_requires=["Click", "toml", "colorama", "jinja2", "pytest"],
+    extras_require={"detect": ["numpy"]},
     data_files=[("", template_files)],
     entry_points={
         "console_scripts": ["git-hooks = githooks.scripts.git_hooks:cli"],
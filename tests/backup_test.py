@@ -0,0 +1,56 @@
+from githooks.backup import BackupStore, link_file, write_atomic
+from githooks.hooks.mask import MaskGitHook
+
+
+def test_linked_backup_keeps_the_original_content(tmp_path):
+    file = tmp_path / "file.txt"
+    file.write_bytes(b"secret")
+    backup = tmp_path / "_unmasked_file.txt"
+
+    assert link_file(file, backup)
+    write_atomic(file, b"******")
+    assert file.read_bytes() == b"******"
+    assert backup.read_bytes() == b"secret"
+
+
+def test_backup_store_is_deduplicated(tmp_path):
+    store = BackupStore(tmp_path / "backups")
+    first = tmp_path / "first.txt"
+    second = tmp_path / "second.txt"
+    first.write_bytes(b"secret")
+    second.write_bytes(b"secret")
+
+    sha = store.add(first)
+    assert store.add(second) == sha
+    assert store.get(sha).read_bytes() == b"secret"
+    assert len([path for path in store.path.rglob("*") if path.is_file()]) == 1
+
+
+def test_store_fallback_round_trip(tmp_path, capsys, monkeypatch, git):
+    # Neither reflinks nor hard links are supported next to the files.
+    monkeypatch.setattr("githooks.hooks.mask.clone_file", lambda *args: False)
+    monkeypatch.setattr("githooks.hooks.mask.link_file", lambda *args: False)
+    git("init -q")
+    (tmp_path / "mask.config").write_text("[show]\nsecret123 = 2\n")
+    (tmp_path / "a.txt").write_text("a secret123\n")
+    git("add a.txt")
+    MaskGitHook(tmp_path).mask(workers=1)
+    backups = tmp_path / ".git" / "githooks" / "backups"
+    [stored] = [path for path in backups.rglob("*") if path.is_file()]
+    assert f"the unmasked copy of {tmp_path / 'a.txt'} is kept in {stored}" in (
+        capsys.readouterr().out
+    )
+    assert stored.read_text() == "a secret123\n"
+    assert (tmp_path / "a.txt").read_text() == "a *******23\n"
+
+    # Masked again, the copy of the previous run isn't used anymore.
+    (tmp_path / "a.txt").write_text("a *******23 secret123\n")
+    git("add a.txt")
+    MaskGitHook(tmp_path).mask(workers=1)
+    [stored] = [path for path in backups.rglob("*") if path.is_file()]
+    assert stored.read_text() == "a *******23 secret123\n"
+
+    MaskGitHook(tmp_path).reverse_mask(None, workers=1)
+    assert (tmp_path / "a.txt").read_text() == "a secret123 secret123\n"
+    assert "2 secrets were restored in 1 of 1 files" in capsys.readouterr().out
+    assert not [path for path in backups.rglob("*") if path.is_file()]
@@ -0,0 +1,87 @@
+import sys
+
+from githooks.cache import CLEAN, NEEDS_MASKING, ConfigCache, ScanCache
+from githooks.hooks.mask import MaskGitHook
+
+
+def test_scan_cache_is_persistent(tmp_path):
+    cache_path = tmp_path / "scan-cache.db"
+    with ScanCache(cache_path, "a" * 64) as cache:
+        cache.store("1" * 40, CLEAN)
+        cache.store("2" * 40, NEEDS_MASKING)
+
+    with ScanCache(cache_path, "a" * 64) as cache:
+        assert cache.lookup(["1" * 40, "2" * 40, "3" * 40]) == {
+            "1" * 40: CLEAN,
+            "2" * 40: NEEDS_MASKING,
+        }
+
+    # A different mask.config must not reuse the results.
+    with ScanCache(cache_path, "b" * 64) as cache:
+        assert cache.lookup(["1" * 40]) == {}
+
+
+def test_scan_cache_keys_are_salted(tmp_path):
+    cache_path = tmp_path / "scan-cache.db"
+    fingerprint = "0123456789abcdef" * 4
+    with ScanCache(cache_path, fingerprint) as cache:
+        cache.store("1" * 40, CLEAN)
+    assert fingerprint[:16].encode("ascii") not in cache_path.read_bytes()
+    with ScanCache(cache_path, fingerprint) as cache:
+        assert cache.lookup(["1" * 40]) == {"1" * 40: CLEAN}
+
+
+def test_scan_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    cache_path = tmp_path / "scan-cache.db"
+    clock = iter(range(100))
+    monkeypatch.setattr("githooks.cache.time.time", lambda: next(clock))
+    with ScanCache(cache_path, "a" * 64, max_entries=2) as cache:
+        cache.store("1" * 40, CLEAN)
+        cache.store("2" * 40, CLEAN)
+        cache.lookup(["1" * 40])
+        cache.store("3" * 40, CLEAN)
+
+    with ScanCache(cache_path, "a" * 64, max_entries=2) as cache:
+        assert set(cache.lookup(["1" * 40, "2" * 40, "3" * 40])) == {"1" * 40, "3" * 40}
+
+
+def test_config_cache_is_encrypted_and_keyed_on_env_vars(tmp_path, monkeypatch):
+    cache = ConfigCache(tmp_path / "config.cache")
+    config = b"[show]\n{{ MY_SECRET }} = 2\n"
+    monkeypatch.setenv("MY_SECRET", "mySecretValue")
+    cache.store(config, ["MY_SECRET"], {"show": {"mySecretValue": 2}})
+
+    assert b"mySecretValue" not in (tmp_path / "config.cache").read_bytes()
+    assert cache.load(config) == {"show": {"mySecretValue": 2}}
+    assert cache.load(config + b"\n") is None
+
+    monkeypatch.setenv("MY_SECRET", "anotherValue")
+    assert cache.load(config) is None
+
+
+class Removed:
+    pass
+
+
+def test_config_cache_misses_on_another_version(tmp_path, monkeypatch):
+    cache = ConfigCache(tmp_path / "config.cache")
+    cache.store(b"[show]\n", [], {"show": {}})
+    assert cache.load(b"[show]\n") == {"show": {}}
+
+    monkeypatch.setattr(ConfigCache, "version", "0.0.0/0")
+    assert cache.load(b"[show]\n") is None
+    # The cached value can't be unpickled by this version.
+    cache.store(b"[show]\n", [], Removed())
+    monkeypatch.delattr(sys.modules[__name__], "Removed")
+    assert cache.load(b"[show]\n") is None
+
+
+def test_mask_config_includes_templates(tmp_path, git):
+    git("init -q")
+    (tmp_path / "mask.config").write_text('{% include "secrets.toml" %}\n')
+    (tmp_path / "secrets.toml").write_text("[show]\nsecret123 = 2\n")
+    assert MaskGitHook(tmp_path).matcher.mask("secret123") == "*******23"
+
+    # The included templates aren't cached.
+    (tmp_path / "secrets.toml").write_text("[show]\nsecret456 = 2\n")
+    assert MaskGitHook(tmp_path).matcher.mask("secret456") == "*******56"
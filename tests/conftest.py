@@ -1,6 +1,40 @@
+import subprocess
+
 import pytest
 
 
 @pytest.fixture
 def supported_hooks():
     return ["mask"]
+
+
+@pytest.fixture
+def git(tmp_path):
+    """Runs a git command in 'cwd' (tmp_path by default), returns its output."""
+
+    def run(cmd, cwd=None):
+        return (
+            subprocess.run(
+                f"git -c user.name=a -c user.email=a@b {cmd}",
+                shell=True,
+                cwd=cwd or tmp_path,
+                capture_output=True,
+                check=True,
+            )
+            .stdout.decode()
+            .strip()
+        )
+
+    return run
+
+
+@pytest.fixture
+def init_repo(git):
+    """Creates a git repo in the directory, returns its path."""
+
+    def init(path):
+        path.mkdir(parents=True, exist_ok=True)
+        git("init -q", cwd=path)
+        return path
+
+    return init
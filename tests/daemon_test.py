@@ -0,0 +1,64 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from githooks.daemon import MaskDaemon, request, socket_path
+from githooks.hooks.mask import main
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix sockets")
+def test_daemon_masks_and_reloads_the_config(tmp_path, capsys, git):
+    git("init -q")
+    (tmp_path / "mask.config").write_text("[show]\nsecret123 = 2\n")
+    daemon = threading.Thread(target=MaskDaemon(tmp_path, idle_timeout=30).serve)
+    daemon.start()
+    try:
+        while not socket_path(tmp_path).exists():
+            time.sleep(0.01)
+        assert request(tmp_path, "ping") == {"status": 0, "output": ""}
+
+        (tmp_path / "a.txt").write_text("secret123\n")
+        git("add a.txt")
+        assert main(tmp_path) == 0
+        assert (tmp_path / "a.txt").read_text() == "*******23\n"
+        assert "masked in" in capsys.readouterr().out
+
+        # A changed mask.config is loaded again.
+        (tmp_path / "mask.config").write_text("[show]\nother-secret = 0\n")
+        (tmp_path / "b.txt").write_text("other-secret\n")
+        git("add b.txt")
+        assert main(tmp_path) == 0
+        assert (tmp_path / "b.txt").read_text() == "************\n"
+    finally:
+        request(tmp_path, "stop")
+        daemon.join()
+    assert not socket_path(tmp_path).exists()
+    assert request(tmp_path) is None
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs Unix sockets")
+def test_daemon_reloads_the_included_templates(tmp_path, git):
+    git("init -q")
+    (tmp_path / "mask.config").write_text('{% include "show.toml" %}\n')
+    (tmp_path / "show.toml").write_text("[show]\nsecret123 = 2\n")
+    daemon = threading.Thread(target=MaskDaemon(tmp_path, idle_timeout=30).serve)
+    daemon.start()
+    try:
+        while not socket_path(tmp_path).exists():
+            time.sleep(0.01)
+        (tmp_path / "a.txt").write_text("secret123\n")
+        git("add a.txt")
+        assert main(tmp_path) == 0
+        assert (tmp_path / "a.txt").read_text() == "*******23\n"
+
+        # Only the included template changed.
+        (tmp_path / "show.toml").write_text("[show]\nother-secret = 0\n")
+        (tmp_path / "b.txt").write_text("other-secret\n")
+        git("add b.txt")
+        assert main(tmp_path) == 0
+        assert (tmp_path / "b.txt").read_text() == "************\n"
+    finally:
+        request(tmp_path, "stop")
+        daemon.join()
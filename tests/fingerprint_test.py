@@ -0,0 +1,82 @@
+import pytest
+
+from githooks import fingerprint
+from githooks.detect import _load_numpy
+from githooks.fingerprint import (
+    FingerprintSet,
+    format_fingerprint,
+    make_fingerprint,
+    parse_fingerprint,
+)
+from githooks.hooks.mask import MaskGitHook
+from githooks.matcher import SecretMatcher
+
+SALT = "0123456789abcdef"
+VECTORIZED = [False] + ([True] if _load_numpy() else [])
+
+
+def test_fingerprint_entry_round_trip():
+    entry = make_fingerprint("xyz-key-99", 3, SALT)
+    assert entry.length == 10 and entry.suffix == b"-99"
+    assert entry.masked == b"*******-99"
+    assert "xyz-key" not in format_fingerprint(entry)
+    import toml
+
+    table = toml.loads(f"secrets = [{format_fingerprint(entry)}]")
+    assert parse_fingerprint(dict(table["secrets"][0])) == entry
+    assert parse_fingerprint({"length": 3, "check": 1, "hash": "x"}) is None
+
+
+@pytest.mark.parametrize("vectorized", VECTORIZED)
+def test_finds_the_longest_secret_at_each_position(vectorized, monkeypatch):
+    # Small blocks, so the windows across the blocks are checked too.
+    monkeypatch.setattr(fingerprint, "BLOCK_SIZE", 7)
+    secrets = FingerprintSet(
+        [
+            make_fingerprint("token", 0, SALT),
+            make_fingerprint("token-long", 0, SALT),
+            make_fingerprint("key-42", 2, SALT),
+        ],
+        SALT,
+        vectorized=vectorized,
+    )
+    content = b"a token-long key-42 token-longer xkey-42key-42"
+    found = [(start, secret) for start, secret, _ in secrets.find(content)]
+    assert found == [
+        (2, b"token-long"),
+        (13, b"key-42"),
+        (20, b"token-long"),
+        (34, b"key-42"),
+        (40, b"key-42"),
+    ]
+    assert secrets.search(content)
+    assert not secrets.search(b"toke-n and key-4")
+
+
+def test_matcher_masks_the_fingerprinted_secrets():
+    matcher = SecretMatcher(
+        {"secret123": 2},
+        fingerprints=FingerprintSet([make_fingerprint("hidden-one", 3, SALT)], SALT),
+    )
+    assert not matcher.streamable
+    matches = []
+    masked = matcher.mask(b"secret123 hidden-one", matches)
+    assert masked == b"*******23 *******one"
+    assert matches == [(0, b"secret123"), (10, b"hidden-one")]
+    assert matcher.masked(b"hidden-one") == b"*******one"
+    # Text is only searched for the [show] secrets.
+    assert matcher.mask("hidden-one") == "hidden-one"
+
+
+def test_mask_hook_with_fingerprints(tmp_path, git):
+    git("init -q")
+    entry = format_fingerprint(make_fingerprint("tok_ABCDEFGHIJKLMNOP", 0, SALT))
+    (tmp_path / "mask.config").write_text(
+        f'[fingerprints]\nsalt = "{SALT}"\nsecrets = [\n    {entry},\n]\n'
+    )
+    (tmp_path / "a.txt").write_text("key = tok_ABCDEFGHIJKLMNOP\n")
+    git("add a.txt")
+    MaskGitHook(tmp_path).mask(workers=1)
+    assert (tmp_path / "a.txt").read_text() == "key = ********************\n"
+    # Loaded from the config cache.
+    assert MaskGitHook(tmp_path).matcher.search(b"tok_ABCDEFGHIJKLMNOP")
@@ -0,0 +1,152 @@
+import threading
+
+import pytest
+
+from githooks.git import (
+    AddedHunk,
+    BlobReader,
+    changed_paths,
+    ignored_paths,
+    staged_blobs,
+    staged_hunks,
+    update_index,
+)
+from githooks.hooks.mask import MaskGitHook
+
+
+def test_staged_blobs_are_read_from_the_index(tmp_path, git, init_repo):
+    repo = init_repo(tmp_path)
+    (repo / "staged file.txt").write_text("staged")
+    git("add .")
+    (repo / "staged file.txt").write_text("working tree")
+
+    blobs = staged_blobs(repo)
+    assert [blob.path for blob in blobs] == ["staged file.txt"]
+    with BlobReader(repo) as reader:
+        assert [content for _, content in reader.read_many([blobs[0].sha])] == [
+            b"staged"
+        ]
+
+
+def test_staged_blobs_with_special_paths(tmp_path, git, init_repo):
+    repo = init_repo(tmp_path)
+    names = ["with space.txt", "ünïcödé ✓.txt", 'quote"d.txt', "dir/nested file.txt"]
+    for name in names:
+        (repo / name).parent.mkdir(exist_ok=True)
+        (repo / name).write_text(name)
+    git("add .")
+
+    blobs = staged_blobs(repo)
+    assert sorted(blob.path for blob in blobs) == sorted(names)
+    with BlobReader(repo) as reader:
+        contents = dict(reader.read_many(blob.sha for blob in blobs))
+    assert {blob.path: contents[blob.sha] for blob in blobs} == {
+        name: name.encode("utf8") for name in names
+    }
+
+
+def test_empty_staged_set(tmp_path, git, init_repo):
+    repo = init_repo(tmp_path)
+    assert staged_blobs(repo) == []
+    (repo / "a.txt").write_text("committed")
+    git("add a.txt")
+    git("commit -q -m init")
+    assert staged_blobs(repo) == []
+    with BlobReader(repo) as reader:
+        assert [*reader.read_many([])] == []
+
+
+def test_blob_reader_closed_mid_iteration(tmp_path, git, init_repo):
+    repo = init_repo(tmp_path)
+    (repo / "a.txt").write_bytes(b"x" * 16 * 1024)
+    git("add a.txt")
+    sha = staged_blobs(repo)[0].sha
+
+    errors = []
+
+    def read() -> None:
+        # More requests and output than the pipes hold.
+        try:
+            with BlobReader(repo) as reader:
+                for _ in reader.read_many([sha] * 3000):
+                    raise RuntimeError("stopped")
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert errors == ["stopped"]
+
+
+@pytest.mark.parametrize("pipeline", [False, True])
+def test_parallel_scan_matches_serial(tmp_path, git, init_repo, pipeline):
+    def run(workers):
+        repo = init_repo(tmp_path / f"workers-{workers}")
+        (repo / "mask.config").write_text("[show]\nsecret123 = 2\n")
+        for idx in range(20):
+            secret = "secret123" if idx % 3 == 0 else "clean"
+            (repo / f"file {idx} é.txt").write_text(f"{idx} {secret}\n")
+        git("add .", cwd=repo)
+        MaskGitHook(repo).mask(workers=workers, pipeline=pipeline)
+        return git("ls-files -s", cwd=repo), {
+            file.name: file.read_bytes() for file in repo.iterdir() if file.is_file()
+        }
+
+    staged, tree = run(workers=2)
+    assert (staged, tree) == run(workers=1)
+    assert tree["file 0 é.txt"] == b"0 *******23\n"
+
+
+def test_update_index_reports_rejected_paths(tmp_path, init_repo):
+    repo = init_repo(tmp_path)
+    (repo / "with space.txt").write_text("content")
+    (repo / "other.txt").write_text("content")
+
+    rejected = update_index(repo, ["with space.txt", "missing.txt", "other.txt"])
+    assert rejected == ["missing.txt"]
+    assert sorted(blob.path for blob in staged_blobs(repo)) == [
+        "other.txt",
+        "with space.txt",
+    ]
+
+
+def test_changed_and_ignored_paths(tmp_path, git, init_repo):
+    repo = init_repo(tmp_path)
+    (repo / ".gitignore").write_text("build/\n*.log\n")
+    (repo / "tracked.log").write_text("tracked")
+    git("add -f .")
+    (repo / "build").mkdir()
+    (repo / "build" / "out.txt").write_text("ignored")
+    (repo / "new.txt").write_text("untracked")
+    (repo / "tracked.log").write_text("modified")
+
+    assert changed_paths(repo) == ["new.txt", "tracked.log"]
+    # Tracked files are never ignored.
+    assert ignored_paths(repo, ["build/", "a.log", "tracked.log", "new.txt"]) == {
+        "build/",
+        "a.log",
+    }
+
+
+def test_staged_hunks_are_the_added_lines(tmp_path, git, init_repo):
+    repo = init_repo(tmp_path)
+    (repo / "file.txt").write_bytes(b"one\ntwo\nthree\n")
+    (repo / "removed.txt").write_bytes(b"gone\n")
+    git("add .")
+    git("commit -q -m init")
+    (repo / "file.txt").write_bytes(b"zero\none\n2\nthree\nfour")
+    (repo / "removed.txt").unlink()
+    (repo / "new\tfile.txt").write_bytes(b"new\n")
+    git("add -A")
+
+    hunks = {blob.path: hunks for blob, hunks in staged_hunks(repo)}
+    assert hunks == {
+        "file.txt": [
+            AddedHunk(1, 1, b"zero\n"),
+            AddedHunk(3, 1, b"2\n"),
+            AddedHunk(5, 1, b"four"),
+        ],
+        "new\tfile.txt": [AddedHunk(1, 1, b"new\n")],
+    }
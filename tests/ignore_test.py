@@ -0,0 +1,37 @@
+from githooks.git import staged_hunks
+from githooks.ignore import IgnoreMatcher
+
+
+def test_ignore_matcher_patterns():
+    ignore = IgnoreMatcher(
+        ["tests/ignoreme1", "vendor/**", "*.min.js", "build/", "/docs/*.md", "# x"]
+    )
+    assert ignore.match("tests/ignoreme1")
+    assert ignore.match("tests/ignoreme1/inside.txt")
+    assert not ignore.match("tests/ignoreme10")
+    assert not ignore.match("other/tests/ignoreme1")
+    assert ignore.match("vendor/lib/a.py")
+    assert not ignore.match("src/vendor/a.py")
+    assert ignore.match("app.min.js")
+    assert ignore.match("static/js/app.min.js")
+    assert not ignore.match("app.min.jsx")
+    assert ignore.match("build/out.txt")
+    assert ignore.match("src/build/out.txt")
+    assert not ignore.match("build")
+    assert ignore.match("docs/index.md")
+    assert not ignore.match("docs/api/index.md")
+    assert not ignore.match("# x")
+    assert not IgnoreMatcher([]).match("file.txt")
+
+
+def test_ignored_paths_are_excluded_from_the_diff(tmp_path, git):
+    git("init -q")
+    (tmp_path / "vendor" / "lib").mkdir(parents=True)
+    (tmp_path / "vendor" / "lib" / "a.txt").write_text("vendored\n")
+    (tmp_path / "app.min.js").write_text("minified\n")
+    (tmp_path / "app.js").write_text("source\n")
+    git("add .")
+
+    ignore = IgnoreMatcher(["vendor/", "*.min.js"])
+    hunks = staged_hunks(tmp_path, pathspecs=ignore.pathspecs())
+    assert [blob.path for blob, _ in hunks] == ["app.js"]
@@ -0,0 +1,112 @@
+import random
+
+from githooks.matcher import SecretMatcher, is_binary, mask_secret
+
+
+def test_mask_secret():
+    assert mask_secret("123456789", 4) == "*****6789"
+    assert mask_secret("123456789", 0) == "*********"
+
+
+def test_literal_matcher_escapes_keys():
+    matcher = SecretMatcher({"a.c+": 0, "my@email.com": 8})
+    assert matcher.mask("abc+ a.c+ my@email.com") == "abc+ **** ****mail.com"
+
+
+def test_literal_matcher_longest_match_first():
+    matcher = SecretMatcher({"secret": 0, "secret_key": 3, "sec": 1})
+    content = "secret_key secret sec secre"
+    assert matcher.mask(content) == "*******key ****** **c **cre"
+
+
+def test_literal_matcher_nested_prefixes():
+    # Too deep for a trie, every key is a prefix of the longer ones.
+    keys = ["k" * idx + "x" for idx in range(1000)]
+    keys += ["k" * idx for idx in range(1, 1000)]
+    matcher = SecretMatcher({key: 0 for key in keys})
+    content = "k" * 5 + "x " + "k" * 999 + " " + "k" * 1000 + "x"
+    assert matcher.mask(content) == "*" * 6 + " " + "*" * 999 + " " + "*" * 1001
+    assert matcher.mask(b"kkkx k") == b"**** *"
+
+
+def test_key_scanner_matches_like_the_trie(monkeypatch):
+    # Overlapping keys over a small alphabet, searched one by one or in a trie.
+    rng = random.Random(0)
+    keys = {"".join(rng.choices("abc", k=rng.randint(1, 5))): 1 for _ in range(30)}
+    content = "".join(rng.choices("abc ", k=2000))
+    results = []
+    for min_trie_keys in [0, 1000]:
+        monkeypatch.setattr("githooks.matcher.MIN_TRIE_KEYS", min_trie_keys)
+        matcher = SecretMatcher(keys)
+        matches = []
+        masked = matcher.mask(memoryview(content.encode()), matches)
+        assert matcher.mask(content) == masked.decode()
+        results.append((masked, matches, matcher.reversed().mask(masked)))
+    assert results[0] == results[1]
+    assert results[0][1]
+
+
+def test_regex_matcher_keeps_legacy_behavior():
+    matcher = SecretMatcher({"a.c": 0}, regex=True)
+    assert matcher.mask("abc a.c") == "*** ***"
+
+
+def test_empty_matcher():
+    assert SecretMatcher({}).mask("nothing to mask") == "nothing to mask"
+
+
+def test_stream_matches_whole_content():
+    matcher = SecretMatcher({"secret": 0, "secret_key": 3, "my@email.com": 8})
+    content = "secret_key my@email.com xx secret secre" * 5
+    for chunk_size in range(1, 15):
+        chunks = [
+            content[start : start + chunk_size]
+            for start in range(0, len(content), chunk_size)
+        ]
+        assert "".join(matcher.mask_stream(chunks)) == matcher.mask(content)
+        assert matcher.contains_stream(chunks)
+
+
+def test_matches_are_the_masked_offsets():
+    matcher = SecretMatcher({"secret": 0, "secret_key": 3})
+    content = b"secret_key, secret, secret"
+    matches = []
+    assert matcher.mask(content, matches) == b"*******key, ******, ******"
+    assert matches == [(0, b"secret_key"), (12, b"secret"), (20, b"secret")]
+    for chunk_size in range(1, 8):
+        chunks = [
+            content[start : start + chunk_size]
+            for start in range(0, len(content), chunk_size)
+        ]
+        stream_matches = []
+        list(matcher.mask_stream(chunks, stream_matches))
+        assert stream_matches == matches
+
+
+def test_stream_without_secrets():
+    matcher = SecretMatcher({"secret": 0})
+    assert not matcher.contains_stream(["sec", "re", "_t"])
+
+
+def test_bytes_matcher_never_decodes():
+    matcher = SecretMatcher({"sécret": 2, "12345": 0}, utf16=True)
+    content = "latin1 \xe9 12345".encode("latin1") + " sécret".encode("utf8")
+    assert matcher.mask(content) == b"latin1 \xe9 ***** " + "****et".encode("utf8")
+    for encoding in ["utf-16-le", "utf-16-be"]:
+        assert matcher.mask("a sécret".encode(encoding)) == "a ****et".encode(encoding)
+
+
+def test_is_binary():
+    assert is_binary(b"\x89PNG\r\n\x1a\n\0\0")
+    assert not is_binary(b"plain text")
+    assert not is_binary("text".encode("utf-16"))
+
+
+def test_reversed_matcher():
+    matcher = SecretMatcher({"123456789": 4, "abcdef": 0, "uvwxyz": 0})
+    reverse = matcher.reversed()
+    # The longest masked form wins, the first secret of a shared masked form is restored.
+    assert reverse.mask("*****6789 ****** ***") == "123456789 abcdef ***"
+    matches = []
+    assert reverse.mask(b"x *****6789", matches) == b"x 123456789"
+    assert matches == [(2, b"*****6789")]
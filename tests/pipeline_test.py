@@ -0,0 +1,38 @@
+import pytest
+
+from githooks.hooks.mask import MaskGitHook
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_pipeline_matches_serial_mask(tmp_path, workers, git, init_repo):
+    def run(pipeline):
+        repo = init_repo(tmp_path / ("pipeline" if pipeline else "serial"))
+        (repo / "mask.config").write_text(
+            "[show]\nsecret123 = 2\n[options]\nstream_threshold = 4096\n"
+        )
+        for idx in range(40):
+            secret = "secret123" if idx % 3 == 0 else "nothing"
+            (repo / f"f{idx}.txt").write_text(f"{idx} {secret}\n")
+        # Streamed (larger than stream_threshold).
+        (repo / "large.txt").write_text("x" * 5000 + " secret123\n")
+        # Masked in the index only.
+        (repo / "unstaged.txt").write_text("secret123\n")
+        git("add .", cwd=repo)
+        (repo / "unstaged.txt").write_text("secret123\nmore\n")
+
+        MaskGitHook(repo).mask(workers=workers, pipeline=pipeline)
+        staged = git("ls-files -s", cwd=repo)
+        tree = {
+            file.name: file.read_bytes()
+            for file in repo.iterdir()
+            if file.is_file() and file.name != "mask.config"
+        }
+        return staged, tree
+
+    staged, tree = run(pipeline=True)
+    assert (staged, tree) == run(pipeline=False)
+    assert tree["f0.txt"] == b"0 *******23\n"
+    assert tree["_unmasked_f0.txt"] == b"0 secret123\n"
+    assert tree["large.txt"].endswith(b" *******23\n")
+    assert tree["unstaged.txt"] == b"secret123\nmore\n"
+    assert "secret123" not in git("-C pipeline show :unstaged.txt")
@@ -0,0 +1,50 @@
+import pathlib
+import subprocess
+
+import pytest
+from click.testing import CliRunner
+
+import githooks
+from githooks.hooks.mask import main
+from githooks.scripts.git_hooks import cli
+
+
+def test_pre_commit_hook_masks_the_commit(tmp_path, monkeypatch, git):
+    git("init -q")
+    monkeypatch.chdir(tmp_path)
+    result = CliRunner().invoke(cli, ["init", "mask"])
+    assert result.exit_code == 0
+    # The hook imports githooks from the interpreter that ran init.
+    monkeypatch.setenv("PYTHONPATH", str(pathlib.Path(githooks.__file__).parents[1]))
+    (tmp_path / "mask.config").write_text("[show]\nsecret123 = 2\n")
+    (tmp_path / ".gitignore").write_text("mask.config\n")
+    (tmp_path / "a.txt").write_text("key = secret123\n")
+    git("add .gitignore a.txt")
+
+    git("commit -q -m masked")
+    assert git("show HEAD:a.txt") == "key = *******23"
+    assert (tmp_path / "a.txt").read_text() == "key = *******23\n"
+
+    # Without mask.config the commit is blocked.
+    (tmp_path / "mask.config").unlink()
+    (tmp_path / "b.txt").write_text("key = secret123\n")
+    git("add b.txt")
+    with pytest.raises(subprocess.CalledProcessError):
+        git("commit -q -m blocked")
+    assert git("log --format=%s") == "masked"
+
+
+def test_shipped_template_without_its_env_variables(tmp_path, capsys, monkeypatch, git):
+    git("init -q")
+    monkeypatch.delenv("ENV_VAR_1", raising=False)
+    monkeypatch.delenv("ENV_VAR_2", raising=False)
+    template = pathlib.Path(githooks.__file__).parent / "templates" / "mask.config"
+    (tmp_path / "mask.config").write_bytes(template.read_bytes())
+    (tmp_path / "a.txt").write_text("key = 12345678\n")
+    git("add a.txt")
+
+    assert main(tmp_path) == 0
+    assert (tmp_path / "a.txt").read_text() == "key = ****5678\n"
+    assert "Env. variable 'ENV_VAR_2' in mask.config is not set." in (
+        capsys.readouterr().out
+    )
@@ -0,0 +1,51 @@
+import io
+import json
+
+from githooks.hooks.mask import MaskGitHook
+from githooks.report import FileResult, JsonReport, TextReport
+
+
+def test_text_report_is_written_at_once():
+    stream = io.StringIO()
+    with TextReport(stream) as report:
+        report.message("success", "first")
+        report.message("error", "second")
+        assert stream.getvalue() == ""
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    assert "first" in lines[0] and "second" in lines[1]
+
+
+def test_ndjson_report_is_streamed():
+    stream = io.StringIO()
+    with JsonReport(stream, ndjson=True) as report:
+        report.file(FileResult("a.txt", "masked", 10, {"id": 2}, 0.5))
+        assert json.loads(stream.getvalue())["path"] == "a.txt"
+        report.message("error", "failed")
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [record["type"] for record in records] == ["file", "message", "totals"]
+    assert records[-1]["matches"] == 2
+    assert records[-1]["errors"] == 1
+
+
+def test_mask_json_report(tmp_path, git):
+    git("init -q")
+    (tmp_path / "mask.config").write_text("[show]\nsecret123 = 2\n")
+    (tmp_path / "a.txt").write_text("secret123 secret123\n")
+    (tmp_path / "b.txt").write_text("clean\n")
+    git("add a.txt b.txt")
+
+    stream = io.StringIO()
+    with JsonReport(stream) as report:
+        MaskGitHook(tmp_path, report=report).mask(workers=1)
+    output = json.loads(stream.getvalue())
+
+    files = {result["path"]: result for result in output["files"]}
+    assert files["a.txt"]["action"] == "masked"
+    assert files["a.txt"]["size"] == 20
+    assert [*files["a.txt"]["matches"].values()] == [2]
+    assert files["b.txt"]["action"] == "clean"
+    assert output["totals"]["files"] == 2
+    assert output["totals"]["masked"] == 1
+    assert output["totals"]["matches"] == 2
+    assert output["messages"][0]["level"] == "success"
@@ -0,0 +1,68 @@
+from githooks.hooks.mask import MaskGitHook, pre_push
+from githooks.matcher import SecretMatcher
+from githooks.scan import HistoryScan, find_secrets
+
+
+def test_find_secrets_reports_lines():
+    matcher = SecretMatcher({"secret": 0, "multi\nline": 2})
+    content = b"one\nsecret multi\nline\nthree secret\n"
+    expected = [(2, b"******"), (2, b"********ne"), (4, b"******")]
+    assert find_secrets(matcher, content, "skip") == expected
+    for chunk_size in range(1, 10):
+        chunks = [
+            content[start : start + chunk_size]
+            for start in range(0, len(content), chunk_size)
+        ]
+        assert find_secrets(matcher, chunks, "skip") == expected
+    assert find_secrets(matcher, b"secret\0", "skip") == []
+
+
+def test_history_scan_resumes_from_checkpoint(tmp_path, capsys, git):
+    git("init -q")
+    (tmp_path / "mask.config").write_text("[show]\nsecret123 = 2\n")
+    (tmp_path / "a.txt").write_text("one\nsecret123\n")
+    git("add a.txt")
+    git("commit -q -m one")
+    (tmp_path / "a.txt").write_text("clean\n")
+    (tmp_path / "b.txt").write_text("secret123\n")
+    git("add a.txt b.txt")
+    git("commit -q -m two")
+    first = git("rev-list --max-parents=0 HEAD")
+
+    assert HistoryScan(tmp_path, []).run(workers=1) == 2
+    output = capsys.readouterr().out
+    assert f"{first} a.txt:2 *******23" in output
+    assert "3 blobs scanned, 2 secrets found." in output
+    # The hash of the rendered config isn't written in the checkpoint.
+    checkpoint = (tmp_path / ".git" / "githooks" / "history-scan.db").read_bytes()
+    assert MaskGitHook(tmp_path).fingerprint.encode("ascii") not in checkpoint
+
+    # Nothing is scanned again, the hits are reported from the checkpoint.
+    assert HistoryScan(tmp_path, []).run(workers=2, resume=True) == 2
+    output = capsys.readouterr().out
+    assert f"{first} a.txt:2 *******23" in output
+    assert "0 blobs scanned, 2 secrets found." in output
+
+
+def test_pre_push_scans_only_the_pushed_commits(tmp_path, capsys, git):
+    git("init -q")
+    (tmp_path / "mask.config").write_text("[show]\nsecret123 = 2\n")
+    (tmp_path / "old.txt").write_text("secret123\n")
+    git("add old.txt")
+    git("commit -q -m old")
+    remote_sha = git("rev-parse HEAD")
+    (tmp_path / "new.txt").write_text("clean\n")
+    git("add new.txt")
+    git("commit -q -m new")
+    local_sha = git("rev-parse HEAD")
+
+    line = f"refs/heads/main {local_sha} refs/heads/main {remote_sha}"
+    assert pre_push("origin", [line], tmp_path) == 0
+    assert "1 blobs scanned, 0 secrets found." in capsys.readouterr().out
+
+    (tmp_path / "new.txt").write_text("secret123\n")
+    git("commit -q -a -m leak")
+    local_sha = git("rev-parse HEAD")
+    line = f"refs/heads/main {local_sha} refs/heads/main {remote_sha}"
+    assert pre_push("origin", [line], tmp_path) == 1
+    assert "new.txt:1 *******23" in capsys.readouterr().out
@@ -0,0 +1,21 @@
+from githooks.store import UnmaskStore
+
+
+def test_unmask_store_records_positions(tmp_path):
+    with UnmaskStore(tmp_path / "unmask.db") as store:
+        secret_id = store.secret_id(b"hunter2-token")
+        store.record("dir/file.txt", "1" * 40, [(12, secret_id), (0, secret_id)])
+        store.record("regex.txt", "2" * 40, None, backup="3" * 64)
+
+    with UnmaskStore(tmp_path / "unmask.db") as store:
+        # The salt is kept, so the ids are stable across runs.
+        assert store.secret_id(b"hunter2-token") == secret_id
+        assert store.paths() == ["dir/file.txt", "regex.txt"]
+        assert store.file("dir/file.txt") == ("1" * 40, True, None)
+        assert store.masks("dir/file.txt") == [(0, secret_id), (12, secret_id)]
+        assert store.file("regex.txt") == ("2" * 40, False, "3" * 64)
+        store.remove("dir/file.txt")
+        assert store.file("dir/file.txt") is None
+        assert store.masks("dir/file.txt") == []
+
+    assert b"hunter2-token" not in (tmp_path / "unmask.db").read_bytes()
@@ -0,0 +1,52 @@
+import json
+import threading
+
+from githooks.timings import NO_TIMINGS, Timings
+
+
+def test_phases_are_timed_and_counted(tmp_path):
+    timings = Timings(trace=True)
+    with timings.phase("load config"):
+        pass
+    assert [*timings.iterate("scan", ["a", "b"])] == ["a", "b"]
+    with timings.phase("update index", 3):
+        pass
+
+    assert [*timings.phases] == ["load config", "scan", "update index"]
+    assert timings.phases["scan"][1] == 2
+    assert timings.phases["update index"][1] == 3
+    assert "update index" in timings.summary()
+
+    trace = tmp_path / "trace.json"
+    timings.write_trace(trace)
+    events = json.loads(trace.read_text())["traceEvents"]
+    assert [event["name"] for event in events].count("scan") == 3
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events)
+
+
+def test_trace_events_keep_the_thread_of_their_phase(tmp_path):
+    timings = Timings(trace=True)
+    threads = {}
+
+    def scan():
+        with timings.phase("scan"):
+            threads["scan"] = threading.get_ident()
+
+    with timings.phase("mask"):
+        thread = threading.Thread(target=scan)
+        thread.start()
+        thread.join()
+    threads["mask"] = threading.get_ident()
+
+    trace = tmp_path / "trace.json"
+    timings.write_trace(trace)
+    events = json.loads(trace.read_text())["traceEvents"]
+    assert {event["name"]: event["tid"] for event in events} == threads
+    assert threads["scan"] != threads["mask"]
+
+
+def test_disabled_timings_record_nothing():
+    items = ["a", "b"]
+    with NO_TIMINGS.phase("load config"):
+        pass
+    assert NO_TIMINGS.iterate("scan", items) is items
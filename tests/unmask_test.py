@@ -0,0 +1,56 @@
+import pytest
+
+from githooks.hooks.mask import MaskGitHook
+from githooks.report import TextReport
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batch_unmask(tmp_path, capsys, workers, git):
+    git("init -q")
+    (tmp_path / "mask.config").write_text("[show]\nsecret123 = 2\n")
+    for name in ["a.txt", "b.txt", "c.txt"]:
+        (tmp_path / name).write_text(f"{name} secret123 secret123\n")
+    git("add a.txt b.txt c.txt")
+    MaskGitHook(tmp_path).mask(workers=1)
+    # Edited since it was masked, the masked secrets are replaced instead.
+    (tmp_path / "b.txt").write_text("new line\nb.txt *******23\n")
+    # Listed by an older version, without any masked secret.
+    (tmp_path / "clean.txt").write_text("nothing masked\n")
+    (tmp_path / ".ghunmask").write_text(str(tmp_path / "clean.txt"))
+    clean_mtime = (tmp_path / "clean.txt").stat().st_mtime_ns
+    capsys.readouterr()
+
+    with TextReport(buffered=False) as report:
+        MaskGitHook(tmp_path, report=report).reverse_mask(
+            None, workers=workers, dry_run=True
+        )
+    output = capsys.readouterr().out
+    assert "5 secrets would be restored in 3 of 4 files" in output
+    assert (tmp_path / "a.txt").read_text() == "a.txt *******23 *******23\n"
+
+    MaskGitHook(tmp_path).reverse_mask(None, workers=workers)
+    output = capsys.readouterr().out
+    assert (tmp_path / "a.txt").read_text() == "a.txt secret123 secret123\n"
+    assert (tmp_path / "b.txt").read_text() == "new line\nb.txt secret123\n"
+    assert (tmp_path / "c.txt").read_text() == "c.txt secret123 secret123\n"
+    assert "changed since it was masked" in output
+    assert "clean.txt" not in output
+    assert (tmp_path / "clean.txt").stat().st_mtime_ns == clean_mtime
+    assert "5 secrets were restored in 3 of 4 files" in output
+
+
+def test_unmask_after_the_masked_secrets_moved(tmp_path, git):
+    git("init -q")
+    (tmp_path / "mask.config").write_text("[show]\nsecret123 = 2\n")
+    (tmp_path / "a.txt").write_text("A secret123")
+    git("add a.txt")
+    MaskGitHook(tmp_path).mask(workers=1)
+    git("commit -q -m masked")
+    # The new line moves the secret masked by the first run.
+    (tmp_path / "a.txt").write_text("new\nA *******23 secret123")
+    git("add a.txt")
+    MaskGitHook(tmp_path).mask(workers=1)
+    assert (tmp_path / "a.txt").read_text() == "new\nA *******23 *******23"
+
+    MaskGitHook(tmp_path).reverse_mask(None, workers=1)
+    assert (tmp_path / "a.txt").read_text() == "new\nA secret123 secret123"
@@ -0,0 +1,72 @@
+import sys
+import threading
+import time
+
+import pytest
+
+from githooks.cache import CLEAN, NEEDS_MASKING
+from githooks.git import blob_hasher
+from githooks.hooks.mask import MaskGitHook
+from githooks.watch import MaskWatcher
+
+
+def blob_sha(content: bytes) -> str:
+    hasher = blob_hasher(len(content))
+    hasher.update(content)
+    return hasher.hexdigest()
+
+
+@pytest.mark.parametrize(
+    "poll",
+    [
+        True,
+        pytest.param(
+            False,
+            marks=pytest.mark.skipif(
+                not sys.platform.startswith("linux"), reason="needs inotify"
+            ),
+        ),
+    ],
+)
+def test_watcher_records_the_saved_files(tmp_path, tmp_path_factory, poll, git):
+    git("init -q")
+    (tmp_path / "mask.config").write_text(
+        '[show]\nsecret123 = 2\n\n[ignore]\nfiles=["skip.txt"]\n'
+    )
+    (tmp_path / ".gitignore").write_text("mask.config\nbuild/\n")
+    (tmp_path / "build").mkdir()
+    (tmp_path / "before.txt").write_text("saved before\n")
+
+    watcher = MaskWatcher(tmp_path, debounce=0.05, poll=poll, interval=0.1)
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop,))
+    thread.start()
+    try:
+        watcher.ready.wait(10)
+        (tmp_path / "a.txt").write_text("secret123\n")
+        # The files of a directory moved into the working tree are found too.
+        outside = tmp_path_factory.mktemp("outside")
+        (outside / "moved" / "deep").mkdir(parents=True)
+        (outside / "moved" / "deep" / "b.txt").write_text("clean\n")
+        (outside / "moved").rename(tmp_path / "moved")
+        (tmp_path / "skip.txt").write_text("skipped\n")
+        (tmp_path / "build" / "c.txt").write_text("gitignored\n")
+
+        shas = {
+            blob_sha(b"saved before\n"): CLEAN,
+            blob_sha(b"secret123\n"): NEEDS_MASKING,
+            blob_sha(b"clean\n"): CLEAN,
+        }
+        hook = MaskGitHook(tmp_path)
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            with hook.open_scan_cache() as cache:
+                if cache.lookup(shas) == shas:
+                    break
+            time.sleep(0.1)
+    finally:
+        stop.set()
+        thread.join()
+    with hook.open_scan_cache() as cache:
+        assert cache.lookup(shas) == shas
+        assert not cache.lookup([blob_sha(b"skipped\n"), blob_sha(b"gitignored\n")])
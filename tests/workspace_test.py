@@ -0,0 +1,64 @@
+from click.testing import CliRunner
+
+from githooks.scripts.git_hooks import cli
+from githooks.workspace import discover_repos
+
+
+def test_discover_repos(tmp_path, init_repo):
+    api = init_repo(tmp_path / "services" / "api")
+    web = init_repo(tmp_path / "services" / "web")
+    # Nested repos, hidden directories and deep directories aren't walked.
+    init_repo(api / "vendor" / "nested")
+    init_repo(tmp_path / ".cache" / "repo")
+    init_repo(tmp_path / "a" / "b" / "c" / "d" / "e" / "deep")
+    worktree = tmp_path / "worktree"
+    worktree.mkdir()
+    (worktree / ".git").write_text("gitdir: ../services/api/.git/worktrees/x\n")
+
+    assert discover_repos(tmp_path) == [api, web, worktree]
+
+
+def test_workspace_commands(tmp_path, git, init_repo):
+    init_repo(tmp_path / "api")
+    init_repo(tmp_path / "web")
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ["status", "--workspace", str(tmp_path)])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        "Repository  mask",
+        "api         Not initialized",
+        "web         Not initialized",
+    ]
+    result = runner.invoke(cli, ["init", "mask", "--workspace", str(tmp_path)])
+    assert result.exit_code == 0
+    assert (tmp_path / "web" / ".git" / "hooks" / "pre-commit").exists()
+    assert (tmp_path / "web" / "mask.config").exists()
+
+    result = runner.invoke(cli, ["disable", "mask", "--workspace", str(tmp_path)])
+    assert "api         Disabled" in result.output.splitlines()
+
+    # A failure in one repo is reported and doesn't stop the others.
+    (tmp_path / "api" / "mask.config").write_text("[show]\nsecret123 = 2\n")
+    (tmp_path / "api" / "a.txt").write_text("secret123\n")
+    git("add a.txt", cwd=tmp_path / "api")
+    (tmp_path / "web" / "mask.config").write_text("[show\n")
+    # A repo without the mask hook is skipped.
+    init_repo(tmp_path / "docs")
+    result = runner.invoke(cli, ["exec", "mask", "--workspace", str(tmp_path)])
+    assert result.exit_code == 1
+    lines = result.output.splitlines()
+    assert lines[:4] == [
+        "Repository  exec mask",
+        "api         1 file masked",
+        "docs        Skipped (no mask.config)",
+        "web         Failed",
+    ]
+    assert (tmp_path / "api" / "a.txt").read_text() == "*******23\n"
+    assert "Skipped 1 of 3 repositories without mask.config." in lines[-2]
+    assert "Failed in 1 of 3 repositories." in lines[-1]
+
+    result = runner.invoke(
+        cli, ["exec", "mask", "--workers", "2", "--workspace", str(tmp_path)]
+    )
+    assert result.exit_code == 2